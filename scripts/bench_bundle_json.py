@@ -0,0 +1,48 @@
+"""
+Benchmark for assembling the snippets JSON of bundles.
+
+Compares serializing and escaping the whole list of snippets, as
+bundles used to, against joining the cached escaped fragments of every
+snippet, for growing numbers of snippets. Uses the enabled snippets in
+the configured database, repeated as needed. Run with:
+
+    ./manage.py runscript bench_bundle_json
+"""
+from __future__ import print_function
+import itertools
+import json
+import timeit
+
+from django.utils.html import escapejs
+
+from snippets.base.models import SnippetBundle, escaped_snippets_json
+
+
+NUMBER = 20
+SIZES = [1, 5, 10, 25, 50, 100]
+
+
+def bench(function, snippets):
+    """Return the average time per call of function(snippets) in milliseconds."""
+    seconds = timeit.timeit(lambda: function(snippets), number=NUMBER)
+    return seconds / NUMBER * 1000
+
+
+def serialize(snippets):
+    return escapejs(json.dumps([snippet.to_dict() for snippet in snippets]))
+
+
+def run():
+    available = list(SnippetBundle._snippet_queryset())
+    if not available:
+        print('No enabled snippets in the database.')
+        return
+
+    print('{0:<10}{1:>14}{2:>14}{3:>10}'.format('snippets', 'serialize', 'fragments', 'speedup'))
+    for size in SIZES:
+        snippets = list(itertools.islice(itertools.cycle(available), size))
+        assert serialize(snippets) == escaped_snippets_json(snippets)
+        serialize_time = bench(serialize, snippets)
+        fragments_time = bench(escaped_snippets_json, snippets)
+        print('{0:<10}{1:>12.2f}ms{2:>12.2f}ms{3:>9.1f}x'.format(
+            size, serialize_time, fragments_time, serialize_time / fragments_time))
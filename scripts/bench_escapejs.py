@@ -0,0 +1,45 @@
+"""
+Benchmark for escaping the snippets JSON of bundles.
+
+Compares django.utils.html.escapejs with snippets.base.util.escapejs on
+bundle payloads of growing size, built from the enabled snippets in the
+configured database, repeated as needed. Run with:
+
+    ./manage.py runscript bench_escapejs
+"""
+from __future__ import print_function
+import itertools
+import json
+import timeit
+
+from django.utils import html
+
+from snippets.base import util
+from snippets.base.models import SnippetBundle
+
+
+NUMBER = 20
+SIZES = [10, 50, 100, 500, 1000]
+
+
+def bench(function, payload):
+    """Return the average time per call of function(payload) in milliseconds."""
+    seconds = timeit.timeit(lambda: function(payload), number=NUMBER)
+    return seconds / NUMBER * 1000
+
+
+def run():
+    available = [snippet.to_dict() for snippet in SnippetBundle._snippet_queryset()]
+    if not available:
+        print('No enabled snippets in the database.')
+        return
+
+    print('{0:<10}{1:>12}{2:>12}{3:>12}{4:>10}'.format(
+        'snippets', 'payload', 'django', 'util', 'speedup'))
+    for size in SIZES:
+        payload = json.dumps(list(itertools.islice(itertools.cycle(available), size)))
+        assert html.escapejs(payload) == util.escapejs(payload)
+        django_time = bench(html.escapejs, payload)
+        util_time = bench(util.escapejs, payload)
+        print('{0:<10}{1:>10}KB{2:>10.2f}ms{3:>10.2f}ms{4:>9.1f}x'.format(
+            size, len(payload) // 1024, django_time, util_time, django_time / util_time))
@@ -0,0 +1,53 @@
+"""
+Benchmark for serving the snippet runtime as a static file.
+
+Renders bundles with the runtime inlined and with it referenced as an
+external file (SNIPPET_EXTERNAL_RUNTIME), for both bundle templates and
+growing numbers of snippets, and reports bundle sizes and rendering
+times. Uses the enabled snippets in the configured database, repeated
+as needed; the runtime files are saved to the default storage. Run
+with:
+
+    ./manage.py runscript bench_external_runtime
+"""
+from __future__ import print_function
+import itertools
+import timeit
+
+from django.test.utils import override_settings
+
+from snippets.base.models import Client, SnippetBundle
+
+
+NUMBER = 20
+SIZES = [0, 1, 10, 50]
+STARTPAGE_VERSIONS = ['4', '5']
+
+
+def bench(bundle):
+    """Return the bundle size in bytes and its render time in milliseconds."""
+    size = len(bundle.render())
+    seconds = timeit.timeit(bundle.render, number=NUMBER)
+    return size, seconds / NUMBER * 1000
+
+
+def run():
+    available = list(SnippetBundle._snippet_queryset())
+    if not available:
+        print('No enabled snippets in the database.')
+        return
+
+    print('{0:<20}{1:>24}{2:>24}'.format('', 'bundle size', 'render time'))
+    print('{0:<10}{1:<10}{2:>12}{3:>12}{4:>12}{5:>12}'.format(
+        'startpage', 'snippets', 'inline', 'external', 'inline', 'external'))
+    for startpage_version, count in itertools.product(STARTPAGE_VERSIONS, SIZES):
+        client = Client(startpage_version, 'Firefox', '50.0', '20161208153507',
+                        'WINNT_x86-msvc', 'en-US', 'release', 'Windows_NT 6.1',
+                        'default', 'default')
+        bundle = SnippetBundle(client, list(itertools.islice(itertools.cycle(available), count)))
+        with override_settings(SNIPPET_EXTERNAL_RUNTIME=False):
+            inline_size, inline_time = bench(bundle)
+        with override_settings(SNIPPET_EXTERNAL_RUNTIME=True):
+            external_size, external_time = bench(bundle)
+        print('{0:<10}{1:<10}{2:>11}B{3:>11}B{4:>10.2f}ms{5:>10.2f}ms'.format(
+            startpage_version, count, inline_size, external_size, inline_time, external_time))
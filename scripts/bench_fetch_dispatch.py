@@ -0,0 +1,53 @@
+"""
+Micro-benchmarks for the dispatch of FetchSnippetsMiddleware.
+
+Compares matching fetch URLs in the middleware against resolving the
+same paths with the urlconf, for requests that hit a fetch view and
+requests that miss. Run with:
+
+    ./manage.py runscript bench_fetch_dispatch
+"""
+from __future__ import print_function
+import timeit
+
+from django.core.urlresolvers import Resolver404, resolve
+
+from snippets.base.middleware import FetchSnippetsMiddleware
+
+
+NUMBER = 20000
+
+CLIENT_PATH = ('4/Firefox/23.0a1/20130510041606/Darwin_Universal-gcc3/en-US/release/'
+               'Darwin%2010.8.0/default/default_version/')
+
+PATHS = [
+    ('hit: fetch', '/' + CLIENT_PATH),
+    ('hit: json', '/json/' + CLIENT_PATH),
+    ('hit: batch', '/batch-fetch/'),
+    ('miss: admin', '/admin/base/snippet/42/'),
+    ('miss: static', '/static/css/main.css'),
+    ('miss: healthz', '/healthz/'),
+]
+
+
+def resolve_path(path):
+    try:
+        return resolve(path)
+    except Resolver404:
+        return None
+
+
+def bench(function, path):
+    """Return the average time per call of function(path) in microseconds."""
+    seconds = timeit.timeit(lambda: function(path), number=NUMBER)
+    return seconds / NUMBER * 1e6
+
+
+def run():
+    middleware = FetchSnippetsMiddleware()
+    print('{0:<16}{1:>12}{2:>12}{3:>10}'.format('path', 'resolve', 'match', 'speedup'))
+    for name, path in PATHS:
+        resolve_time = bench(resolve_path, path)
+        match_time = bench(middleware.match, path)
+        print('{0:<16}{1:>10.2f}us{2:>10.2f}us{3:>9.1f}x'.format(
+            name, resolve_time, match_time, resolve_time / match_time))
@@ -0,0 +1,43 @@
+"""
+Micro-benchmark for the release information used by fetch and preview
+views.
+
+Compares deriving the current Firefox version from product details on
+every request, as the views used to, against reading it from the
+memoized release_info. Run with:
+
+    ./manage.py runscript bench_release_info
+"""
+from __future__ import print_function
+import timeit
+
+from product_details import product_details
+from product_details.version_compare import version_list
+
+from snippets.base.releases import release_info
+
+
+NUMBER = 2000
+
+
+def per_request():
+    return version_list(product_details.firefox_history_major_releases)[0].split('.', 1)[0]
+
+
+def memoized():
+    return release_info.current_version
+
+
+def bench(function):
+    """Return the average time per call of function() in microseconds."""
+    seconds = timeit.timeit(function, number=NUMBER)
+    return seconds / NUMBER * 1e6
+
+
+def run():
+    assert per_request() == memoized()
+    per_request_time = bench(per_request)
+    memoized_time = bench(memoized)
+    print('{0:<16}{1:>12}{2:>12}{3:>10}'.format('', 'per-request', 'memoized', 'speedup'))
+    print('{0:<16}{1:>10.2f}us{2:>10.2f}us{3:>9.1f}x'.format(
+        'current version', per_request_time, memoized_time, per_request_time / memoized_time))
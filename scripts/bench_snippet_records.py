@@ -0,0 +1,57 @@
+"""
+Benchmark for loading the snippets of bundles.
+
+Compares loading full Snippet model instances, as bundles used to,
+against loading compact SnippetRecord rows, reporting the time per
+load and the approximate memory held by the loaded snippets. Uses the
+enabled snippets in the configured database. Run with:
+
+    ./manage.py runscript bench_snippet_records
+"""
+from __future__ import print_function
+import sys
+import timeit
+
+from snippets.base.managers import filter_available
+from snippets.base.models import Snippet
+
+
+NUMBER = 50
+
+
+def deep_size(obj, seen=None):
+    """Return the approximate size in bytes of obj and everything it refers to."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, name, None), seen) for name in obj.__slots__)
+    return size
+
+
+def load_models():
+    return filter_available(list(
+        Snippet.cached_objects.filter(disabled=False).order_by('priority')))
+
+
+def load_records():
+    return filter_available(
+        Snippet.cached_objects.filter(disabled=False).order_by('priority').records())
+
+
+def run():
+    print('{0:<10}{1:>10}{2:>12}{3:>14}'.format('kind', 'snippets', 'time', 'memory'))
+    for name, load in (('models', load_models), ('records', load_records)):
+        snippets = load()
+        seconds = timeit.timeit(load, number=NUMBER)
+        print('{0:<10}{1:>10}{2:>10.2f}ms{3:>8.1f} KB'.format(
+            name, len(snippets), seconds / NUMBER * 1000, deep_size(snippets) / 1024.0))
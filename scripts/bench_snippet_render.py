@@ -0,0 +1,46 @@
+"""
+Benchmark for rendering snippets.
+
+Compares rendering the enabled snippets of the configured database with
+the parsed template data and wrapper attributes computed on every call,
+as they used to be, against rendering them from render_data_cache and
+render_attrs_cache. Run with:
+
+    ./manage.py runscript bench_snippet_render
+"""
+from __future__ import print_function
+import timeit
+
+from snippets.base.models import SnippetBundle, render_attrs_cache, render_data_cache
+
+
+NUMBER = 20
+
+
+def render_uncached(snippets):
+    for snippet in snippets:
+        render_data_cache.clear()
+        render_attrs_cache.clear()
+        snippet.render()
+
+
+def render_cached(snippets):
+    for snippet in snippets:
+        snippet.render()
+
+
+def run():
+    snippets = list(SnippetBundle._snippet_queryset())
+    if not snippets:
+        print('No enabled snippets in the database.')
+        return
+
+    times = []
+    for function in (render_uncached, render_cached):
+        function(snippets)
+        seconds = timeit.timeit(lambda: function(snippets), number=NUMBER)
+        times.append(seconds / NUMBER / len(snippets) * 1000)
+
+    print('{0} snippets'.format(len(snippets)))
+    print('uncached: {0:.3f}ms per snippet'.format(times[0]))
+    print('cached:   {0:.3f}ms per snippet ({1:.1f}x)'.format(times[1], times[0] / times[1]))
@@ -0,0 +1,68 @@
+"""
+Load test for CSP violation report ingestion.
+
+Posts reports for a few blocked URIs, most of them for the same one as
+happens when a snippet ships a violating resource, through the WSGI
+application for a while. Reports are sent to Sentry as summaries
+flushed in the background; for comparison, the test is repeated
+flushing after every report, which sends a Sentry message per report
+like synchronous capturing does. Requests are made in process, one at
+a time. Run with:
+
+    ./manage.py runscript loadtest_csp
+"""
+from __future__ import print_function
+import itertools
+import json
+import time
+
+from django.test.client import FakePayload, RequestFactory
+
+from snippets.base.csp import csp_reports
+from snippets.wsgi import app
+
+
+DURATION = 10
+
+BLOCKED_URIS = (['https://tracker.example.com/pixel.gif'] * 8 +
+                ['https://cdn.example.com/font.woff', 'inline'])
+
+
+def environs():
+    factory = RequestFactory()
+    for uri in BLOCKED_URIS:
+        body = json.dumps({'csp-report': {'blocked-uri': uri}})
+        environ = factory.post('/csp-violation-capture', body,
+                               content_type='application/csp-report').environ
+        yield environ, body
+
+
+def reports_per_second(application, flush_every_report):
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    sent = csp_reports.sent
+    count = 0
+    start = time.time()
+    for environ, body in itertools.cycle(list(environs())):
+        environ = dict(environ, **{'wsgi.input': FakePayload(body)})
+        result = application(environ, start_response)
+        for chunk in result:
+            pass
+        if hasattr(result, 'close'):
+            result.close()
+        if flush_every_report:
+            csp_reports.flush()
+        count += 1
+        if count % 100 == 0 and time.time() - start > DURATION:
+            break
+    rate = count / (time.time() - start)
+    csp_reports.flush()
+    return rate, count, csp_reports.sent - sent
+
+
+def run():
+    print('{0:<12}{1:>12}{2:>12}{3:>16}'.format('', 'reports/s', 'reports', 'sentry messages'))
+    for name, flush_every_report in [('per report', True), ('aggregated', False)]:
+        rate, count, sent = reports_per_second(app.application, flush_every_report)
+        print('{0:<12}{1:>12.1f}{2:>12}{3:>16}'.format(name, rate, count, sent))
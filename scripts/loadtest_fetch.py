@@ -0,0 +1,67 @@
+"""
+Load test comparing the fetch throughput of the full Django stack with
+the one of FetchApplication in front of it.
+
+Requests are made in process against the WSGI callables, one at a time,
+so the results are requests per second for a single core. Uses the
+snippets in the configured database. Run with:
+
+    ./manage.py runscript loadtest_fetch
+"""
+from __future__ import print_function
+import itertools
+import time
+
+from django.test.client import RequestFactory
+
+from snippets.wsgi import app
+from snippets.wsgi.fetch import FetchApplication
+
+
+DURATION = 10
+
+LOCALES = ['en-US', 'de', 'fr', 'es-ES', 'it']
+CHANNELS = ['release', 'beta', 'aurora', 'nightly']
+# JSON snippets are only served to Fennec.
+SNIPPETS_PATH = ('/4/Firefox/50.0/20161208153507/WINNT_x86-msvc/{locale}/{channel}/'
+                 'Windows_NT%206.1/default/default/')
+JSON_PATH = ('/json/1/Fennec/50.0/20161208153507/Android_arm-eabi/{locale}/{channel}/'
+             'Android/default/default/')
+
+
+def environs(path):
+    factory = RequestFactory()
+    return [factory.get(path.format(locale=locale, channel=channel)).environ
+            for locale, channel in itertools.product(LOCALES, CHANNELS)]
+
+
+def requests_per_second(application, environs):
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    count = 0
+    start = time.time()
+    for environ in itertools.cycle(environs):
+        result = application(dict(environ), start_response)
+        for chunk in result:
+            pass
+        if hasattr(result, 'close'):
+            result.close()
+        count += 1
+        if count % 100 == 0 and time.time() - start > DURATION:
+            break
+    return count / (time.time() - start)
+
+
+def run():
+    stack = app.application
+    if isinstance(stack, FetchApplication):
+        stack = stack.application
+    fast = FetchApplication(stack)
+
+    print('{0:<10}{1:>14}{2:>14}{3:>10}'.format('fetch', 'django req/s', 'fast req/s', 'speedup'))
+    for name, path in [('snippets', SNIPPETS_PATH), ('json', JSON_PATH)]:
+        django_rps = requests_per_second(stack, environs(path))
+        fast_rps = requests_per_second(fast, environs(path))
+        print('{0:<10}{1:>14.1f}{2:>14.1f}{3:>9.1f}x'.format(
+            name, django_rps, fast_rps, fast_rps / django_rps))
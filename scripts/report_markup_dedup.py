@@ -0,0 +1,50 @@
+"""
+Size report for deduplicating the markup of snippets in bundles.
+
+Builds the snippets JSON of a bundle holding every enabled snippet in
+the configured database, with and without sharing identical rendered
+templates, and prints the raw and gzipped sizes of both. Run with:
+
+    ./manage.py runscript report_markup_dedup
+"""
+from __future__ import print_function
+import gzip
+import json
+from StringIO import StringIO
+
+from django.test.utils import override_settings
+
+from snippets.base.models import SnippetBundle, escaped_bundle_json
+
+
+def gzipped_size(content):
+    output = StringIO()
+    with gzip.GzipFile(fileobj=output, mode='wb') as gzip_file:
+        gzip_file.write(content.encode('utf-8'))
+    return len(output.getvalue())
+
+
+def bundle_json(snippets, deduplicate):
+    with override_settings(SNIPPET_DEDUPLICATE_MARKUP=deduplicate):
+        snippets_json, markup_json = escaped_bundle_json(snippets)
+    return snippets_json + markup_json, markup_json
+
+
+def run():
+    snippets = list(SnippetBundle._snippet_queryset())
+    if not snippets:
+        print('No enabled snippets in the database.')
+        return
+
+    full, _ = bundle_json(snippets, False)
+    deduplicated, markup_json = bundle_json(snippets, True)
+    shared = len(json.loads(json.loads(u'"{0}"'.format(markup_json))))
+    print('{0} snippets, {1} distinct shared markup entries'.format(len(snippets), shared))
+
+    print('{0:<14}{1:>12}{2:>12}'.format('', 'raw', 'gzipped'))
+    for name, content in [('full', full), ('deduplicated', deduplicated)]:
+        print('{0:<14}{1:>12}{2:>12}'.format(name, len(content), gzipped_size(content)))
+    print('{0:<14}{1:>11.1f}%{2:>11.1f}%'.format(
+        'saved',
+        100.0 * (len(full) - len(deduplicated)) / len(full),
+        100.0 * (gzipped_size(full) - gzipped_size(deduplicated)) / gzipped_size(full)))
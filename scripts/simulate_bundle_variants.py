@@ -0,0 +1,123 @@
+"""
+Simulator for splitting bundles into weighted variants.
+
+Splits a bundle holding every enabled snippet in the configured
+database into SNIPPET_BUNDLE_VARIANTS variants of
+SNIPPET_BUNDLE_VARIANT_SIZE slots, 4 of 10 if disabled. Snippets that
+the runtime shows to some clients only are in every variant, and the
+simulated clients filter none of them out. Prints:
+
+- the exact odds of showing each snippet with the variants of the
+  first round of the bundle and averaged over all of its rounds, next
+  to the odds of picking from all of its snippets by weight,
+- a chi-square test of snippets shown by clients picking a random
+  variant and then a snippet by weight, over bundles sampled with
+  random seeds and rounds,
+- the size of the snippets JSON of the whole bundle and of its
+  variants.
+
+Run with:
+
+    ./manage.py runscript simulate_bundle_variants
+"""
+from __future__ import division, print_function
+import math
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from snippets.base.models import Client, SnippetBundle, escaped_bundle_json, split_variants
+
+
+IMPRESSIONS = 200000
+
+
+def pick(weights, rng):
+    """Pick a snippet ID by weight, like the snippet runtime does."""
+    number = rng.random() * sum(weights.values())
+    for snippet_id, weight in sorted(weights.items()):
+        number -= weight
+        if number < 0:
+            return snippet_id
+    return snippet_id
+
+
+def exact_odds(variants):
+    """Return the odds of showing each snippet by snippet ID."""
+    odds = Counter()
+    for weights in variants:
+        total = sum(weights.values())
+        for snippet_id, weight in weights.items():
+            odds[snippet_id] += weight / total / len(variants)
+    return odds
+
+
+def chi_square_z(observed, expected):
+    """
+    Return the chi-square statistic of observed counts and its
+    Wilson-Hilferty normal approximation, which is within a few units of
+    0 when counts follow the expected odds.
+    """
+    statistic = sum((observed[key] - count) ** 2 / count for key, count in expected.items())
+    freedom = len(expected) - 1
+    z = (((statistic / freedom) ** (1 / 3) - (1 - 2 / (9 * freedom))) /
+         math.sqrt(2 / (9 * freedom)))
+    return statistic, z
+
+
+def run():
+    snippets = list(SnippetBundle._snippet_queryset())
+    if len(snippets) < 2:
+        print('Not enough enabled snippets in the database.')
+        return
+
+    count = settings.SNIPPET_BUNDLE_VARIANTS if settings.SNIPPET_BUNDLE_VARIANTS > 1 else 4
+    size = settings.SNIPPET_BUNDLE_VARIANT_SIZE if settings.SNIPPET_BUNDLE_VARIANTS > 1 else 10
+    total = sum(snippet.weight for snippet in snippets)
+    expected = dict((snippet.id, snippet.weight / total) for snippet in snippets)
+    rounds = settings.SNIPPET_BUNDLE_VARIANT_ROUNDS
+
+    with override_settings(SNIPPET_BUNDLE_VARIANTS=count, SNIPPET_BUNDLE_VARIANT_SIZE=size):
+        client = Client(**dict((field, '') for field in Client._fields))
+        sampled = SnippetBundle(client, snippets).sampled_snippets
+        print('{0} snippets, {1} sampled, {2} variants of {3} slots, {4} rounds'.format(
+            len(snippets), len(sampled), count, size, rounds))
+        bundles = [[SnippetBundle(client, snippets, variant, variant_round)
+                    for variant in range(count)]
+                   for variant_round in range(rounds)]
+        first_odds = exact_odds([bundle.variant_weights for bundle in bundles[0]])
+        odds = exact_odds([bundle.variant_weights
+                           for round_bundles in bundles for bundle in round_bundles])
+        print('\n{0:<10}{1:>10}{2:>10}{3:>10}'.format('snippet', 'weight', 'round', 'rounds'))
+        for snippet in snippets:
+            print('{0:<10}{1:>9.2f}%{2:>9.2f}%{3:>9.2f}%'.format(
+                snippet.id, expected[snippet.id] * 100, first_odds[snippet.id] * 100,
+                odds[snippet.id] * 100))
+        for name, slots, name_odds in [('round', count * size, first_odds),
+                                       ('rounds', count * size * rounds, odds)]:
+            difference = max(abs(name_odds[key] - value) for key, value in expected.items())
+            print('Largest difference over {0}: {1:.2f} points, at most {2:.2f} '
+                  'from rounding'.format(name, difference * 100, 100 / slots))
+
+        rng = random.Random(0)
+        shown = Counter()
+        for impression in range(IMPRESSIONS):
+            variants = split_variants(snippets, sampled, count, size, rng.getrandbits(64),
+                                      rng.randrange(rounds), rounds)
+            shown[pick(rng.choice(variants), rng)] += 1
+        statistic, z = chi_square_z(
+            shown, dict((key, value * IMPRESSIONS) for key, value in expected.items()))
+        print('\n{0} impressions over random seeds: chi-square {1:.1f} with {2} degrees '
+              'of freedom, z = {3:.2f}'.format(IMPRESSIONS, statistic, len(snippets) - 1, z))
+
+        full = sum(len(part) for part in escaped_bundle_json(snippets))
+        sizes = []
+        for bundle in bundles[0]:
+            variant_snippets, weights_json = bundle.variant_context()
+            sizes.append(sum(len(part) for part in escaped_bundle_json(variant_snippets)) +
+                         len(weights_json))
+        print('\nSnippets JSON: {0} bytes whole, {1:.0f} bytes per variant on average '
+              '({2:.1f}% smaller)'.format(full, sum(sizes) / count,
+                                          100 - 100 * sum(sizes) / count / full))
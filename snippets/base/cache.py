@@ -1,8 +1,176 @@
-# FROM https://raw.githubusercontent.com/mozilla/bedrock/master/bedrock/base/cache.py
+import time
+from collections import Counter, OrderedDict
 
+from django.core.cache import cache
 from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.core.cache.backends.locmem import LocMemCache
 
+from django_statsd.clients import statsd
+from jinja2.utils import LRUCache
+
+
+DATA_GENERATION_KEY = 'snippets_data_generation'
+
+
+def _new_data_generation():
+    # Seed from the clock so that a generation handed out before a
+    # cache flush is never handed out again.
+    return int(time.time() * 1000)
+
+
+def get_data_generation():
+    """
+    Return the current data generation.
+
+    The generation changes every time targeting data changes. It is
+    shared between workers through the default cache and it's used to
+    build validators and cache keys that invalidate themselves.
+    """
+    generation = cache.get(DATA_GENERATION_KEY)
+    if generation is None:
+        generation = _new_data_generation()
+        if not cache.add(DATA_GENERATION_KEY, generation, None):
+            generation = cache.get(DATA_GENERATION_KEY, generation)
+    return generation
+
+
+def bump_data_generation():
+    """Start a new data generation and return it."""
+    try:
+        return cache.incr(DATA_GENERATION_KEY)
+    except ValueError:
+        generation = _new_data_generation()
+        cache.set(DATA_GENERATION_KEY, generation, None)
+        return generation
+
+
+# Number of distinct keys each cache layer keeps access counts for.
+HOT_KEYS_TRACKED = 1000
+
+# Seconds between two batches of cache counters sent to statsd.
+STATS_FLUSH_INTERVAL = 10
+
+cache_layers = OrderedDict()
+
+
+class CacheLayer(object):
+    """
+    Hit, miss and eviction counters for one of the caches of the
+    service.
+
+    The counters and the access counts of the most requested keys are
+    kept in process for the cache stats view, so they describe the
+    current worker only. Counts are sent to statsd under cache.<name>
+    in batches, at most every STATS_FLUSH_INTERVAL seconds, since most
+    caches are in process and looked up many times per request. Only
+    lookups given a duration, in shared caches, are also timed.
+    """
+    def __init__(self, name, size=None):
+        self.name = name
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hot_keys = Counter()
+        self.unsent = Counter()
+        self.flushed = time.time()
+
+    def _count_key(self, key):
+        self.hot_keys[key] += 1
+        if len(self.hot_keys) > HOT_KEYS_TRACKED:
+            self.hot_keys = Counter(dict(self.hot_keys.most_common(HOT_KEYS_TRACKED // 2)))
+
+    def _count(self, event, count=1):
+        self.unsent[event] += count
+        now = time.time()
+        if now - self.flushed >= STATS_FLUSH_INTERVAL:
+            self.flush(now)
+
+    def flush(self, now=None):
+        """Send the counts not sent to statsd yet."""
+        unsent, self.unsent = self.unsent, Counter()
+        self.flushed = now or time.time()
+        for event, count in unsent.items():
+            statsd.incr('cache.{0}.{1}'.format(self.name, event), count)
+
+    def _time(self, duration):
+        if duration is not None:
+            statsd.timing('cache.{0}.get'.format(self.name), duration * 1000)
+
+    def hit(self, key, duration=None):
+        self.hits += 1
+        self._count_key(key)
+        self._count('hit')
+        self._time(duration)
+
+    def miss(self, key, duration=None):
+        self.misses += 1
+        self._count_key(key)
+        self._count('miss')
+        self._time(duration)
+
+    def evict(self, count=1):
+        self.evictions += count
+        self._count('eviction', count)
+
+    def get(self, backend, key, default=None):
+        """Get key from a django cache backend and record the outcome."""
+        start = time.time()
+        value = backend.get(key, default)
+        if value is default:
+            self.miss(key, time.time() - start)
+        else:
+            self.hit(key, time.time() - start)
+        return value
+
+    def stats(self, hot_keys=10):
+        return {
+            'name': self.name,
+            'size': self.size() if self.size else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hot_keys': self.hot_keys.most_common(hot_keys),
+        }
+
+
+def cache_layer(name, size=None):
+    """
+    Return the CacheLayer registered under name, creating it if
+    needed. A size callable replaces the one already registered.
+    """
+    layer = cache_layers.get(name)
+    if layer is None:
+        layer = cache_layers[name] = CacheLayer(name)
+    if size is not None:
+        layer.size = size
+    return layer
+
+
+class InstrumentedLRUCache(LRUCache):
+    """A jinja LRUCache that reports to the cache layer called name."""
+    def __init__(self, capacity, name):
+        super(InstrumentedLRUCache, self).__init__(capacity)
+        self.layer = cache_layer(name, size=self.__len__)
+
+    def __getitem__(self, key):
+        try:
+            value = super(InstrumentedLRUCache, self).__getitem__(key)
+        except KeyError:
+            self.layer.miss(key)
+            raise
+        self.layer.hit(key)
+        return value
+
+    def __setitem__(self, key, value):
+        evicting = key not in self and len(self) >= self.capacity
+        super(InstrumentedLRUCache, self).__setitem__(key, value)
+        if evicting:
+            self.layer.evict()
+
+
+# FROM https://raw.githubusercontent.com/mozilla/bedrock/master/bedrock/base/cache.py
+
 
 class SimpleDictCache(LocMemCache):
     """A local memory cache that doesn't pickle values.
@@ -10,6 +178,15 @@ class SimpleDictCache(LocMemCache):
     Only for use with simple immutable data structures that can be
     inserted into a dict.
     """
+    def __init__(self, name, params):
+        super(SimpleDictCache, self).__init__(name, params)
+        self.layer = cache_layer(name, size=self._cache.__len__)
+
+    def _cull(self):
+        size = len(self._cache)
+        super(SimpleDictCache, self)._cull()
+        self.layer.evict(size - len(self._cache))
+
     def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
         key = self.make_key(key, version=version)
         self.validate_key(key)
@@ -27,6 +204,7 @@ class SimpleDictCache(LocMemCache):
             if not self._has_expired(key):
                 value = self._cache[key]
         if value is not None:
+            self.layer.hit(key)
             return value
 
         with self._lock.writer():
@@ -35,7 +213,8 @@ class SimpleDictCache(LocMemCache):
                 del self._expire_info[key]
             except KeyError:
                 pass
-            return default
+        self.layer.miss(key)
+        return default
 
     def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
         key = self.make_key(key, version=version)
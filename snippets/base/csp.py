@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+from raven.contrib.django.models import client as sentry_client
+
+
+class CSPReportAggregator(object):
+    """
+    Collect CSP violation reports and send them to Sentry as summaries.
+
+    Reports are counted per blocked URI. A background thread sends one
+    message per blocked URI with the number of reports received every
+    SNIPPET_CSP_FLUSH_INTERVAL seconds, up to
+    SNIPPET_CSP_MESSAGES_PER_FLUSH messages; the least reported URIs
+    wait for the next flush. At most SNIPPET_CSP_MAX_BLOCKED_URIS URIs
+    are pending at any time, reports for new URIs beyond that are
+    dropped. Pending reports are lost when the worker exits.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.samples = {}
+        self.sent = 0
+        self.dropped = 0
+        self.pid = None
+
+    def add(self, blocked_uri, get_data):
+        """
+        Count a report for blocked_uri. get_data returns the Sentry data
+        of the report and it's only called for the first report of each
+        summary.
+        """
+        with self.lock:
+            if blocked_uri not in self.counts:
+                if len(self.counts) >= settings.SNIPPET_CSP_MAX_BLOCKED_URIS:
+                    self.dropped += 1
+                    statsd.incr('csp.dropped')
+                    return
+                self.samples[blocked_uri] = get_data()
+            self.counts[blocked_uri] += 1
+
+            # Threads don't survive forks, start one in every worker.
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+        statsd.incr('csp.report')
+
+    def flush(self):
+        """Send the summaries of the most reported blocked URIs."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            samples, self.samples = self.samples, {}
+
+        for index, (blocked_uri, count) in enumerate(counts.most_common()):
+            if index >= settings.SNIPPET_CSP_MESSAGES_PER_FLUSH:
+                with self.lock:
+                    self.counts[blocked_uri] += count
+                    self.samples.setdefault(blocked_uri, samples[blocked_uri])
+                continue
+
+            data = samples[blocked_uri]
+            data.setdefault('extra', {})['reports'] = count
+            sentry_client.captureMessage(message=u'CSP Violation: {0}'.format(blocked_uri),
+                                         data=data)
+            self.sent += 1
+
+    def _run(self):
+        while True:
+            time.sleep(settings.SNIPPET_CSP_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                # Keep flushing, summaries that failed are lost.
+                statsd.incr('csp.flush_error')
+
+
+csp_reports = CSPReportAggregator()
@@ -8,12 +8,13 @@ from django.core.urlresolvers import reverse
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
-from product_details import product_details
-from product_details.version_compare import Version, version_list
+from product_details.version_compare import Version
 
 from snippets.base.fields import MultipleChoiceFieldCSV
-from snippets.base.models import (JSONSnippet, Snippet, SnippetTemplate,
+from snippets.base.models import (CHANNELS, JSONSnippet, Snippet, SnippetTemplate,
                                   SnippetTemplateVariable, UploadedFile)
+from snippets.base.releases import release_info
+from snippets.base.util import decode_cursor
 from snippets.base.validators import MinValueValidator
 
 
@@ -200,9 +201,7 @@ class SnippetAdminForm(BaseSnippetAdminForm):
     def __init__(self, *args, **kwargs):
         super(SnippetAdminForm, self).__init__(*args, **kwargs)
 
-        version_choices = [
-            (x, x) for x in version_list(product_details.firefox_history_major_releases)
-        ]
+        version_choices = release_info.version_choices
         self.fields['client_option_version_lower_bound'].choices += version_choices
         self.fields['client_option_version_upper_bound'].choices += version_choices
 
@@ -309,3 +308,39 @@ class UploadedFileAdminForm(forms.ModelForm):
     class Meta:
         model = UploadedFile
         fields = ('file', 'name')
+
+
+ISO_DATETIME_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d',
+]
+
+
+class ActiveSnippetsForm(forms.Form):
+    """Filtering and pagination parameters of the active snippets listing."""
+    channel = forms.ChoiceField(choices=[(channel, channel) for channel in CHANNELS],
+                                required=False)
+    locale = forms.CharField(required=False)
+    country = forms.CharField(required=False)
+    template = forms.CharField(required=False)
+    since = forms.DateTimeField(input_formats=ISO_DATETIME_FORMATS, required=False)
+    publish_after = forms.DateTimeField(input_formats=ISO_DATETIME_FORMATS, required=False)
+    publish_before = forms.DateTimeField(input_formats=ISO_DATETIME_FORMATS, required=False)
+    cursor = forms.CharField(required=False)
+    limit = forms.IntegerField(min_value=1, max_value=settings.ACTIVE_SNIPPETS_MAX_LIMIT,
+                               required=False)
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data['cursor']
+        if not cursor:
+            return None
+        try:
+            position = decode_cursor(cursor)
+        except ValueError:
+            raise forms.ValidationError('Invalid cursor.')
+        # Cursors hold the modification date, kind and pk of a snippet.
+        if len(position) != 3:
+            raise forms.ValidationError('Invalid cursor.')
+        return position
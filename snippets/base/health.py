@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connections
+
+from django_statsd.clients import statsd
+from raven.contrib.django.models import client as sentry_client
+
+from snippets.base.models import Snippet
+
+
+HEALTH_CHECK_CACHE_KEY = 'snippets_health_check'
+
+
+def check_database():
+    assert Snippet.objects.exists(), 'No snippets exist'
+
+
+def check_cache():
+    value = str(time.time())
+    cache.set(HEALTH_CHECK_CACHE_KEY, value, 60)
+    assert cache.get(HEALTH_CHECK_CACHE_KEY) == value, 'Cache is not storing values'
+
+
+def check_storage():
+    default_storage.exists(settings.MEDIA_BUNDLES_ROOT)
+
+
+DEPENDENCY_CHECKS = OrderedDict([
+    ('database', check_database),
+    ('cache', check_cache),
+    ('storage', check_storage),
+])
+
+
+def run_checks():
+    """
+    Run every dependency check and return the status of each one,
+    with its latency in milliseconds.
+
+    The status is public, so errors only go to Sentry: their messages
+    can name hosts, users and paths.
+    """
+    dependencies = OrderedDict()
+    for name, check in DEPENDENCY_CHECKS.items():
+        start = time.time()
+        try:
+            check()
+        except Exception:
+            ok = False
+            sentry_client.captureException(extra={'dependency': name})
+        else:
+            ok = True
+        latency = int((time.time() - start) * 1000)
+        dependencies[name] = {'ok': ok, 'latency': latency}
+        statsd.timing('health.{0}'.format(name), latency)
+        if not ok:
+            statsd.incr('health.{0}.fail'.format(name))
+    return dependencies
+
+
+class HealthStatus(object):
+    """
+    Latest result of the dependency checks of the current worker.
+
+    Reading the status never waits for the checks, except for the very
+    first read: once the record is older than
+    SNIPPET_HEALTH_REFRESH_INTERVAL seconds, it's refreshed in a
+    background thread and the current record is returned meanwhile.
+    """
+    def __init__(self):
+        self.record = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def refresh(self):
+        self.record = {'dependencies': run_checks(), 'updated': time.time()}
+        return self.record
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            self.refreshing = False
+            # The checks opened connections of their own in this thread.
+            connections.close_all()
+
+    def get(self):
+        record = self.record
+        if record is None:
+            return self.refresh()
+
+        if time.time() - record['updated'] >= settings.SNIPPET_HEALTH_REFRESH_INTERVAL:
+            with self.lock:
+                if not self.refreshing:
+                    self.refreshing = True
+                    thread = threading.Thread(target=self._refresh_in_background)
+                    thread.daemon = True
+                    thread.start()
+        return record
+
+
+health_status = HealthStatus()
+
+
+def readiness():
+    """
+    Return the readiness report of the worker.
+
+    The worker is ready while either the database or the cache works:
+    without the database, bundles that are flagged as generated in the
+    cache can still be served. Any failing dependency makes the status
+    degraded.
+    """
+    record = health_status.get()
+    dependencies = record['dependencies']
+    failing = [name for name, dependency in dependencies.items() if not dependency['ok']]
+    ready = dependencies['database']['ok'] or dependencies['cache']['ok']
+    if not failing:
+        status = 'ok'
+    elif ready:
+        status = 'degraded'
+    else:
+        status = 'unavailable'
+    return {
+        'ready': ready,
+        'status': status,
+        'age': int(time.time() - record['updated']),
+        'dependencies': dependencies,
+    }
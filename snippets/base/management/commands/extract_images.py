@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from snippets.base.models import JSONSnippet, Snippet
+
+
+class Command(BaseCommand):
+    help = 'Move base64 images inlined in snippets to uploaded files served from the CDN.'
+
+    def handle(self, *args, **options):
+        saved = 0
+        snippets = [
+            (Snippet.objects.filter(data__contains='data:image/'), 'data'),
+            (JSONSnippet.objects.filter(icon__contains='data:image/'), 'icon'),
+        ]
+        for queryset, field in snippets:
+            for snippet in queryset:
+                size = len(getattr(snippet, field))
+                snippet.extract_images()
+                snippet_saved = size - len(getattr(snippet, field))
+                if snippet_saved:
+                    snippet.save()
+                    saved += snippet_saved
+                    self.stdout.write(u'{0} {1}: {2} data bytes saved'.format(
+                        snippet._meta.verbose_name.capitalize(), snippet.id, snippet_saved))
+
+        self.stdout.write(u'Total: {0} data bytes saved'.format(saved))
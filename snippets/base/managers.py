@@ -1,14 +1,55 @@
+import hashlib
+import time
+from collections import defaultdict
 from datetime import datetime
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Manager
+from django.db.models.sql.datastructures import EmptyResultSet
 
 from caching.base import CachingQuerySet
 
 from snippets.base import LANGUAGE_VALUES
+from snippets.base.cache import cache_layer, get_data_generation
 from snippets.base.util import first
 
 
-class ClientMatchRuleQuerySet(CachingQuerySet):
+# Rows of snippet record queries in the default cache.
+record_rows = cache_layer('snippet-records')
+
+
+def filter_available(snippets):
+    """Filter snippets, or snippet records, by their publish dates."""
+    now = datetime.utcnow()
+    return [
+        snippet for snippet in snippets if
+        (not snippet.publish_start or snippet.publish_start <= now) and
+        (not snippet.publish_end or snippet.publish_end >= now)
+    ]
+
+
+class MeteredCachingQuerySet(CachingQuerySet):
+    """
+    CachingQuerySet that reports cache-machine hits and misses to the
+    cache-machine cache layer, keyed by model.
+
+    Whether the result came from the cache is only known once the first
+    object is fetched, so empty results are not counted.
+    """
+    def iterator(self):
+        layer = cache_layer('cache-machine')
+        start = time.time()
+        first_object = True
+        for obj in super(MeteredCachingQuerySet, self).iterator():
+            if first_object:
+                first_object = False
+                record = layer.hit if getattr(obj, 'from_cache', False) else layer.miss
+                record(self.model.__name__, time.time() - start)
+            yield obj
+
+
+class ClientMatchRuleQuerySet(MeteredCachingQuerySet):
     def evaluate(self, client):
         passed_rules, failed_rules = [], []
         for rule in self:
@@ -24,25 +65,44 @@ class ClientMatchRuleManager(Manager):
         return ClientMatchRuleQuerySet(self.model)
 
 
-class SnippetQuerySet(CachingQuerySet):
+class SnippetQuerySet(MeteredCachingQuerySet):
     def filter_by_available(self):
         """Datetime filtering of snippets.
 
         Filter by date in python to avoid caching based on the passing
         of time.
         """
-        now = datetime.utcnow()
-        matching_snippets = [
-            snippet for snippet in self if
-            (not snippet.publish_start or snippet.publish_start <= now) and
-            (not snippet.publish_end or snippet.publish_end >= now)
-        ]
-        return matching_snippets
+        return filter_available(self)
 
-    def match_client(self, client):
+    def records(self):
+        """
+        Return the snippets as SnippetRecords.
+
+        Records are built from a values_list() query, which skips model
+        instances, related managers and field decoding. cache-machine
+        doesn't cache values_list() queries, so the rows are cached in
+        the default cache for the current data generation instead.
+        """
+        from snippets.base.models import SnippetRecord
+
+        rows_query = self.values_list(*SnippetRecord.FIELDS)
+        try:
+            sql, params = rows_query.query.get_compiler(using=self.db).as_sql()
+        except EmptyResultSet:
+            return []
+
+        query_hash = hashlib.sha1((sql % params).encode('utf-8')).hexdigest()
+        key = u'snippet_records:{0}:{1}'.format(get_data_generation(), query_hash)
+        rows = record_rows.get(cache, key)
+        if rows is None:
+            rows = list(rows_query)
+            cache.set(key, rows, settings.SNIPPET_BUNDLE_TIMEOUT)
+        return [SnippetRecord(*row) for row in rows]
+
+    def _client_filters(self, client):
+        """Return the database filters that select snippets for client."""
         from snippets.base.models import (
-            CHANNELS, FENNEC_STARTPAGE_VERSIONS, FIREFOX_STARTPAGE_VERSIONS,
-            JSONSnippet, ClientMatchRule)
+            CHANNELS, FENNEC_STARTPAGE_VERSIONS, FIREFOX_STARTPAGE_VERSIONS)
 
         filters = {}
 
@@ -77,7 +137,12 @@ class SnippetQuerySet(CachingQuerySet):
             # locales specified.
             filters.update(locales__isnull=True)
 
-        snippets = self.filter(**filters).distinct()
+        return filters
+
+    def match_client(self, client):
+        from snippets.base.models import JSONSnippet, ClientMatchRule
+
+        snippets = self.filter(**self._client_filters(client)).distinct()
         if issubclass(self.model, JSONSnippet):
             filtering = {'jsonsnippet__in': snippets}
         else:
@@ -91,6 +156,38 @@ class SnippetQuerySet(CachingQuerySet):
 
         return snippets.exclude(client_match_rules__in=failed_rules)
 
+    def match_clients(self, clients):
+        """
+        Match many clients at once and return a dict mapping each client
+        to the list of its available snippets, in queryset order.
+
+        Clients that result in the same database filters share a single
+        query, and each client match rule is evaluated once per client.
+        """
+        groups = defaultdict(list)
+        for client in set(clients):
+            filters = self._client_filters(client)
+            group_key = tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                                     for name, value in filters.items()))
+            groups[group_key].append((client, filters))
+
+        matches = {}
+        for group in groups.values():
+            filters = group[0][1]
+            snippets = (self.filter(**filters)
+                        .distinct()
+                        .prefetch_related('client_match_rules')
+                        .filter_by_available())
+            rules = dict((rule.id, rule) for snippet in snippets
+                         for rule in snippet.client_match_rules.all())
+            for client, filters in group:
+                passed = dict((rule_id, rule.matches(client)) for rule_id, rule in rules.items())
+                matches[client] = [
+                    snippet for snippet in snippets
+                    if all(passed[rule.id] for rule in snippet.client_match_rules.all())
+                ]
+        return matches
+
 
 class SnippetManager(Manager):
     def get_queryset(self):
@@ -98,3 +195,6 @@ class SnippetManager(Manager):
 
     def match_client(self, client):
         return self.get_queryset().match_client(client)
+
+    def match_clients(self, clients):
+        return self.get_queryset().match_clients(clients)
@@ -1,9 +1,41 @@
 from django.conf import settings
-from django.core.urlresolvers import Resolver404, resolve
 
+from snippets.base.models import Client
 from snippets.base.views import fetch_json_snippets, fetch_snippets
 
 
+# Number of slashes in the paths of the fetch views, which are made of
+# the client fields, one per segment. JSON paths are prefixed with json/.
+FETCH_PATH_SLASHES = len(Client._fields) + 1
+FETCH_JSON_PATH_SLASHES = FETCH_PATH_SLASHES + 1
+
+
+def parse_fetch_path(path):
+    """
+    Match path against the URL patterns of fetch_snippets and
+    fetch_json_snippets without going through the urlconf.
+
+    Return a (is_json, client) tuple, or None if path is not a fetch
+    URL.
+    """
+    slashes = path.count('/')
+
+    if slashes == FETCH_PATH_SLASHES:
+        is_json = False
+        segments = path[1:-1].split('/')
+    elif slashes == FETCH_JSON_PATH_SLASHES and path.startswith('/json/'):
+        is_json = True
+        segments = path[6:-1].split('/')
+    else:
+        return None
+
+    # Every segment is required, as in the fetch URL patterns.
+    if not path.endswith('/') or not all(segments):
+        return None
+
+    return is_json, Client(*segments)
+
+
 class FetchSnippetsMiddleware(object):
     """
     If the incoming request is for the fetch_snippets view, execute the view
@@ -14,15 +46,29 @@ class FetchSnippetsMiddleware(object):
     middlewares. To avoid unintended issues (such as headers we don't want
     being added to the response) this middleware detects requests to that view
     and executes the view early, bypassing the rest of the middleware.
+
+    Every request goes through this middleware, so instead of resolving
+    the path against the whole urlconf the fetch URLs are matched
+    directly with parse_fetch_path.
     """
     def process_request(self, request):
-        try:
-            result = resolve(request.path)
-        except Resolver404:
-            return
+        match = self.match(request.path_info)
+        if match is not None:
+            view, kwargs = match
+            return view(request, **kwargs)
+
+    def match(self, path):
+        """
+        Return the fetch view for path and its keyword arguments, or None
+        if path is not a fetch URL.
+        """
+        fetch = parse_fetch_path(path)
+        if fetch is None:
+            return None
 
-        if result.func in (fetch_snippets, fetch_json_snippets):
-            return result.func(request, *result.args, **result.kwargs)
+        is_json, client = fetch
+        view = fetch_json_snippets if is_json else fetch_snippets
+        return view, dict(zip(client._fields, client))
 
 
 class HostnameMiddleware(object):
@@ -0,0 +1,90 @@
+"""
+Conservative minifiers for the code of bundles.
+
+They only remove what is safe to remove without parsing: indentation,
+blank lines, comments and collapsible whitespace. Lines of JavaScript
+are never joined, so automatic semicolon insertion is unaffected.
+"""
+import hashlib
+import re
+
+from snippets.base.cache import InstrumentedLRUCache
+
+
+# Minified code keyed by minifier and input hash.
+minify_cache = InstrumentedLRUCache(100, 'minified')
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION_SPACE = re.compile(r'\s*([{};])\s*')
+
+# Jinja raw blocks, expressions, statements and comments, and tags,
+# comments and CDATA sections of markup. Quoted attribute values may
+# contain '>'.
+MARKUP_TOKEN = re.compile(r'({%-?\s*raw\s*-?%}.*?{%-?\s*endraw\s*-?%}|{{.*?}}|{%.*?%}|{#.*?#}|'
+                          r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>)',
+                          re.DOTALL)
+MARKUP_SPACE = re.compile(r'\s+')
+RAW_TEXT_TAG = re.compile(r'<(/?)(script|style|pre|textarea)\b', re.IGNORECASE)
+
+
+def minify_js(code):
+    """
+    Strip indentation, blank lines and whole line comments from
+    JavaScript code.
+    """
+    lines = []
+    for line in code.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return u'\n'.join(lines)
+
+
+def minify_css(code):
+    """Strip comments and collapse whitespace in CSS code."""
+    code = CSS_COMMENT.sub(u'', code)
+    code = CSS_SPACE.sub(u' ', code)
+    return CSS_PUNCTUATION_SPACE.sub(ur'\1', code).strip()
+
+
+def minify_markup(code):
+    """
+    Collapse whitespace in the text of markup to single spaces.
+
+    Jinja expressions, statements, comments and raw blocks, tags,
+    comments and CDATA sections are left untouched, and so is the
+    content of script, style, pre and textarea elements. Whitespace is
+    never removed completely, so the rendering of inline content and the
+    XML structure of snippet templates don't change.
+    """
+    parts = []
+    raw_depth = 0
+    for index, part in enumerate(MARKUP_TOKEN.split(code)):
+        if index % 2:
+            match = RAW_TEXT_TAG.match(part)
+            if match and not part.endswith('/>'):
+                raw_depth = max(raw_depth + (-1 if match.group(1) else 1), 0)
+        elif not raw_depth:
+            part = MARKUP_SPACE.sub(u' ', part)
+        parts.append(part)
+    return u''.join(parts)
+
+
+MINIFIERS = {
+    'js': minify_js,
+    'css': minify_css,
+    'markup': minify_markup,
+}
+
+
+def minify(kind, code):
+    """
+    Return code minified with the minifier for kind, from minify_cache
+    when possible.
+    """
+    key = u'{0}:{1}'.format(kind, hashlib.sha1(code.encode('utf-8')).hexdigest())
+    minified = minify_cache.get(key)
+    if minified is None:
+        minified = minify_cache[key] = MINIFIERS[kind](code)
+    return minified
@@ -1,12 +1,15 @@
+import base64
 import copy
 import hashlib
 import json
 import os
+import random
 import re
+import time
 import uuid
 import xml.sax
 from StringIO import StringIO
-from collections import namedtuple
+from collections import Counter, namedtuple
 from datetime import datetime
 from urlparse import urljoin, urlparse
 from xml.sax import ContentHandler
@@ -19,20 +22,26 @@ from django.core.files.storage import default_storage
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.db.models.manager import Manager
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.template import engines
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.safestring import mark_safe
 
 import django_mysql.models
 from caching.base import CachingManager, CachingMixin
+from caching.invalidation import invalidator
 from jinja2 import Markup
-from jinja2.utils import LRUCache
-from product_details import product_details
-from product_details.version_compare import version_list
 
+from snippets.base.cache import (InstrumentedLRUCache, bump_data_generation, cache_layer,
+                                 get_data_generation)
 from snippets.base.fields import RegexField
-from snippets.base.managers import ClientMatchRuleManager, SnippetManager
-from snippets.base.util import hashfile
+from snippets.base.managers import ClientMatchRuleManager, SnippetManager, filter_available
+from snippets.base.minify import minify
+from snippets.base.releases import release_info
+from snippets.base.util import escapejs, hashfile
 
 
 JINJA_ENV = engines['backend']
@@ -122,30 +131,291 @@ Client = namedtuple('Client', (
 # Cache for compiled snippet templates. Using jinja's built in cache
 # requires either an extra trip to the database/cache or jumping through
 # hoops.
-template_cache = LRUCache(100)
+template_cache = InstrumentedLRUCache(100, 'snippet-templates')
+
+# Flags in the default cache marking generated and empty bundles.
+bundle_flags = cache_layer('bundle-flags')
+
+# JSON of snippets escaped for JavaScript string literals, keyed by the
+# snippet and template revisions. Snippets are touched when their
+# countries or search providers change, see touch_snippets().
+json_fragment_cache = InstrumentedLRUCache(settings.SNIPPET_JSON_FRAGMENT_CACHE_SIZE,
+                                           'json-fragments')
+
+# Template data of snippets with the snippet ID substituted, and
+# attributes of the elements wrapping snippets. Both are keyed by the
+# snippet revision, like json_fragment_cache, and skipped for unsaved
+# snippets, as in previews.
+render_data_cache = InstrumentedLRUCache(settings.SNIPPET_RENDER_CACHE_SIZE, 'render-data')
+render_attrs_cache = InstrumentedLRUCache(settings.SNIPPET_RENDER_CACHE_SIZE, 'render-attrs')
+
+
+def escaped_snippets_json(snippets):
+    """
+    Return the JSON list of snippets, in the to_dict format, escaped for
+    a JavaScript string literal.
+
+    The list is assembled from the cached fragments of every snippet.
+    escapejs works character by character and leaves the list
+    punctuation alone, so the result is the same as escaping the JSON
+    of the whole list.
+    """
+    load_snippets(snippets, u'')
+    return mark_safe(u'[{0}]'.format(u', '.join(snippet.escaped_json() for snippet in snippets)))
+
+
+# Stands in for the snippet ID in markup shared between snippets. The
+# snippet runtime puts the ID back.
+SNIPPET_ID_PLACEHOLDER = u'[[snippet_id]]'
+
+# Escaped JSON key referencing shared markup, closing a snippet object.
+ESCAPED_MARKUP_KEY = escapejs(u', "markup": ')
+
+
+def escaped_bundle_json(snippets):
+    """
+    Return the JSON lists of snippets and of the markup they share,
+    escaped for JavaScript string literals.
+
+    With SNIPPET_DEDUPLICATE_MARKUP, rendered templates shared by more
+    than one snippet are sent once and those snippets reference them by
+    index, with the wrapper attributes in code_attrs instead of the full
+    code. Other snippets are in the to_dict format.
+    """
+    if not settings.SNIPPET_DEDUPLICATE_MARKUP:
+        return escaped_snippets_json(snippets), mark_safe(u'[]')
+
+    load_snippets(snippets, u'parts:')
+    parts = [snippet.escaped_json_parts() for snippet in snippets]
+    markup_counts = Counter(markup for fragment, head, markup in parts if markup is not None)
+
+    fragments = []
+    markup_indexes = {}
+    for fragment, head, markup in parts:
+        if markup_counts[markup] > 1:
+            index = markup_indexes.setdefault(markup, len(markup_indexes))
+            fragment = u'{0}{1}{2}}}'.format(head, ESCAPED_MARKUP_KEY, index)
+        fragments.append(fragment)
+
+    markup_list = sorted(markup_indexes, key=markup_indexes.get)
+    return (mark_safe(u'[{0}]'.format(u', '.join(fragments))),
+            mark_safe(u'[{0}]'.format(u', '.join(markup_list))))
+
+
+def weighted_variants(snippets, count, size, seed, round=0, rounds=1):
+    """
+    Split snippets into count variants of size slots each and return the
+    weights of the snippets of every variant, by snippet ID.
+
+    Slots are handed out by systematic sampling over the snippet
+    weights, so each snippet holds its share of all slots, rounded up or
+    down depending on seed. A snippet weighs as many slots as it holds
+    in a variant, so picking a variant at random and then one of its
+    snippets by weight shows snippets as often as picking from all of
+    them by their own weight, on average over seeds.
+
+    Rounds shift the sampling so that the slots of all rounds of a seed
+    are spread like count * size * rounds slots would be, which bounds
+    the rounding of shares averaged over the rounds.
+    """
+    slots = count * size
+    total = sum(snippet.weight for snippet in snippets)
+    # Positions are scaled by slots * rounds to keep to integers: the
+    # first slot of the round is at its offset and the next ones follow
+    # every total * rounds.
+    position = random.Random(seed).randrange(total) + round * total
+    variants = [{} for i in range(count)]
+    slot = 0
+    boundary = 0
+    for snippet in snippets:
+        boundary += snippet.weight * slots * rounds
+        while position < boundary:
+            weights = variants[slot % count]
+            weights[snippet.id] = weights.get(snippet.id, 0) + 1
+            slot += 1
+            position += total * rounds
+    return variants
+
+
+def split_variants(snippets, sampled, count, size, seed, round=0, rounds=1):
+    """
+    Return the weights of the snippets of every variant of snippets, by
+    snippet ID. The sampled snippets are split with weighted_variants
+    and the others are held by every variant.
+
+    Slots of sampled snippets weigh the total weight of the sampled
+    snippets and the other snippets weigh their weight times size, so
+    sampled snippets keep their odds among all snippets, whichever of
+    the others the runtime filters out.
+    """
+    total = sum(snippet.weight for snippet in sampled)
+    sampled_ids = set(snippet.id for snippet in sampled)
+    kept = dict((snippet.id, snippet.weight * size)
+                for snippet in snippets if snippet.id not in sampled_ids)
+    variants = weighted_variants(sampled, count, size, seed, round, rounds)
+    for weights in variants:
+        for snippet_id in weights:
+            weights[snippet_id] *= total
+        weights.update(kept)
+    return variants
+
+
+# Screen resolutions of snippets shown on all screens.
+ALL_SCREEN_RESOLUTIONS = set(['0-1024', '1024-1920', '1920-50000'])
+
+
+def filters_clients(campaign, client_options):
+    """
+    Return whether the snippet runtime shows a snippet with campaign
+    and client_options to some clients only. Campaigns can be blocked.
+    """
+    if campaign:
+        return True
+    for name, value in (client_options or {}).items():
+        if name == 'screen_resolutions':
+            if set((value or '').split(';')) != ALL_SCREEN_RESOLUTIONS:
+                return True
+        elif value not in (None, '', 'any', -1):
+            return True
+    return False
+
+
+def client_filtered_snippet_ids():
+    """
+    Return the IDs of the enabled snippets that the snippet runtime
+    shows to some clients only, because of their countries, excluded
+    search providers, campaign or client_options. Cached for the
+    current data generation.
+    """
+    key = u'client_filtered_snippets:{0}'.format(get_data_generation())
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(Snippet.countries.through.objects.values_list('snippet_id', flat=True))
+        ids.update(Snippet.exclude_from_search_providers.through.objects
+                   .values_list('snippet_id', flat=True))
+        rows = (Snippet.objects.filter(disabled=False)
+                .values_list('id', 'campaign', 'client_options'))
+        ids.update(snippet_id for snippet_id, campaign, client_options in rows
+                   if filters_clients(campaign, client_options))
+        cache.set(key, ids, settings.SNIPPET_BUNDLE_TIMEOUT)
+    return ids
+
+
+def bundle_period():
+    """Return the number of the current SNIPPET_BUNDLE_TIMEOUT period."""
+    return int(time.time()) // settings.SNIPPET_BUNDLE_TIMEOUT
+
+
+def media_url(filename):
+    """Return the absolute URL of a file in the default storage."""
+    file_url = default_storage.url(filename)
+    full_url = urljoin(settings.SITE_URL, file_url).split('?')[0]
+    cdn_url = getattr(settings, 'CDN_URL', None)
+    if cdn_url:
+        full_url = urljoin(cdn_url, urlparse(file_url).path)
+
+    return full_url
+
+
+# Snippet runtime included by each bundle template.
+RUNTIME_TEMPLATES = {
+    'base/fetch_snippets.jinja': 'base/includes/snippet.js',
+    'base/fetch_snippets_as.jinja': 'base/includes/snippet_as.js',
+}
+
+# URLs of the runtime files of this process, keyed by template name.
+runtime_urls = {}
+
+
+def runtime_url(template_name):
+    """
+    Return the URL of the snippet runtime rendered from template_name as
+    a static file, saving the file to the default storage if needed.
+
+    The runtime only depends on settings outside of previews, so it's
+    rendered once per process. The file name contains the hash of its
+    content, so the file can be cached for long.
+    """
+    url = runtime_urls.get(template_name)
+    if url is None:
+        content = render_to_string(template_name, {'settings': settings, 'preview': False})
+        if settings.SNIPPET_MINIFY:
+            content = minify('js', content)
+        content = content.encode('utf-8')
+        name, ext = os.path.splitext(os.path.basename(template_name))
+        filename = urljoin(settings.MEDIA_BUNDLES_ROOT, 'runtime/{0}.{1}{2}'.format(
+            name, hashlib.sha1(content).hexdigest(), ext))
+        if not default_storage.exists(filename):
+            default_storage.save(filename, ContentFile(content))
+        url = runtime_urls[template_name] = media_url(filename)
+    return url
 
 
 class SnippetBundle(object):
     """
     Group of snippets to be sent to a particular client configuration.
     """
-    def __init__(self, client):
+    def __init__(self, client, snippets=None, variant=None, variant_round=0):
         self.client = client
-        self._snippets = None
+        self._snippets = snippets
+        self.variant = variant
+        self.variant_round = variant_round
+
+    @classmethod
+    def for_clients(cls, clients):
+        """
+        Return a bundle for each of clients, matching snippets for all of
+        them at once. Clients that match no snippets are remembered like
+        they are when matching a single bundle.
+        """
+        matches = cls._snippet_queryset().match_clients(clients)
+        bundles = []
+        for client in clients:
+            bundle = cls(client, matches[client])
+            if bundle.empty:
+                cache.set(bundle.empty_cache_key, True, settings.SNIPPET_BUNDLE_TIMEOUT)
+            bundles.append(bundle)
+        return bundles
+
+    @staticmethod
+    def _snippet_queryset():
+        return (Snippet.cached_objects
+                .filter(disabled=False)
+                .order_by('priority')
+                .select_related('template')
+                .prefetch_related('countries', 'exclude_from_search_providers'))
 
     @property
     def key(self):
         """A unique key for this bundle as a sha1 hexdigest."""
-        # Key should consist of snippets that are in the bundle plus any
-        # properties of the client that may change the snippet code
-        # being sent.
-        key_properties = ['{id}-{date}'.format(id=snippet.id, date=snippet.modified.isoformat())
-                          for snippet in self.snippets]
+        if self.empty:
+            # Empty bundles only differ in the properties of the client
+            # that end up in the rendered code, so all clients that
+            # match no snippets share them.
+            key_properties = ['empty', self.client.startpage_version,
+                              self.client.locale, self.metrics_url]
+        else:
+            # Key should consist of snippets that are in the bundle plus any
+            # properties of the client that may change the snippet code
+            # being sent.
+            key_properties = self._snippet_versions()
+
+            key_properties.extend([
+                self.client.startpage_version,
+                self.client.locale,
+                self.client.channel,
+            ])
+
+            if self.variant is not None:
+                key_properties.append('variant-{0}-{1}-{2}-{3}-{4}'.format(
+                    self.variant, self.variant_round, settings.SNIPPET_BUNDLE_VARIANTS,
+                    settings.SNIPPET_BUNDLE_VARIANT_SIZE,
+                    settings.SNIPPET_BUNDLE_VARIANT_ROUNDS))
 
         key_properties.extend([
-            self.client.startpage_version,
-            self.client.locale,
-            self.client.channel,
+            str(settings.SNIPPET_EXTERNAL_RUNTIME),
+            str(settings.SNIPPET_MINIFY),
+            str(settings.SNIPPET_DEDUPLICATE_MARKUP),
             SNIPPET_JS_TEMPLATE_HASH,
             SNIPPET_CSS_TEMPLATE_HASH,
             SNIPPET_FETCH_TEMPLATE_HASH,
@@ -155,17 +425,35 @@ class SnippetBundle(object):
         key_string = u'_'.join(key_properties)
         return hashlib.sha1(key_string.encode('utf-8')).hexdigest()
 
+    def _snippet_versions(self):
+        return ['{id}-{date}'.format(id=snippet.id, date=snippet.modified.isoformat())
+                for snippet in self.snippets]
+
     @property
     def cache_key(self):
         return u'bundle_' + self.key
 
+    @property
+    def empty_cache_key(self):
+        """
+        Cache key used to remember that the client matches no snippets
+        in the current data generation.
+        """
+        key_properties = list(self.client) + [str(get_data_generation())]
+        key_string = u'_'.join(key_properties)
+        return u'bundle_empty_' + hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
     @property
     def expired(self):
         """
         If True, the code for this bundle should be re-generated before
         use.
         """
-        return not cache.get(self.cache_key)
+        return not bundle_flags.get(cache, self.cache_key)
+
+    @property
+    def empty(self):
+        return not self.snippets
 
     @property
     def filename(self):
@@ -173,52 +461,147 @@ class SnippetBundle(object):
 
     @property
     def url(self):
-        bundle_url = default_storage.url(self.filename)
-        full_url = urljoin(settings.SITE_URL, bundle_url).split('?')[0]
-        cdn_url = getattr(settings, 'CDN_URL', None)
-        if cdn_url:
-            full_url = urljoin(cdn_url, urlparse(bundle_url).path)
+        return media_url(self.filename)
 
-        return full_url
+    @property
+    def template(self):
+        if self.client.startpage_version == '5':
+            return 'base/fetch_snippets_as.jinja'
+        return 'base/fetch_snippets.jinja'
+
+    @property
+    def runtime_url(self):
+        """
+        URL of the snippet runtime file referenced by the bundle, or None
+        if the runtime is inlined in the bundle.
+        """
+        if not settings.SNIPPET_EXTERNAL_RUNTIME:
+            return None
+        return runtime_url(RUNTIME_TEMPLATES[self.template])
+
+    @property
+    def metrics_url(self):
+        if ((settings.ALTERNATE_METRICS_URL and
+             self.client.channel in settings.ALTERNATE_METRICS_CHANNELS)):
+            return settings.ALTERNATE_METRICS_URL
+        return settings.METRICS_URL
 
     @property
     def snippets(self):
         # Lazy-load snippets on first access.
         if self._snippets is None:
-            self._snippets = (Snippet.cached_objects
-                              .filter(disabled=False)
-                              .match_client(self.client)
-                              .order_by('priority')
-                              .select_related('template')
-                              .prefetch_related('countries', 'exclude_from_search_providers')
-                              .filter_by_available())
+            # Clients that are known to match no snippets skip matching
+            # until targeting data changes.
+            empty_cache_key = self.empty_cache_key
+            if bundle_flags.get(cache, empty_cache_key):
+                self._snippets = []
+            else:
+                self._snippets = filter_available(Snippet.cached_objects
+                                                  .filter(disabled=False)
+                                                  .order_by('priority')
+                                                  .match_client(self.client)
+                                                  .records())
+                if not self._snippets:
+                    cache.set(empty_cache_key, True, settings.SNIPPET_BUNDLE_TIMEOUT)
         return self._snippets
 
-    def generate(self):
-        """Generate and save the code for this snippet bundle."""
-        current_firefox_version = (
-            version_list(product_details.firefox_history_major_releases)[0].split('.', 1)[0])
+    @property
+    def variant_count(self):
+        """
+        Number of variants the bundle is split into with
+        SNIPPET_BUNDLE_VARIANTS, or 1 if it's sent whole.
+        """
+        count = settings.SNIPPET_BUNDLE_VARIANTS
+        if count > 1 and len(self.sampled_snippets) > settings.SNIPPET_BUNDLE_VARIANT_SIZE:
+            return count
+        return 1
 
-        metrics_url = settings.METRICS_URL
-        if ((settings.ALTERNATE_METRICS_URL and
-             self.client.channel in settings.ALTERNATE_METRICS_CHANNELS)):
-            metrics_url = settings.ALTERNATE_METRICS_URL
+    @property
+    def sampled_snippets(self):
+        """
+        Snippets of the bundle that variants hold a sample of. Variants
+        hold all of the snippets the runtime shows to some clients only,
+        otherwise the snippets left after filtering would be shown more
+        or less often than without variants.
+        """
+        filtered = client_filtered_snippet_ids()
+        return [snippet for snippet in self.snippets if snippet.id not in filtered]
 
-        template = 'base/fetch_snippets.jinja'
-        if self.client.startpage_version == '5':
-            template = 'base/fetch_snippets_as.jinja'
-        bundle_content = render_to_string(template, {
-            'snippet_ids': [snippet.id for snippet in self.snippets],
-            'snippets_json': json.dumps([s.to_dict() for s in self.snippets]),
+    def choose_variant(self):
+        """
+        Pick one of the variants of the bundle, if any, for the client
+        and the current SNIPPET_BUNDLE_TIMEOUT period, from the round of
+        the period.
+
+        The choice only depends on the client and the period, like fetch
+        validators, so every process picks the same variant until the
+        validator changes. Clients with the same signature share a
+        variant for a period, so the odds of snippets hold over periods.
+        """
+        count = self.variant_count
+        if count > 1:
+            period = bundle_period()
+            choice_string = u'_'.join(list(self.client) + [str(period)])
+            self.variant = int(hashlib.sha1(choice_string.encode('utf-8')).hexdigest(), 16) % count
+            self.variant_round = period % settings.SNIPPET_BUNDLE_VARIANT_ROUNDS
+        else:
+            self.variant = None
+
+    @property
+    def variant_weights(self):
+        """
+        Weights of the snippets in the variant of the bundle by snippet
+        ID, or None if the bundle holds all of its snippets.
+
+        Variants only depend on the snippets, so all processes agree on
+        them.
+        """
+        if self.variant is None:
+            return None
+        seed_string = u'_'.join(self._snippet_versions())
+        seed = int(hashlib.sha1(seed_string.encode('utf-8')).hexdigest(), 16)
+        variants = split_variants(self.snippets, self.sampled_snippets,
+                                  settings.SNIPPET_BUNDLE_VARIANTS,
+                                  settings.SNIPPET_BUNDLE_VARIANT_SIZE, seed, self.variant_round,
+                                  settings.SNIPPET_BUNDLE_VARIANT_ROUNDS)
+        return variants[self.variant]
+
+    def variant_context(self):
+        """
+        Return the snippets sent in the bundle and their weights escaped
+        for a JavaScript string literal, which override the weights of
+        the snippets in the client.
+        """
+        weights = self.variant_weights
+        if weights is None:
+            return self.snippets, mark_safe(u'{}')
+        snippets = [snippet for snippet in self.snippets if snippet.id in weights]
+        return snippets, mark_safe(escapejs(json.dumps(weights)))
+
+    def render(self):
+        """Render the code for this snippet bundle."""
+        snippets, weights_json = self.variant_context()
+        snippets_json, markup_json = escaped_bundle_json(snippets)
+        bundle_content = render_to_string(self.template, {
+            'snippet_ids': [snippet.id for snippet in snippets],
+            'escaped_snippets_json': snippets_json,
+            'escaped_markup_json': markup_json,
+            'escaped_weights_json': weights_json,
             'client': self.client,
             'locale': self.client.locale,
             'settings': settings,
-            'current_firefox_version': current_firefox_version,
-            'metrics_url': metrics_url,
+            'current_firefox_version': release_info.current_version,
+            'metrics_url': self.metrics_url,
+            'runtime_url': self.runtime_url,
         })
 
         if isinstance(bundle_content, unicode):
             bundle_content = bundle_content.encode('utf-8')
+        return bundle_content
+
+    def generate(self):
+        """Generate and save the code for this snippet bundle."""
+        bundle_content = self.render()
         default_storage.save(self.filename, ContentFile(bundle_content))
         cache.set(self.cache_key, True, settings.SNIPPET_BUNDLE_TIMEOUT)
 
@@ -241,16 +624,23 @@ class SnippetTemplate(CachingMixin, models.Model):
     objects = models.Manager()
     cached_objects = CachingManager()
 
-    def render(self, ctx):
-        ctx.setdefault('snippet_id', 0)
+    def compile(self):
+        """Return the compiled jinja template for this template's code."""
+        code = self.code
+        if settings.SNIPPET_MINIFY:
+            code = minify('markup', code)
 
         # Check if template is in cache, and cache it if it's not.
-        cache_key = hashlib.sha1(self.code).hexdigest()
+        cache_key = hashlib.sha1(code).hexdigest()
         template = template_cache.get(cache_key)
         if not template:
-            template = JINJA_ENV.from_string(self.code)
+            template = JINJA_ENV.from_string(code)
             template_cache[cache_key] = template
-        return template.render(ctx)
+        return template
+
+    def render(self, ctx):
+        ctx.setdefault('snippet_id', 0)
+        return self.compile().render(ctx)
 
     def __unicode__(self):
         return self.name
@@ -442,16 +832,111 @@ class Snippet(CachingMixin, SnippetBaseModel):
 
         return data
 
-    def render(self):
-        data = json.loads(self.data)
+    def fragment_key(self):
+        """Return the json_fragment_cache key of the snippet."""
+        return u'{0}:{1}:{2}:{3}'.format(self.id, self.modified.isoformat(), self.template_id,
+                                         self.template.modified.isoformat())
+
+    def escaped_json(self):
+        """
+        Return the JSON of to_dict escaped for a JavaScript string
+        literal, from json_fragment_cache when possible.
+        """
+        key = self.fragment_key()
+        fragment = json_fragment_cache.get(key)
+        if fragment is None:
+            fragment = escapejs(json.dumps(self.to_dict()))
+            json_fragment_cache[key] = fragment
+        return fragment
+
+    def escaped_json_parts(self):
+        """
+        Return the escaped JSON fragments of the snippet used by
+        escaped_bundle_json, from json_fragment_cache when possible.
+
+        The fragments are the one of escaped_json, the snippet JSON
+        without its code, left open for a markup reference, and the JSON
+        of the shared markup. The last two are None if the markup can't
+        be shared.
+        """
+        key = u'parts:' + self.fragment_key()
+        parts = json_fragment_cache.get(key)
+        if parts is None:
+            fragment = self.escaped_json()
+            markup = self.shared_markup()
+            if markup is None:
+                parts = (fragment, None, None)
+            else:
+                data = self.to_dict()
+                del data['code']
+                data['code_attrs'] = self.render_attrs()
+                parts = (fragment, escapejs(json.dumps(data)[:-1]),
+                         escapejs(json.dumps(markup)))
+            json_fragment_cache[key] = parts
+        return parts
+
+    def shared_markup(self):
+        """
+        Return the rendered template with SNIPPET_ID_PLACEHOLDER in place
+        of the snippet ID, or None if the output depends on the ID in
+        other ways than being printed.
+        """
         snippet_id = self.id or 0
+        try:
+            markup = self.render_template(SNIPPET_ID_PLACEHOLDER)
+        except Exception:
+            # Templates may use the ID in ways that fail for anything
+            # but a number.
+            return None
+        content = self.render_template(snippet_id)
+        if markup.replace(SNIPPET_ID_PLACEHOLDER, unicode(snippet_id)) != content:
+            return None
+        return markup
+
+    def render_data(self, snippet_id):
+        """
+        Return the template data of the snippet for snippet_id, from
+        render_data_cache when possible. The result is shared and must
+        not be modified.
+        """
+        if not self.id:
+            return self._render_data(snippet_id)
+
+        key = (self.id, self.modified.isoformat(), snippet_id)
+        data = render_data_cache.get(key)
+        if data is None:
+            data = render_data_cache[key] = self._render_data(snippet_id)
+        return data
+
+    def _render_data(self, snippet_id):
+        data = json.loads(self.data)
         data.setdefault('snippet_id', snippet_id)
 
         # Add snippet ID to template variables.
-        for key, value in data.items():
+        for name, value in data.items():
             if isinstance(value, basestring):
-                data[key] = value.replace(u'[[snippet_id]]', unicode(snippet_id))
+                data[name] = value.replace(u'[[snippet_id]]', unicode(snippet_id))
+        return data
 
+    def render_template(self, snippet_id):
+        """Render the template of the snippet with its data."""
+        return self.template.render(self.render_data(snippet_id))
+
+    def render_attrs(self):
+        """
+        Return the attributes of the element wrapping the snippet, from
+        render_attrs_cache when possible.
+        """
+        if not self.id:
+            return self._render_attrs()
+
+        key = (self.id, self.modified.isoformat())
+        attrs = render_attrs_cache.get(key)
+        if attrs is None:
+            attrs = render_attrs_cache[key] = self._render_attrs()
+        return attrs
+
+    def _render_attrs(self):
         # Use a list for attrs to make the output order predictable.
         attrs = [('data-snippet-id', self.id),
                  ('data-weight', self.weight),
@@ -472,12 +957,12 @@ class Snippet(CachingMixin, SnippetBaseModel):
                 attrs.append(('data-exclude-from-search-engines',
                               u','.join(search_engine_identifiers)))
 
-        attr_string = u' '.join(u'{0}="{1}"'.format(key, value) for key, value in
-                                attrs)
+        return u' '.join(u'{0}="{1}"'.format(key, value) for key, value in attrs)
 
+    def render(self):
         rendered_snippet = u'<div {attrs}>{content}</div>'.format(
-            attrs=attr_string,
-            content=self.template.render(data)
+            attrs=self.render_attrs(),
+            content=self.render_template(self.id or 0)
         )
 
         return Markup(rendered_snippet)
@@ -496,12 +981,107 @@ class Snippet(CachingMixin, SnippetBaseModel):
     def get_absolute_url(self):
         return reverse('base.show', kwargs={'snippet_id': self.id})
 
+    def extract_images(self):
+        """Move the images inlined in the snippet data to UploadedFiles."""
+        if 'data:image/' not in self.data:
+            return
+
+        data = json.loads(self.data)
+        for key, value in data.items():
+            if isinstance(value, basestring):
+                data[key] = extract_images(value)
+        self.data = json.dumps(data)
+
     def save(self, *args, **kwargs):
         if self.client_options is None:
             self.client_options = {}
+        if settings.SNIPPET_EXTRACT_IMAGES:
+            self.extract_images()
         return super(Snippet, self).save(*args, **kwargs)
 
 
+class SnippetRecord(object):
+    """
+    Read-only stand-in for a Snippet in bundles, holding only the fields
+    needed to match and serve it. Built in bulk by
+    SnippetQuerySet.records().
+
+    The JSON of the snippet comes from json_fragment_cache. The Snippet
+    itself is only loaded to render it when the cache misses, see
+    load_snippets().
+    """
+    FIELDS = ('id', 'modified', 'template_id', 'template__modified',
+              'publish_start', 'publish_end', 'weight')
+
+    __slots__ = ('id', 'modified', 'template_id', 'template_modified',
+                 'publish_start', 'publish_end', 'weight', '_snippet')
+
+    def __init__(self, id, modified, template_id, template_modified, publish_start,
+                 publish_end, weight):
+        self.id = id
+        self.modified = modified
+        self.template_id = template_id
+        self.template_modified = template_modified
+        self.publish_start = publish_start
+        self.publish_end = publish_end
+        self.weight = weight
+        self._snippet = None
+
+    def __repr__(self):
+        return '<SnippetRecord: {0}>'.format(self.id)
+
+    @property
+    def snippet(self):
+        if self._snippet is None:
+            load_snippets([self])
+        return self._snippet
+
+    def fragment_key(self):
+        """Return the json_fragment_cache key of the snippet."""
+        return u'{0}:{1}:{2}:{3}'.format(self.id, self.modified.isoformat(), self.template_id,
+                                         self.template_modified.isoformat())
+
+    def escaped_json(self):
+        """Return the escaped JSON of the snippet, see Snippet.escaped_json."""
+        fragment = json_fragment_cache.get(self.fragment_key())
+        if fragment is None:
+            fragment = self.snippet.escaped_json()
+        return fragment
+
+    def escaped_json_parts(self):
+        """Return the escaped JSON parts, see Snippet.escaped_json_parts."""
+        parts = json_fragment_cache.get(u'parts:' + self.fragment_key())
+        if parts is None:
+            parts = self.snippet.escaped_json_parts()
+        return parts
+
+
+def load_snippets(records, key_prefix=None):
+    """
+    Load the Snippets of records in a single query.
+
+    With key_prefix, only the records with no fragment in
+    json_fragment_cache under that prefix are loaded. Other items of
+    records, like Snippets, are skipped.
+    """
+    missing = {}
+    for record in records:
+        if not isinstance(record, SnippetRecord) or record._snippet is not None:
+            continue
+        if (key_prefix is not None and
+                key_prefix + record.fragment_key() in json_fragment_cache):
+            continue
+        missing[record.id] = record
+
+    if missing:
+        snippets = (Snippet.cached_objects
+                    .filter(id__in=missing.keys())
+                    .select_related('template')
+                    .prefetch_related('countries', 'exclude_from_search_providers'))
+        for snippet in snippets:
+            missing[snippet.id]._snippet = snippet
+
+
 class JSONSnippet(CachingMixin, SnippetBaseModel):
     name = models.CharField(max_length=255, unique=True)
     priority = models.IntegerField(default=0, blank=True)
@@ -546,6 +1126,15 @@ class JSONSnippet(CachingMixin, SnippetBaseModel):
     def __unicode__(self):
         return self.name
 
+    def extract_images(self):
+        """Move the icon to an UploadedFile if it is inlined."""
+        self.icon = extract_images(self.icon)
+
+    def save(self, *args, **kwargs):
+        if settings.SNIPPET_EXTRACT_IMAGES:
+            self.extract_images()
+        return super(JSONSnippet, self).save(*args, **kwargs)
+
 
 def _generate_filename(instance, filename):
     """Generate a new unique filename while preserving the original
@@ -589,6 +1178,50 @@ class UploadedFile(models.Model):
             models.Q(template__code__contains=self.file.url)
         )
 
+    @classmethod
+    def from_content(cls, content, ext):
+        """
+        Return an UploadedFile holding content, creating it if needed.
+
+        Files are named after the hash of their content, so identical
+        content is only stored once.
+        """
+        filename = hashlib.sha1(content).hexdigest() + ext
+        path = os.path.join(settings.MEDIA_FILES_ROOT, filename)
+        uploaded_file = cls.objects.filter(file=path).first()
+        if uploaded_file is None:
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(content))
+            uploaded_file = cls.objects.create(file=path, name=filename)
+        return uploaded_file
+
+
+# Base64 encoded images inlined as data URIs.
+IMAGE_DATA_URI = re.compile(
+    r'data:image/(?P<type>png|jpeg|gif|svg\+xml);base64,(?P<data>[A-Za-z0-9+/]+={0,2})')
+IMAGE_EXTENSIONS = {
+    'png': '.png',
+    'jpeg': '.jpg',
+    'gif': '.gif',
+    'svg+xml': '.svg',
+}
+
+
+def extract_images(value):
+    """
+    Replace the base64 encoded images inlined in value with the URLs of
+    UploadedFiles holding the same images.
+    """
+    def replace(match):
+        try:
+            content = base64.b64decode(match.group('data'))
+        except TypeError:
+            return match.group(0)
+        ext = IMAGE_EXTENSIONS[match.group('type')]
+        return UploadedFile.from_content(content, ext).url
+
+    return IMAGE_DATA_URI.sub(replace, value)
+
 
 class SearchProvider(CachingMixin, models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -630,3 +1263,67 @@ class TargetedLocale(models.Model):
 
     def __str__(self):
         return u'{} ({})'.format(self.name, self.code)
+
+
+def touch_snippets(snippets):
+    """
+    Update the modification date of snippets, so that caches keyed by
+    it pick up changes to their countries and search providers.
+    """
+    snippets = list(snippets)
+    if snippets:
+        modified = timezone.now()
+        Snippet.objects.filter(id__in=[snippet.id for snippet in snippets]).update(
+            modified=modified)
+        for snippet in snippets:
+            snippet.modified = modified
+        # Snippet has no CachingManager to do it on save.
+        invalidator.invalidate_objects(snippets)
+
+
+# Connected before bump_data_generation_on_change, so that the records
+# of the new generation have the new modification dates.
+@receiver(m2m_changed, sender=Snippet.countries.through)
+@receiver(m2m_changed, sender=Snippet.exclude_from_search_providers.through)
+def touch_snippets_on_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # Clearing doesn't tell which objects were removed, so touch before.
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if reverse:
+        snippets = (instance.snippet_set.all() if pk_set is None else
+                    Snippet.objects.filter(id__in=pk_set))
+        related = [instance]
+    else:
+        snippets = [instance]
+        related = (model.objects.no_cache().filter(snippet=instance) if pk_set is None else
+                   model.objects.no_cache().filter(id__in=pk_set))
+    touch_snippets(snippets)
+    # Flush the cached queries of the related objects, prefetches
+    # included, which cache-machine doesn't do for m2m changes.
+    invalidator.invalidate_objects(list(related))
+
+
+@receiver(post_save, sender=TargetedCountry)
+@receiver(post_save, sender=SearchProvider)
+@receiver(pre_delete, sender=TargetedCountry)
+@receiver(pre_delete, sender=SearchProvider)
+def touch_snippets_on_change(sender, instance, **kwargs):
+    touch_snippets(instance.snippet_set.all())
+
+
+# Models that affect which snippets a client gets or how they are
+# rendered. Changing any of them starts a new data generation.
+TARGETING_MODELS = (Snippet, JSONSnippet, SnippetTemplate, ClientMatchRule,
+                    SearchProvider, TargetedCountry, TargetedLocale)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(m2m_changed)
+def bump_data_generation_on_change(sender, instance, action=None, **kwargs):
+    if action and not action.startswith('post_'):
+        return
+
+    if isinstance(instance, TARGETING_MODELS):
+        bump_data_generation()
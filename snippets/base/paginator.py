@@ -0,0 +1,123 @@
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.http import urlencode
+
+from snippets.base.cache import cache_layer, get_data_generation
+from snippets.base.util import decode_cursor, encode_cursor
+
+
+# Cached counts are keyed by the data generation, the timeout only
+# bounds how long superseded counts linger.
+COUNT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Counts of index listings in the default cache.
+index_counts = cache_layer('index-counts')
+
+
+def count_cache_key(model, params):
+    """
+    Return the cache key for the count of the model listing filtered
+    with params, a list of (name, value) pairs.
+    """
+    params_hash = hashlib.sha1(urlencode(sorted(params))).hexdigest()
+    return 'index_count:{0}:{1}:{2}'.format(model._meta.model_name, get_data_generation(),
+                                            params_hash)
+
+
+def encode_position(obj, index):
+    """
+    Encode the position of obj, the index-th object of a listing, into
+    a cursor.
+    """
+    return encode_cursor(obj.modified, obj.pk, index)
+
+
+def decode_position(cursor):
+    """
+    Return the (modified, pk, index) tuple encoded in cursor. Raises
+    ValueError if the cursor is malformed.
+    """
+    position = decode_cursor(cursor)
+    if len(position) != 3 or position[2] < 0:
+        raise ValueError('Invalid cursor: {0}'.format(cursor))
+    return position
+
+
+class KeysetPage(Page):
+    def cursor_for(self, number):
+        """
+        Return the cursor that leads from this page to the page with
+        the given number, or None if that page is reached without one.
+        """
+        if number in (1, self.number, self.paginator.num_pages) or not self.object_list:
+            return None
+        if number > self.number:
+            return encode_position(self.object_list[-1], self.end_index() - 1)
+        return encode_position(self.object_list[0], self.start_index() - 1)
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator for listings of snippets ordered by modification date.
+
+    Pages are looked up from a cursor that marks the position of a
+    snippet on a nearby page, so the database seeks to the page with an
+    index instead of scanning past every snippet before it, and page N
+    costs the same as page 1. The first and last pages never need a
+    cursor; without one other pages fall back to OFFSET.
+
+    If count_key is given, the total count is cached under it.
+    """
+    def __init__(self, object_list, per_page, cursor=None, count_key=None):
+        super(KeysetPaginator, self).__init__(object_list.order_by('-modified', '-id'),
+                                              per_page)
+        self.position = None
+        if cursor:
+            try:
+                self.position = decode_position(cursor)
+            except ValueError:
+                # Fall back to OFFSET for stale or tampered cursors.
+                pass
+        self.count_key = count_key
+
+    def _get_count(self):
+        if self._count is None:
+            count = index_counts.get(cache, self.count_key) if self.count_key else None
+            if count is None:
+                count = self.object_list.count()
+                if self.count_key:
+                    cache.set(self.count_key, count, COUNT_CACHE_TIMEOUT)
+            self._count = count
+        return self._count
+    count = property(_get_count)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = min(bottom + self.per_page, self.count)
+        size = top - bottom
+
+        if self.position and self.position[2] < bottom:
+            modified, pk, index = self.position
+            following = self.object_list.filter(Q(modified__lt=modified) |
+                                                Q(modified=modified, id__lt=pk))
+            offset = bottom - index - 1
+            object_list = list(following[offset:offset + size])
+        elif self.position and self.position[2] >= top:
+            modified, pk, index = self.position
+            preceding = (self.object_list
+                         .filter(Q(modified__gt=modified) | Q(modified=modified, id__gt=pk))
+                         .order_by('modified', 'id'))
+            offset = index - top
+            object_list = list(preceding[offset:offset + size])[::-1]
+        elif number > 1 and number == self.num_pages:
+            object_list = list(self.object_list.reverse()[:size])[::-1]
+        else:
+            object_list = list(self.object_list[bottom:top])
+        return self._get_page(object_list, number, self)
+
+    def _get_page(self, *args, **kwargs):
+        return KeysetPage(*args, **kwargs)
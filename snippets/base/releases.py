@@ -0,0 +1,44 @@
+from product_details import product_details
+from product_details.version_compare import version_list
+
+
+class ReleaseInfo(object):
+    """
+    Firefox release information derived from the product details major
+    release history.
+
+    Parsing and sorting the history is done once per product details
+    refresh: product details data lives in a SimpleDictCache, which
+    hands out the same object until the data is loaded again, so the
+    derived values are recomputed only when that object changes.
+    """
+    def __init__(self):
+        self._state = (None, [], None, [])
+
+    def _get_state(self):
+        history = product_details.firefox_history_major_releases
+        state = self._state
+        if state[0] is not history:
+            versions = version_list(history)
+            current_version = versions[0].split('.', 1)[0] if versions else None
+            state = (history, versions, current_version, [(v, v) for v in versions])
+            self._state = state
+        return state
+
+    @property
+    def major_versions(self):
+        """Major release versions, newest first."""
+        return self._get_state()[1]
+
+    @property
+    def current_version(self):
+        """Major version number of the current release, e.g. '45'."""
+        return self._get_state()[2]
+
+    @property
+    def version_choices(self):
+        """Form choices for the major release versions."""
+        return self._get_state()[3]
+
+
+release_info = ReleaseInfo()
@@ -0,0 +1,41 @@
+// about:home injects the bundle with innerHTML and only runs the text of
+// its script tags, so a script tag loading the runtime would be ignored.
+// Fetch the runtime instead and run it from the text of a new script tag,
+// like the inline runtime. This happens asynchronously, after the rest of
+// the bundle. If the request fails, for example offline with a cached
+// bundle, no snippet is shown and the failure is reported as a metric.
+(function() {
+    'use strict';
+
+    function reportFailure() {
+        if (!SNIPPET_METRICS_URL || Math.random() > {{ settings.METRICS_SAMPLE_RATE }}) {
+            return;
+        }
+        {% if check_telemetry %}
+        if (!gSnippetsMap.get('appData.telemetryEnabled')) {
+            return;
+        }
+        {% endif %}
+        var report = new XMLHttpRequest();
+        report.open('GET', (SNIPPET_METRICS_URL + '?metric=runtime-load-failed' +
+                            '&locale=' + SNIPPET_LOCALE + '&status=' + request.status));
+        report.send();
+    }
+
+    var request = new XMLHttpRequest();
+    request.onreadystatechange = function() {
+        if (request.readyState != 4) {
+            return;
+        }
+        if (request.status == 200) {
+            var runtime = document.createElement('script');
+            runtime.type = 'application/javascript';
+            runtime.text = request.responseText;
+            document.body.appendChild(runtime);
+        } else {
+            reportFailure();
+        }
+    };
+    request.open('GET', '{{ runtime_url|escapejs }}', true);
+    request.send();
+})();
@@ -1,7 +1,6 @@
 'use strict';
 
 var SNIPPET_METRICS_SAMPLE_RATE = {{ settings.METRICS_SAMPLE_RATE }};
-var SNIPPET_METRICS_URL = '{{ metrics_url }}';
 var ABOUTHOME_SHOWN_SNIPPET = null;
 var USER_COUNTRY = null;
 var GEO_CACHE_DURATION = 1000 * 60 * 60 * 24 * 30; // 30 days
@@ -124,6 +123,8 @@ Mozilla.UITour.setConfiguration = function(configName, configValue) {
 
 
     var show_snippet = null;
+    expandSnippetMarkup(ABOUTHOME_SNIPPETS, ABOUTHOME_SNIPPET_MARKUP);
+    applySnippetWeights(ABOUTHOME_SNIPPETS, ABOUTHOME_SNIPPET_WEIGHTS);
     if (ABOUTHOME_SNIPPETS.length > 0) {
         show_snippet = chooseSnippet(ABOUTHOME_SNIPPETS);
     }
@@ -181,6 +182,27 @@ Mozilla.UITour.setConfiguration = function(configName, configValue) {
         downloadUserCountry();
     }
 
+    // Snippets in bundles may share their rendered markup, which is sent
+    // once with a placeholder for the snippet ID.
+    function expandSnippetMarkup(snippets, markup) {
+        snippets.forEach(function(snippet) {
+            if (typeof snippet.markup === 'number') {
+                var content = markup[snippet.markup].split('[[snippet_id]]').join(snippet.id);
+                snippet.code = '<div ' + snippet.code_attrs + '>' + content + '</div>';
+            }
+        });
+    }
+
+    // Bundles split into variants hold a sample of the snippets, with
+    // weights that keep the odds of showing each snippet the same.
+    function applySnippetWeights(snippets, weights) {
+        snippets.forEach(function(snippet) {
+            if (weights.hasOwnProperty(snippet.id)) {
+                snippet.weight = weights[snippet.id];
+            }
+        });
+    }
+
     {% if preview %}
     function chooseSnippet(snippets) {
         return snippets[0];
@@ -664,7 +686,7 @@ function sendMetric(metric, callback, href) {
           return;
       }
 
-      var locale = '{{ locale }}';
+      var locale = SNIPPET_LOCALE;
       var userCountry = USER_COUNTRY || '';
       var campaign = ABOUTHOME_SHOWN_SNIPPET.campaign;
       var snippet_id = ABOUTHOME_SHOWN_SNIPPET.id;
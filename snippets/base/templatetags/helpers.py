@@ -4,12 +4,13 @@ try:
 except ImportError:
     import urlparse
 
-from django.template.defaultfilters import escapejs_filter
-
+from django.conf import settings
 from django_jinja import library
 from django.utils.http import urlencode
 from jinja2 import Markup
 
+from snippets.base import minify, util
+
 
 @library.global_function
 def thisyear():
@@ -53,4 +54,20 @@ def utcnow():
 
 @library.filter
 def escapejs(data):
-    return escapejs_filter(data)
+    return util.escapejs(data)
+
+
+@library.filter
+def minify_js(code):
+    """Minify JavaScript code if SNIPPET_MINIFY is enabled."""
+    if not settings.SNIPPET_MINIFY:
+        return code
+    return Markup(minify.minify('js', code))
+
+
+@library.filter
+def minify_css(code):
+    """Minify CSS code if SNIPPET_MINIFY is enabled."""
+    if not settings.SNIPPET_MINIFY:
+        return code
+    return Markup(minify.minify('css', code))
@@ -0,0 +1,132 @@
+from django.core.cache.backends.locmem import LocMemCache
+
+from mock import Mock, patch
+
+from snippets.base.cache import (CacheLayer, InstrumentedLRUCache, SimpleDictCache,
+                                 bump_data_generation, cache_layer, get_data_generation)
+from snippets.base.tests import TestCase
+
+
+class DataGenerationTests(TestCase):
+    def setUp(self):
+        self.cache = LocMemCache('data-generation', {})
+        patcher = patch('snippets.base.cache.cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_stable(self):
+        """Generation must not change between calls without data changes."""
+        self.assertEqual(get_data_generation(), get_data_generation())
+
+    def test_bump(self):
+        generation = get_data_generation()
+        new_generation = bump_data_generation()
+        self.assertNotEqual(generation, new_generation)
+        self.assertEqual(get_data_generation(), new_generation)
+
+    def test_bump_empty_cache(self):
+        """Bumping must start a generation even if the cache got flushed."""
+        generation = bump_data_generation()
+        self.assertEqual(get_data_generation(), generation)
+
+
+class CacheLayerTests(TestCase):
+    def setUp(self):
+        patcher = patch('snippets.base.cache.statsd')
+        self.statsd = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.layer = CacheLayer('test')
+
+    def test_get_hit(self):
+        backend = LocMemCache('cache-layer', {})
+        backend.set('foo', 'bar')
+        self.assertEqual(self.layer.get(backend, 'foo'), 'bar')
+        self.assertEqual((self.layer.hits, self.layer.misses), (1, 0))
+        self.assertTrue(self.statsd.timing.called)
+        self.layer.flush()
+        self.statsd.incr.assert_called_with('cache.test.hit', 1)
+
+    def test_get_miss(self):
+        backend = LocMemCache('cache-layer', {})
+        self.assertEqual(self.layer.get(backend, 'missing'), None)
+        self.assertEqual((self.layer.hits, self.layer.misses), (0, 1))
+        self.layer.flush()
+        self.statsd.incr.assert_called_with('cache.test.miss', 1)
+
+    @patch('snippets.base.cache.time.time')
+    def test_batches(self, time):
+        """Counts are sent to statsd at most every STATS_FLUSH_INTERVAL."""
+        time.return_value = 100
+        layer = CacheLayer('batch-test')
+        for key in ['a', 'b', 'c']:
+            layer.hit(key)
+        layer.miss('d')
+        self.assertFalse(self.statsd.incr.called)
+        self.assertFalse(self.statsd.timing.called)
+
+        time.return_value = 110
+        layer.evict(2)
+        self.assertEqual(sorted(call[0] for call in self.statsd.incr.call_args_list),
+                         [('cache.batch-test.eviction', 2), ('cache.batch-test.hit', 3),
+                          ('cache.batch-test.miss', 1)])
+        self.assertEqual(layer.unsent, {})
+
+    def test_hot_keys(self):
+        for key in ['a', 'b', 'b', 'c', 'c', 'c']:
+            self.layer.hit(key, 0)
+        self.assertEqual(self.layer.stats(hot_keys=2)['hot_keys'], [('c', 3), ('b', 2)])
+
+    @patch('snippets.base.cache.HOT_KEYS_TRACKED', 4)
+    def test_hot_keys_bounded(self):
+        for key in ['a', 'a', 'b', 'c', 'd', 'e']:
+            self.layer.hit(key, 0)
+        self.assertTrue(len(self.layer.hot_keys) <= 4)
+        self.assertEqual(self.layer.hot_keys.most_common(1), [('a', 2)])
+
+    def test_cache_layer_registry(self):
+        layer = cache_layer('registry-test')
+        self.assertTrue(cache_layer('registry-test') is layer)
+        size = Mock(return_value=5)
+        cache_layer('registry-test', size=size)
+        self.assertEqual(layer.stats()['size'], 5)
+
+
+class InstrumentedLRUCacheTests(TestCase):
+    def setUp(self):
+        self.cache = InstrumentedLRUCache(2, 'lru-test')
+        self.layer = self.cache.layer
+        self.layer.hits = self.layer.misses = self.layer.evictions = 0
+
+    def test_hit_miss(self):
+        self.cache['foo'] = 'bar'
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertEqual(self.cache.get('baz'), None)
+        self.assertEqual((self.layer.hits, self.layer.misses), (1, 1))
+
+    def test_eviction(self):
+        self.cache['a'] = 1
+        self.cache['b'] = 2
+        self.cache['b'] = 3
+        self.assertEqual(self.layer.evictions, 0)
+        self.cache['c'] = 4
+        self.assertEqual(self.layer.evictions, 1)
+        self.assertEqual(self.layer.stats()['size'], 2)
+
+
+class SimpleDictCacheMetricsTests(TestCase):
+    def test_hit_miss(self):
+        backend = SimpleDictCache('simple-dict-metrics', {})
+        backend.layer.hits = backend.layer.misses = 0
+        backend.set('foo', 'bar')
+        backend.get('foo')
+        backend.get('baz')
+        self.assertEqual((backend.layer.hits, backend.layer.misses), (1, 1))
+        self.assertEqual(backend.layer.stats()['size'], 1)
+
+    def test_cull(self):
+        backend = SimpleDictCache('simple-dict-cull', {
+            'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 2}})
+        backend.layer.evictions = 0
+        for key in ['a', 'b', 'c']:
+            backend.set(key, key)
+        self.assertEqual(backend.layer.evictions, 1)
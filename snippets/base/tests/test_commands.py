@@ -0,0 +1,37 @@
+import base64
+import json
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from mock import patch
+
+from snippets.base.models import UploadedFile
+from snippets.base.tests import JSONSnippetFactory, SnippetFactory, TestCase
+
+
+@override_settings(SITE_URL='http://example.com')
+@patch('snippets.base.models.default_storage')
+class ExtractImagesCommandTests(TestCase):
+    def test_extract_images(self, default_storage):
+        image_uri = 'data:image/png;base64,' + base64.b64encode('image' * 100)
+        snippets = SnippetFactory.create_batch(2, data=json.dumps({'image': image_uri}))
+        other_snippet = SnippetFactory.create(data=json.dumps({'text': 'foo'}))
+        json_snippet = JSONSnippetFactory.create(icon=image_uri)
+
+        stdout = StringIO()
+        call_command('extract_images', stdout=stdout)
+
+        url = UploadedFile.objects.get().url
+        for snippet in snippets:
+            snippet.refresh_from_db()
+            self.assertEqual(json.loads(snippet.data), {'image': url})
+        json_snippet.refresh_from_db()
+        self.assertEqual(json_snippet.icon, url)
+        other_snippet.refresh_from_db()
+        self.assertEqual(other_snippet.data, json.dumps({'text': 'foo'}))
+
+        saved = 3 * (len(image_uri) - len(url))
+        self.assertTrue(stdout.getvalue().endswith(
+            'Total: {0} data bytes saved\n'.format(saved)))
@@ -0,0 +1,81 @@
+from django.test.utils import override_settings
+
+from mock import Mock, patch
+
+from snippets.base.csp import CSPReportAggregator
+from snippets.base.tests import TestCase
+
+
+@override_settings(SNIPPET_CSP_MESSAGES_PER_FLUSH=2, SNIPPET_CSP_MAX_BLOCKED_URIS=3)
+@patch('snippets.base.csp.threading', Mock())
+@patch('snippets.base.csp.sentry_client')
+class CSPReportAggregatorTests(TestCase):
+    def setUp(self):
+        self.aggregator = CSPReportAggregator()
+
+    def _add(self, blocked_uri, times=1):
+        for i in range(times):
+            self.aggregator.add(blocked_uri, lambda: {'request': {'url': blocked_uri}})
+
+    def test_summaries(self, sentry_client):
+        self._add('http://a.example.com', times=3)
+        self._add('http://b.example.com')
+        self.aggregator.flush()
+
+        sentry_client.captureMessage.assert_any_call(
+            message='CSP Violation: http://a.example.com',
+            data={'request': {'url': 'http://a.example.com'}, 'extra': {'reports': 3}})
+        sentry_client.captureMessage.assert_any_call(
+            message='CSP Violation: http://b.example.com',
+            data={'request': {'url': 'http://b.example.com'}, 'extra': {'reports': 1}})
+        self.assertEqual(sentry_client.captureMessage.call_count, 2)
+        self.assertEqual(self.aggregator.sent, 2)
+
+        sentry_client.reset_mock()
+        self.aggregator.flush()
+        self.assertFalse(sentry_client.captureMessage.called)
+
+    def test_non_ascii(self, sentry_client):
+        self._add(u'http://\xe9.example.com')
+        self.aggregator.flush()
+        sentry_client.captureMessage.assert_called_once_with(
+            message=u'CSP Violation: http://\xe9.example.com',
+            data={'request': {'url': u'http://\xe9.example.com'}, 'extra': {'reports': 1}})
+
+    def test_sample_data_once(self, sentry_client):
+        get_data = Mock(return_value={})
+        for i in range(5):
+            self.aggregator.add('http://a.example.com', get_data)
+        get_data.assert_called_once_with()
+
+    def test_rate_limit(self, sentry_client):
+        """Summaries beyond the flush limit wait for the next flush."""
+        self._add('http://a.example.com', times=3)
+        self._add('http://b.example.com', times=2)
+        self._add('http://c.example.com')
+        self.aggregator.flush()
+        self.assertEqual(sentry_client.captureMessage.call_count, 2)
+
+        self._add('http://c.example.com')
+        sentry_client.reset_mock()
+        self.aggregator.flush()
+        sentry_client.captureMessage.assert_called_once_with(
+            message='CSP Violation: http://c.example.com',
+            data={'request': {'url': 'http://c.example.com'}, 'extra': {'reports': 2}})
+
+    def test_max_blocked_uris(self, sentry_client):
+        for uri in ('a', 'b', 'c', 'd'):
+            self._add('http://{0}.example.com'.format(uri))
+        self._add('http://a.example.com')
+        self.assertEqual(self.aggregator.dropped, 1)
+        self.assertEqual(len(self.aggregator.counts), 3)
+        self.assertEqual(self.aggregator.counts['http://a.example.com'], 2)
+
+    def test_starts_thread_per_process(self, sentry_client):
+        with patch('snippets.base.csp.threading') as threading:
+            with patch('snippets.base.csp.os.getpid', return_value=1):
+                self._add('http://a.example.com', times=2)
+            threading.Thread.return_value.start.assert_called_once_with()
+            with patch('snippets.base.csp.os.getpid', return_value=2):
+                self._add('http://a.example.com')
+            self.assertEqual(threading.Thread.return_value.start.call_count, 2)
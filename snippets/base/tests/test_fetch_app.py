@@ -0,0 +1,140 @@
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mock import Mock, patch
+
+from snippets.base.tests import SnippetFactory, TestCase
+from snippets.wsgi.fetch import FetchApplication
+
+
+CLIENT_PATH = ('4/Firefox/23.0a1/20130510041606/Darwin_Universal-gcc3/en-US/release/'
+               'Darwin%2010.8.0/default/default_version/')
+
+
+class FetchApplicationTests(TestCase):
+    def setUp(self):
+        self.django_app = Mock(side_effect=self._django_app)
+        self.app = FetchApplication(self.django_app, size=10)
+        self.response_headers = [('Content-Type', 'text/html'), ('Content-Length', '3'),
+                                 ('ETag', '"asdf"')]
+        self.response_status = '200 OK'
+        patcher = patch('snippets.wsgi.fetch.client_etag', return_value='asdf')
+        self.client_etag = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _django_app(self, environ, start_response):
+        start_response(self.response_status, self.response_headers)
+        return ['f', 'oo']
+
+    def _request(self, path, method='get', **headers):
+        environ = getattr(RequestFactory(), method)(path, **headers).environ
+        start_response = Mock()
+        body = ''.join(self.app(environ, start_response))
+        status, headers = start_response.call_args[0]
+        return status, headers, body
+
+    def test_unicode_path(self):
+        """Paths are decoded as UTF-8 before building the client."""
+        environ = RequestFactory().get('/').environ
+        environ['PATH_INFO'] = '/' + CLIENT_PATH.replace('en-US', '\xc3\xa9')
+        start_response = Mock()
+        self.assertEqual(''.join(self.app(environ, start_response)), 'foo')
+        client = self.client_etag.call_args[0][1]
+        self.assertEqual(client.locale, u'\xe9')
+
+    def test_undecodable_path(self):
+        environ = RequestFactory().get('/').environ
+        environ['PATH_INFO'] = '/' + CLIENT_PATH.replace('en-US', '\xff')
+        start_response = Mock()
+        self.app(environ, start_response)
+        self.assertEqual(start_response.call_args[0][0], '404 Not Found')
+        self.assertTrue(not self.django_app.called)
+
+    def test_not_fetch_url(self):
+        status, headers, body = self._request('/admin/')
+        self.assertEqual(body, 'foo')
+        self.assertEqual(self.django_app.call_count, 1)
+
+    def test_post(self):
+        self._request('/' + CLIENT_PATH, method='post')
+        self._request('/' + CLIENT_PATH, method='post')
+        self.assertEqual(self.django_app.call_count, 2)
+
+    def test_snapshot(self):
+        """Only the first request for a client reaches Django."""
+        first = self._request('/' + CLIENT_PATH)
+        second = self._request('/' + CLIENT_PATH)
+        self.assertEqual(first, ('200 OK', self.response_headers, 'foo'))
+        self.assertEqual(second, first)
+        self.assertEqual(self.django_app.call_count, 1)
+
+    def test_snapshot_keyed_by_etag(self):
+        self._request('/' + CLIENT_PATH)
+        self.client_etag.return_value = 'qwer'
+        self._request('/' + CLIENT_PATH)
+        self.assertEqual(self.django_app.call_count, 2)
+
+    @override_settings(SERVE_SNIPPET_BUNDLES=False)
+    def test_etag_kind(self):
+        self._request('/' + CLIENT_PATH)
+        self.assertEqual(self.client_etag.call_args[0][0], 'render')
+        self._request('/json/' + CLIENT_PATH)
+        self.assertEqual(self.client_etag.call_args[0][0], 'json')
+        with self.settings(SERVE_SNIPPET_BUNDLES=True):
+            self._request('/' + CLIENT_PATH)
+        self.assertEqual(self.client_etag.call_args[0][0], 'bundle')
+        self.assertEqual(self.client_etag.call_args[0][1].locale, 'en-US')
+
+    def test_not_modified(self):
+        self._request('/' + CLIENT_PATH)
+        status, headers, body = self._request('/' + CLIENT_PATH, HTTP_IF_NONE_MATCH='"asdf"')
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(headers, [('ETag', '"asdf"')])
+        self.assertEqual(body, '')
+
+    def test_head(self):
+        """HEAD requests are served from the snapshot but never fill it."""
+        status, headers, body = self._request('/' + CLIENT_PATH, method='head')
+        self.assertEqual(self.django_app.call_count, 1)
+        self._request('/' + CLIENT_PATH)
+        status, headers, body = self._request('/' + CLIENT_PATH, method='head')
+        self.assertEqual(self.django_app.call_count, 2)
+        self.assertEqual((status, headers, body), ('200 OK', self.response_headers, ''))
+
+    def test_errors_not_stored(self):
+        self.response_status = '500 Internal Server Error'
+        status, headers, body = self._request('/' + CLIENT_PATH)
+        self.assertEqual((status, body), ('500 Internal Server Error', 'foo'))
+        self._request('/' + CLIENT_PATH)
+        self.assertEqual(self.django_app.call_count, 2)
+
+    def test_cookies_not_stored(self):
+        self.response_headers.append(('Set-Cookie', 'foo=bar'))
+        self._request('/' + CLIENT_PATH)
+        self._request('/' + CLIENT_PATH)
+        self.assertEqual(self.django_app.call_count, 2)
+
+
+@override_settings(SERVE_SNIPPET_BUNDLES=False, CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FetchApplicationDjangoTests(TestCase):
+    def test_same_response(self):
+        """Snapshot responses must be the ones of the Django stack."""
+        from django.core.wsgi import get_wsgi_application
+
+        SnippetFactory.create(on_release=True)
+        django_app = get_wsgi_application()
+        app = FetchApplication(django_app, size=10)
+        environ = RequestFactory().get('/' + CLIENT_PATH).environ
+
+        responses = []
+        for application in [django_app, app, app]:
+            start_response = Mock()
+            body = ''.join(application(dict(environ), start_response))
+            status, headers = start_response.call_args[0]
+            responses.append((status, sorted(headers), body))
+
+        # Bodies differ between renders by their generation timestamp.
+        self.assertEqual(responses[0][0], '200 OK')
+        self.assertEqual(responses[1][:2], responses[0][:2])
+        self.assertEqual(responses[2], responses[1])
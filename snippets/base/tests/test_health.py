@@ -0,0 +1,105 @@
+import time
+
+from django.test.utils import override_settings
+
+from mock import Mock, patch
+
+from snippets.base.health import HealthStatus, health_status, readiness, run_checks
+from snippets.base.tests import SnippetFactory, TestCase
+
+
+class RunChecksTests(TestCase):
+    def test_ok(self):
+        SnippetFactory.create()
+        with patch('snippets.base.health.cache') as cache:
+            cache.get.side_effect = lambda key: cache.set.call_args[0][1]
+            dependencies = run_checks()
+        self.assertEqual(dependencies.keys(), ['database', 'cache', 'storage'])
+        for dependency in dependencies.values():
+            self.assertTrue(dependency['ok'])
+            self.assertEqual(sorted(dependency.keys()), ['latency', 'ok'])
+            self.assertTrue(dependency['latency'] >= 0)
+
+    @patch('snippets.base.health.sentry_client')
+    def test_failing(self, sentry_client):
+        with patch('snippets.base.health.default_storage') as default_storage:
+            default_storage.exists.side_effect = IOError('Access denied to s3.internal')
+            dependencies = run_checks()
+        self.assertFalse(dependencies['database']['ok'])
+        self.assertFalse(dependencies['storage']['ok'])
+        self.assertFalse('s3.internal' in repr(dependencies))
+        failed = [call[1]['extra']['dependency']
+                  for call in sentry_client.captureException.call_args_list]
+        self.assertTrue('database' in failed)
+        self.assertTrue('storage' in failed)
+
+    @patch('snippets.base.health.sentry_client')
+    def test_non_ascii_error(self, sentry_client):
+        with patch('snippets.base.health.default_storage') as default_storage:
+            default_storage.exists.side_effect = IOError('Zugriff verweigert f\xc3\xbcr')
+            dependencies = run_checks()
+        self.assertFalse(dependencies['storage']['ok'])
+
+
+@override_settings(SNIPPET_HEALTH_REFRESH_INTERVAL=10)
+class HealthStatusTests(TestCase):
+    def test_first_read_refreshes(self):
+        status = HealthStatus()
+        with patch('snippets.base.health.run_checks', return_value={'database': {}}):
+            record = status.get()
+        self.assertEqual(record['dependencies'], {'database': {}})
+        self.assertTrue(status.record is record)
+
+    def test_fresh_record(self):
+        status = HealthStatus()
+        status.record = {'dependencies': {}, 'updated': time.time()}
+        with patch('snippets.base.health.threading') as threading:
+            with self.assertNumQueries(0):
+                self.assertTrue(status.get() is status.record)
+        self.assertFalse(threading.Thread.called)
+
+    def test_stale_record(self):
+        """Stale records are refreshed in the background, once."""
+        status = HealthStatus()
+        record = {'dependencies': {}, 'updated': time.time() - 10}
+        status.record = record
+        with patch('snippets.base.health.threading') as threading:
+            self.assertTrue(status.get() is record)
+            self.assertTrue(status.get() is record)
+        threading.Thread.assert_called_once_with(target=status._refresh_in_background)
+        threading.Thread.return_value.start.assert_called_once_with()
+
+        with patch('snippets.base.health.run_checks', return_value={'database': {}}):
+            with patch('snippets.base.health.connections') as connections:
+                status._refresh_in_background()
+        self.assertEqual(status.record['dependencies'], {'database': {}})
+        self.assertFalse(status.refreshing)
+        connections.close_all.assert_called_with()
+
+
+class ReadinessTests(TestCase):
+    def _readiness(self, database=True, cache=True, storage=True):
+        dependencies = {
+            'database': {'ok': database},
+            'cache': {'ok': cache},
+            'storage': {'ok': storage},
+        }
+        record = {'dependencies': dependencies, 'updated': time.time()}
+        with patch.object(health_status, 'get', Mock(return_value=record)):
+            return readiness()
+
+    def test_ok(self):
+        report = self._readiness()
+        self.assertTrue(report['ready'])
+        self.assertEqual(report['status'], 'ok')
+
+    def test_degraded(self):
+        for failing in ('database', 'cache', 'storage'):
+            report = self._readiness(**{failing: False})
+            self.assertTrue(report['ready'])
+            self.assertEqual(report['status'], 'degraded')
+
+    def test_unavailable(self):
+        report = self._readiness(database=False, cache=False)
+        self.assertFalse(report['ready'])
+        self.assertEqual(report['status'], 'unavailable')
@@ -1,12 +1,29 @@
 from datetime import datetime
 
-from mock import patch
+from django.test.utils import override_settings
+
+from mock import ANY, patch
 
 from snippets.base.models import Client, ClientMatchRule, JSONSnippet, Snippet
 from snippets.base.tests import ClientMatchRuleFactory, SnippetFactory, TestCase
 from snippets.base.util import first
 
 
+class MeteredCachingQuerySetTests(TestCase):
+    @patch('snippets.base.managers.cache_layer')
+    def test_miss(self, cache_layer):
+        SnippetFactory.create_batch(2)
+        self.assertEqual(len(list(Snippet.cached_objects.all())), 2)
+        cache_layer.return_value.miss.assert_called_once_with('Snippet', ANY)
+        self.assertTrue(not cache_layer.return_value.hit.called)
+
+    @patch('snippets.base.managers.cache_layer')
+    def test_empty(self, cache_layer):
+        self.assertEqual(list(Snippet.cached_objects.all()), [])
+        self.assertTrue(not cache_layer.return_value.miss.called)
+        self.assertTrue(not cache_layer.return_value.hit.called)
+
+
 class ClientMatchRuleQuerySetTests(TestCase):
     manager = ClientMatchRule.cached_objects
 
@@ -52,6 +69,36 @@ class SnippetQuerySetTests(TestCase):
 
         self.assertEqual(set([snippet_match_1, snippet_match_2]), set(matching_snippets))
 
+    def test_records(self):
+        snippets = [SnippetFactory.create(priority=2), SnippetFactory.create(priority=1)]
+        records = self.manager.order_by('priority').records()
+        self.assertEqual([record.id for record in records], [snippets[1].id, snippets[0].id])
+        record = records[1]
+        self.assertEqual(record.modified, snippets[0].modified)
+        self.assertEqual(record.template_id, snippets[0].template_id)
+        self.assertEqual(record.template_modified, snippets[0].template.modified)
+        self.assertEqual(record.publish_start, None)
+        self.assertEqual(record.publish_end, None)
+        self.assertEqual(record.weight, snippets[0].weight)
+
+    def test_records_empty_query(self):
+        SnippetFactory.create()
+        self.assertEqual(self.manager.filter(id__in=[]).records(), [])
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_records_cached(self):
+        snippet = SnippetFactory.create()
+        self.manager.all().records()
+        with self.assertNumQueries(0):
+            records = self.manager.all().records()
+        self.assertEqual([record.id for record in records], [snippet.id])
+
+        # Changes start a new data generation.
+        other_snippet = SnippetFactory.create()
+        self.assertEqual(set(record.id for record in self.manager.all().records()),
+                         set([snippet.id, other_snippet.id]))
+
 
 class SnippetManagerTests(TestCase):
     def _build_client(self, **client_attrs):
@@ -245,3 +292,39 @@ class SnippetManagerTests(TestCase):
         # are the same snippets. Just `release_snippet` in this case.
         self.assertEqual(set([release_snippet]), set(release_snippets))
         self.assertEqual(set([release_snippet]), set(esr_snippets))
+
+    def test_match_clients(self):
+        """match_clients must agree with match_client for every client."""
+        rule_nightly = ClientMatchRuleFactory(channel='nightly')
+        rule_not_mac = ClientMatchRuleFactory(os_version='/Darwin.*/', is_exclusion=True)
+        SnippetFactory.create(on_nightly=True, client_match_rules=[rule_nightly])
+        SnippetFactory.create(on_release=True, on_nightly=True,
+                              client_match_rules=[rule_not_mac])
+        SnippetFactory.create(on_release=True, on_nightly=True,
+                              client_match_rules=[rule_nightly, rule_not_mac])
+        SnippetFactory.create(on_beta=True)
+        SnippetFactory.create(on_release=True, publish_end=datetime(2010, 1, 1))
+
+        clients = [
+            self._build_client(channel='nightly'),
+            self._build_client(channel='nightly', os_version='Windows_NT 6.1'),
+            self._build_client(channel='release'),
+            self._build_client(channel='release', os_version='Windows_NT 6.1'),
+            self._build_client(channel='beta'),
+            self._build_client(channel='nightly'),
+        ]
+        matches = Snippet.cached_objects.match_clients(clients)
+        self.assertEqual(set(matches.keys()), set(clients))
+        for client in clients:
+            self.assertEqual(
+                set(matches[client]),
+                set(Snippet.cached_objects.match_client(client).filter_by_available()))
+
+    def test_match_clients_shares_queries(self):
+        """Clients with the same database filters share one query."""
+        SnippetFactory.create(on_nightly=True)
+        clients = [self._build_client(channel='nightly', os_version=str(i)) for i in range(5)]
+        # One query for the snippets and one for their client match rules.
+        with self.assertNumQueries(2):
+            matches = Snippet.cached_objects.match_clients(clients)
+        self.assertEqual([len(matches[client]) for client in clients], [1] * 5)
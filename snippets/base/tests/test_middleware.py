@@ -1,62 +1,76 @@
-from mock import Mock, patch
+from mock import patch
 
+from django.core.urlresolvers import resolve
 from django.test import RequestFactory
 
+from snippets.base import views
 from snippets.base.middleware import FetchSnippetsMiddleware
 from snippets.base.tests import TestCase
 
 
+CLIENT_PATH = ('4/Firefox/23.0a1/20130510041606/Darwin_Universal-gcc3/en-US/release/'
+               'Darwin%2010.8.0/default/default_version/')
+
+
 class FetchSnippetsMiddlewareTests(TestCase):
     def setUp(self):
         self.middleware = FetchSnippetsMiddleware()
+        self.factory = RequestFactory()
 
-    @patch('snippets.base.middleware.resolve')
-    @patch('snippets.base.middleware.fetch_snippets')
-    def test_resolve_fetch_snippets_match(self, fetch_snippets, resolve):
+    def _assert_dispatch(self, path, view_name):
         """
-        If resolve returns a match to the fetch_snippets view, return the
-        result of the view.
+        The middleware must call the view that the urlconf resolves path
+        to, with the same arguments.
         """
-        request = Mock()
-        result = resolve.return_value
-        result.func = fetch_snippets
-        result.args = (1, 'asdf')
-        result.kwargs = {'blah': 5}
+        request = self.factory.get(path)
+        match = resolve(request.path_info)
+        with patch('snippets.base.middleware.{0}'.format(view_name)) as view:
+            self.assertEqual(self.middleware.process_request(request), view.return_value)
+        self.assertEqual(match.func, getattr(views, view_name))
+        view.assert_called_with(request, **match.kwargs)
 
-        self.assertEqual(self.middleware.process_request(request),
-                         fetch_snippets.return_value)
-        fetch_snippets.assert_called_with(request, 1, 'asdf', blah=5)
+    def test_fetch_snippets_match(self):
+        """
+        If the path is a fetch_snippets URL, return the result of the view.
+        """
+        self._assert_dispatch('/' + CLIENT_PATH, 'fetch_snippets')
 
-    @patch('snippets.base.middleware.resolve')
-    @patch('snippets.base.middleware.fetch_json_snippets')
-    def test_resolve_fetch_json_snippets_match(self, fetch_json_snippets, resolve):
+    def test_fetch_json_snippets_match(self):
         """
-        If resolve returns a match to the fetch_json_snippets view,
-        return the result of the view.
+        If the path is a fetch_json_snippets URL, return the result of the
+        view.
         """
-        request = Mock()
-        result = resolve.return_value
-        result.func = fetch_json_snippets
-        result.args = (1, 'asdf')
-        result.kwargs = {'blah': 5}
+        self._assert_dispatch('/json/' + CLIENT_PATH, 'fetch_json_snippets')
 
-        self.assertEqual(self.middleware.process_request(request),
-                         fetch_json_snippets.return_value)
-        fetch_json_snippets.assert_called_with(request, 1, 'asdf', blah=5)
+    def test_fetch_snippets_json_startpage(self):
+        """A fetch_snippets URL for startpage_version json is not JSON."""
+        self._assert_dispatch('/json/Firefox/23.0a1/20130510041606/Darwin_Universal-gcc3/'
+                              'en-US/release/Darwin%2010.8.0/default/default_version/',
+                              'fetch_snippets')
 
-    @patch('snippets.base.middleware.resolve')
-    @patch('snippets.base.middleware.fetch_snippets')
-    def test_resolve_no_match(self, fetch_snippets, resolve):
+    def test_fetch_snippets_batch_no_match(self):
         """
-        If resolve doesn't return a match to the fetch_snippets view, return
-        None.
+        The fetch_snippets_batch URL goes through the rest of the
+        middleware.
         """
-        request = Mock()
-        result = resolve.return_value
-        result.func = lambda request: 'asdf'
-
+        request = self.factory.post('/batch-fetch/')
         self.assertEqual(self.middleware.process_request(request), None)
 
+    @patch('snippets.base.middleware.fetch_snippets')
+    @patch('snippets.base.middleware.fetch_json_snippets')
+    def test_no_match(self, fetch_json_snippets, fetch_snippets):
+        """
+        If the path is not a fetch URL, return None without calling the
+        fetch views.
+        """
+        for path in ['/admin', '/admin/base/snippet/', '/' + CLIENT_PATH[:-1],
+                     '/' + CLIENT_PATH.replace('en-US', ''), '/foo/' + CLIENT_PATH,
+                     '/json/' + CLIENT_PATH[:-1], '/xml/' + CLIENT_PATH]:
+            request = self.factory.get(path)
+            self.assertEqual(self.middleware.process_request(request), None)
+        self.assertTrue(not fetch_snippets.called)
+        self.assertTrue(not fetch_json_snippets.called)
+
     def test_unknown_url(self):
         request = RequestFactory().get('/admin')
         self.assertEqual(self.middleware.process_request(request), None)
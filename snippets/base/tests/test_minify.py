@@ -0,0 +1,97 @@
+from django.test.utils import override_settings
+
+from mock import patch
+
+from snippets.base import minify
+from snippets.base.models import validate_xml_template
+from snippets.base.templatetags.helpers import minify_css, minify_js
+from snippets.base.tests import SnippetTemplateFactory, TestCase
+
+
+class MinifyJSTests(TestCase):
+    def test_basic(self):
+        code = u'\n'.join([
+            u'// A comment.',
+            u'(function() {',
+            u'    var url = "http://example.com"; // Not a whole line comment.',
+            u'',
+            u'    return url',
+            u'})();',
+        ])
+        self.assertEqual(minify.minify_js(code), u'\n'.join([
+            u'(function() {',
+            u'var url = "http://example.com"; // Not a whole line comment.',
+            u'return url',
+            u'})();',
+        ]))
+
+
+class MinifyCSSTests(TestCase):
+    def test_basic(self):
+        code = u'/* Header */\n#snippets .snippet {\n    color: red;\n    margin: 0 auto;\n}\n'
+        self.assertEqual(minify.minify_css(code), u'#snippets .snippet{color: red;margin: 0 auto;}')
+
+
+class MinifyMarkupTests(TestCase):
+    def test_collapse_text(self):
+        code = u'<div class="a  b">\n    <p>\n        Hello   world\n    </p>\n</div>\n'
+        self.assertEqual(minify.minify_markup(code),
+                         u'<div class="a  b"> <p> Hello world </p> </div> ')
+
+    def test_raw_text_elements(self):
+        code = (u'<p>  a  </p><script>\n  var a = 1;\n</script>'
+                u'<pre>  b\n  c</pre><p>  d  </p>')
+        self.assertEqual(minify.minify_markup(code),
+                         u'<p> a </p><script>\n  var a = 1;\n</script>'
+                         u'<pre>  b\n  c</pre><p> d </p>')
+
+    def test_attribute_with_gt(self):
+        code = u'<a title="a > b">  x  </a>'
+        self.assertEqual(minify.minify_markup(code), u'<a title="a > b"> x </a>')
+
+    def test_jinja(self):
+        code = (u'<p>  {{ "a  b" }}  {% if x  ==  "c  d" %}  e  {% endif %}'
+                u'{# f  g #}{% raw %}  {{  h  }}  {% endraw %}</p>')
+        self.assertEqual(minify.minify_markup(code),
+                         u'<p> {{ "a  b" }} {% if x  ==  "c  d" %} e {% endif %}'
+                         u'{# f  g #}{% raw %}  {{  h  }}  {% endraw %}</p>')
+
+    def test_still_valid_xml(self):
+        code = (u'<div>\n  <p>{{ text }}</p>\n  <!-- comment -->\n'
+                u'  <script>\n    if (a < b) {}\n  </script>\n</div>\n')
+        code = code.replace(u'a < b', u'a &lt; b')
+        validate_xml_template(code)
+        validate_xml_template(minify.minify_markup(code))
+
+
+class MinifyTests(TestCase):
+    def setUp(self):
+        minify.minify_cache.clear()
+
+    def test_cached(self):
+        with patch.dict(minify.MINIFIERS, {'js': lambda code: code.strip()}):
+            self.assertEqual(minify.minify('js', u' a '), u'a')
+        # The cached result is returned without calling the minifier.
+        with patch.dict(minify.MINIFIERS, {'js': None}):
+            self.assertEqual(minify.minify('js', u' a '), u'a')
+
+    @override_settings(SNIPPET_MINIFY=True)
+    def test_template_compile(self):
+        template = SnippetTemplateFactory(code=u'<p>\n    {{ myvar }}\n</p>')
+        self.assertEqual(template.render({'myvar': 'foo'}), u'<p> foo </p>')
+
+    @override_settings(SNIPPET_MINIFY=True)
+    def test_template_compile_jinja_literals(self):
+        code = u'<p>\n    {{ "a  b" }}\n    {% raw %}{{  c  }}{% endraw %}\n</p>'
+        template = SnippetTemplateFactory(code=code)
+        self.assertEqual(template.render({}), u'<p> a  b {{  c  }} </p>')
+
+    @override_settings(SNIPPET_MINIFY=False)
+    def test_filters_disabled(self):
+        self.assertEqual(minify_js(u'  a  '), u'  a  ')
+        self.assertEqual(minify_css(u'  a  '), u'  a  ')
+
+    @override_settings(SNIPPET_MINIFY=True)
+    def test_filters_enabled(self):
+        self.assertEqual(minify_js(u'  a  '), u'a')
+        self.assertEqual(minify_css(u'  a  '), u'a')
@@ -1,15 +1,20 @@
+import base64
+import hashlib
 import json
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.test.utils import override_settings
+from django.utils.html import escapejs
 
 from jinja2 import Markup
 from mock import ANY, MagicMock, Mock, patch
 from pyquery import PyQuery as pq
 
-from snippets.base.models import (Client, SnippetBundle, UploadedFile,
-                                  validate_xml_template, validate_xml_variables, _generate_filename)
+from snippets.base import models
+from snippets.base.models import (Client, SnippetBundle, UploadedFile, extract_images,
+                                  runtime_url, validate_xml_template, validate_xml_variables,
+                                  _generate_filename)
 from snippets.base.tests import (ClientMatchRuleFactory,
                                  JSONSnippetFactory,
                                  SearchProviderFactory,
@@ -319,6 +324,259 @@ class SnippetTests(TestCase):
                                                     'foo': True})
 
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SnippetRenderCacheTests(TestCase):
+    def setUp(self):
+        models.render_data_cache.clear()
+        models.render_attrs_cache.clear()
+
+    def test_render_data_cached(self):
+        snippet = SnippetFactory.create(data='{"code": "id [[snippet_id]]"}')
+        data = snippet.render_data(snippet.id)
+        self.assertEqual(data, {'code': 'id {0}'.format(snippet.id), 'snippet_id': snippet.id})
+        self.assertTrue(snippet.render_data(snippet.id) is data)
+
+    def test_render_data_changed(self):
+        snippet = SnippetFactory.create(data='{"text": "foo"}')
+        snippet.render_data(snippet.id)
+        snippet.data = '{"text": "bar"}'
+        snippet.save()
+        self.assertEqual(snippet.render_data(snippet.id)['text'], 'bar')
+
+    def test_render_data_unsaved(self):
+        """Unsaved snippets, as in previews, skip the cache."""
+        template = SnippetTemplateFactory.create()
+        models.Snippet(template=template, data='{"text": "foo"}').render_data(0)
+        snippet = models.Snippet(template=template, data='{"text": "bar"}')
+        self.assertEqual(snippet.render_data(0)['text'], 'bar')
+        self.assertEqual(len(models.render_data_cache), 0)
+
+    def test_render_attrs_cached(self):
+        snippet = SnippetFactory.create(countries=['gr'])
+        attrs = snippet.render_attrs()
+        with self.assertNumQueries(0):
+            self.assertEqual(snippet.render_attrs(), attrs)
+
+    def test_render_attrs_revision(self):
+        snippet = SnippetFactory.create()
+        with patch.object(models.Snippet, '_render_attrs', return_value=u'attrs') as render:
+            snippet.render_attrs()
+            models.bump_data_generation()
+            snippet.render_attrs()
+            self.assertEqual(render.call_count, 1)
+            snippet.countries.add(models.TargetedCountry.objects.create(code='gr', name='Greece'))
+            snippet.render_attrs()
+            self.assertEqual(render.call_count, 2)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EscapedSnippetsJSONTests(TestCase):
+    def setUp(self):
+        models.json_fragment_cache.clear()
+        template = SnippetTemplateFactory.create(code='<p>{{ text }}</p>')
+        self.snippets = [
+            SnippetFactory.create(template=template, data='{"text": "</script>\u2028\'"}'),
+            SnippetFactory.create(template=template, data='{"text": "a & b = c"}'),
+        ]
+
+    def test_same_as_escaping_the_list(self):
+        self.assertEqual(models.escaped_snippets_json(self.snippets),
+                         escapejs(json.dumps([s.to_dict() for s in self.snippets])))
+        self.assertEqual(models.escaped_snippets_json([]), escapejs(json.dumps([])))
+
+    def test_cached_fragments(self):
+        models.escaped_snippets_json(self.snippets)
+        with patch.object(models.Snippet, 'to_dict') as to_dict:
+            models.escaped_snippets_json(self.snippets)
+        self.assertFalse(to_dict.called)
+
+    def test_snippet_changes(self):
+        models.escaped_snippets_json(self.snippets)
+        snippet = self.snippets[0]
+        snippet.data = '{"text": "foo"}'
+        snippet.save()
+        self.assertTrue('\\u003Cp\\u003Efoo\\u003C/p\\u003E' in
+                        models.escaped_snippets_json([snippet]))
+
+    def test_country_changes(self):
+        snippet = self.snippets[0]
+        models.escaped_snippets_json([snippet])
+        snippet.countries.add(models.TargetedCountry.objects.create(code='gr', name='Greece'))
+        self.assertEqual(models.escaped_snippets_json([snippet]),
+                         escapejs(json.dumps([snippet.to_dict()])))
+
+
+def decode_escaped_json(value):
+    return json.loads(json.loads(u'"{0}"'.format(value)))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EscapedBundleJSONTests(TestCase):
+    def setUp(self):
+        models.json_fragment_cache.clear()
+        template = SnippetTemplateFactory.create(
+            code='<p id="s{{ snippet_id }}">{{ text }}</p>')
+        self.snippets = [
+            SnippetFactory.create(template=template, data='{"text": "a [[snippet_id]]"}'),
+            SnippetFactory.create(template=template, data='{"text": "b"}'),
+            SnippetFactory.create(template=template, data='{"text": "a [[snippet_id]]"}'),
+        ]
+
+    def expand(self, snippets_json, markup_json):
+        """Expand shared markup like the snippet runtime does."""
+        snippets = decode_escaped_json(snippets_json)
+        markup = decode_escaped_json(markup_json)
+        for snippet in snippets:
+            if 'markup' in snippet:
+                content = markup[snippet.pop('markup')]
+                content = content.replace('[[snippet_id]]', unicode(snippet['id']))
+                snippet['code'] = u'<div {0}>{1}</div>'.format(snippet.pop('code_attrs'),
+                                                               content)
+        return snippets
+
+    @override_settings(SNIPPET_DEDUPLICATE_MARKUP=True)
+    def test_deduplicate(self):
+        snippets_json, markup_json = models.escaped_bundle_json(self.snippets)
+        # Markup used by a single snippet isn't shared.
+        self.assertEqual(decode_escaped_json(markup_json),
+                         ['<p id="s[[snippet_id]]">a [[snippet_id]]</p>'])
+        self.assertEqual([snippet.get('markup') for snippet in decode_escaped_json(snippets_json)],
+                         [0, None, 0])
+        self.assertEqual(self.expand(snippets_json, markup_json),
+                         [snippet.to_dict() for snippet in self.snippets])
+
+    @override_settings(SNIPPET_DEDUPLICATE_MARKUP=True)
+    def test_id_dependent_markup(self):
+        template = SnippetTemplateFactory.create(code='<p>{{ snippet_id|int }}</p>')
+        snippet = SnippetFactory.create(template=template)
+        template = SnippetTemplateFactory.create(code='<p>{{ snippet_id + 1 }}</p>')
+        other_snippet = SnippetFactory.create(template=template)
+
+        snippets_json, markup_json = models.escaped_bundle_json([snippet, other_snippet])
+        self.assertEqual(markup_json, '[]')
+        self.assertEqual(snippets_json,
+                         models.escaped_snippets_json([snippet, other_snippet]))
+
+    @override_settings(SNIPPET_DEDUPLICATE_MARKUP=True)
+    def test_cached_parts(self):
+        models.escaped_bundle_json(self.snippets)
+        with patch.object(models.Snippet, 'render_template') as render_template:
+            models.escaped_bundle_json(self.snippets)
+        self.assertFalse(render_template.called)
+
+    @override_settings(SNIPPET_DEDUPLICATE_MARKUP=False)
+    def test_disabled(self):
+        self.assertEqual(models.escaped_bundle_json(self.snippets),
+                         (models.escaped_snippets_json(self.snippets), '[]'))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SnippetRecordTests(TestCase):
+    def setUp(self):
+        models.json_fragment_cache.clear()
+        template = SnippetTemplateFactory.create(code='<p>{{ text }}</p>')
+        self.snippets = SnippetFactory.create_batch(3, template=template,
+                                                    data='{"text": "foo"}')
+        self.snippets[0].countries.add(
+            models.TargetedCountry.objects.create(code='gr', name='Greece'))
+
+    def records(self):
+        return models.Snippet.cached_objects.order_by('id').records()
+
+    def test_escaped_json(self):
+        self.assertEqual(models.escaped_snippets_json(self.records()),
+                         models.escaped_snippets_json(self.snippets))
+
+    @override_settings(SNIPPET_DEDUPLICATE_MARKUP=True)
+    def test_escaped_json_parts(self):
+        self.assertEqual(models.escaped_bundle_json(self.records()),
+                         models.escaped_bundle_json(self.snippets))
+
+    def test_load_snippets_once(self):
+        records = self.records()
+        # One query for the snippets and templates, and one for each
+        # prefetched relation.
+        with self.assertNumQueries(3):
+            models.escaped_snippets_json(records)
+
+    def test_cached_fragments(self):
+        models.escaped_snippets_json(self.records())
+        records = self.records()
+        with self.assertNumQueries(0):
+            models.escaped_snippets_json(records)
+        self.assertTrue(all(record._snippet is None for record in records))
+
+    def test_other_changes(self):
+        models.escaped_snippets_json(self.records())
+        models.bump_data_generation()
+        records = self.records()
+        with patch.object(models.Snippet, 'to_dict') as to_dict:
+            models.escaped_snippets_json(records)
+        self.assertFalse(to_dict.called)
+
+    def test_country_changes(self):
+        models.escaped_snippets_json(self.records())
+        country = models.TargetedCountry.objects.create(code='de', name='Germany')
+        self.snippets[1].countries.add(country)
+        snippets = decode_escaped_json(models.escaped_snippets_json(self.records()))
+        self.assertEqual(snippets[1]['countries'], ['de'])
+
+        country.code = 'at'
+        country.save()
+        snippets = decode_escaped_json(models.escaped_snippets_json(self.records()))
+        self.assertEqual(snippets[1]['countries'], ['at'])
+
+        country.snippet_set.clear()
+        snippets = decode_escaped_json(models.escaped_snippets_json(self.records()))
+        self.assertEqual(snippets[1]['countries'], [])
+
+        self.snippets[0].countries.clear()
+        snippets = decode_escaped_json(models.escaped_snippets_json(self.records()))
+        self.assertEqual(snippets[0]['countries'], [])
+
+    def test_search_provider_changes(self):
+        models.escaped_snippets_json(self.records())
+        provider = models.SearchProvider.objects.create(name='Foo', identifier='foo')
+        provider.snippet_set.add(self.snippets[2])
+        snippets = decode_escaped_json(models.escaped_snippets_json(self.records()))
+        self.assertEqual(snippets[2]['exclude_from_search_engines'], ['foo'])
+
+    def test_bundle_snippets(self):
+        client = Client(startpage_version='4', name='Firefox', version='45.0',
+                        appbuildid='', build_target='', locale='en-US', channel='release',
+                        os_version='', distribution='', distribution_version='')
+        snippets = SnippetBundle(client).snippets
+        self.assertTrue(all(isinstance(snippet, models.SnippetRecord) for snippet in snippets))
+        self.assertEqual(set(snippet.id for snippet in snippets),
+                         set(snippet.id for snippet in self.snippets))
+
+
+class DataGenerationSignalTests(TestCase):
+    @patch('snippets.base.models.bump_data_generation')
+    def test_snippet_save(self, bump_data_generation):
+        SnippetFactory.create()
+        self.assertTrue(bump_data_generation.called)
+
+    @patch('snippets.base.models.bump_data_generation')
+    def test_m2m_change(self, bump_data_generation):
+        snippet = SnippetFactory.create()
+        rule = ClientMatchRuleFactory.create()
+        bump_data_generation.reset_mock()
+        snippet.client_match_rules.add(rule)
+        self.assertTrue(bump_data_generation.called)
+
+    @patch('snippets.base.models.bump_data_generation')
+    def test_unrelated_model(self, bump_data_generation):
+        obj = UploadedFileFactory.build()
+        obj.file.name = 'foo.png'
+        obj.save()
+        self.assertTrue(not bump_data_generation.called)
+
+
 class UploadedFileTests(TestCase):
 
     @override_settings(CDN_URL='http://example.com')
@@ -362,6 +620,125 @@ class UploadedFileTests(TestCase):
         more_snippets = SnippetFactory.create_batch(3, template=template)
         self.assertEqual(set(instance.snippets), set(list(snippets) + list(more_snippets)))
 
+    @override_settings(MEDIA_FILES_ROOT='filesroot/')
+    @patch('snippets.base.models.default_storage')
+    def test_from_content(self, default_storage):
+        default_storage.exists.return_value = False
+        digest = hashlib.sha1('foo').hexdigest()
+        uploaded_file = UploadedFile.from_content('foo', '.png')
+        self.assertEqual(uploaded_file.file.name, 'filesroot/{0}.png'.format(digest))
+        self.assertEqual(uploaded_file.name, '{0}.png'.format(digest))
+        default_storage.save.assert_called_with('filesroot/{0}.png'.format(digest), ANY)
+        self.assertEqual(default_storage.save.call_args[0][1].read(), 'foo')
+
+        # Identical content reuses the existing file.
+        default_storage.reset_mock()
+        self.assertEqual(UploadedFile.from_content('foo', '.png'), uploaded_file)
+        self.assertFalse(default_storage.save.called)
+
+
+@override_settings(MEDIA_FILES_ROOT='filesroot/', SITE_URL='http://example.com')
+@patch('snippets.base.models.default_storage')
+class ExtractImagesTests(TestCase):
+    def setUp(self):
+        self.image_uri = 'data:image/png;base64,' + base64.b64encode('image')
+        self.image_path = 'filesroot/{0}.png'.format(hashlib.sha1('image').hexdigest())
+
+    def test_extract_images(self, default_storage):
+        default_storage.exists.return_value = True
+        value = u'<img src="{0}"> <img src="{0}"> data:image/png;base64,'.format(self.image_uri)
+        result = extract_images(value)
+        url = UploadedFile.objects.get().url
+        self.assertTrue(url.endswith(self.image_path))
+        self.assertEqual(result, u'<img src="{0}"> <img src="{0}"> data:image/png;base64,'
+                         .format(url))
+
+    def test_invalid_base64(self, default_storage):
+        value = u'data:image/png;base64,abc'
+        self.assertEqual(extract_images(value), value)
+        self.assertFalse(UploadedFile.objects.exists())
+
+    @override_settings(SNIPPET_EXTRACT_IMAGES=True)
+    def test_snippet_save(self, default_storage):
+        snippet = SnippetFactory.create(data=json.dumps({'image': self.image_uri, 'count': 1}))
+        url = UploadedFile.objects.get().url
+        self.assertEqual(json.loads(snippet.data), {'image': url, 'count': 1})
+
+    @override_settings(SNIPPET_EXTRACT_IMAGES=False)
+    def test_snippet_save_disabled(self, default_storage):
+        data = json.dumps({'image': self.image_uri})
+        snippet = SnippetFactory.create(data=data)
+        self.assertEqual(snippet.data, data)
+
+    @override_settings(SNIPPET_EXTRACT_IMAGES=True)
+    def test_json_snippet_save(self, default_storage):
+        snippet = JSONSnippetFactory.create(icon=self.image_uri)
+        self.assertEqual(snippet.icon, UploadedFile.objects.get().url)
+
+
+class WeightedVariantsTests(TestCase):
+    def setUp(self):
+        self.snippets = [Mock(id=index, weight=weight)
+                         for index, weight in enumerate([33, 50, 66, 100, 100, 100, 33, 300])]
+        self.total = sum(snippet.weight for snippet in self.snippets)
+
+    def test_slots(self):
+        """Every snippet holds its share of slots, rounded up or down."""
+        for seed in range(20):
+            variants = models.weighted_variants(self.snippets, 4, 3, seed)
+            self.assertEqual([sum(weights.values()) for weights in variants], [3] * 4)
+            for snippet in self.snippets:
+                slots = sum(weights.get(snippet.id, 0) for weights in variants)
+                self.assertTrue(abs(slots - snippet.weight * 12.0 / self.total) < 1)
+
+    def test_rounds(self):
+        """The slots of all rounds are shared like those of a single bigger round."""
+        rounds = [models.weighted_variants(self.snippets, 4, 3, 1, round, 5) for round in range(5)]
+        for snippet in self.snippets:
+            slots = sum(weights.get(snippet.id, 0) for variants in rounds for weights in variants)
+            self.assertTrue(abs(slots - snippet.weight * 60.0 / self.total) < 1)
+
+    def test_seed(self):
+        self.assertEqual(models.weighted_variants(self.snippets, 4, 3, 1),
+                         models.weighted_variants(self.snippets, 4, 3, 1))
+
+    def test_split_variants(self):
+        """Snippets that aren't sampled are in every variant."""
+        sampled = self.snippets[2:]
+        total = sum(snippet.weight for snippet in sampled)
+        variants = models.split_variants(self.snippets, sampled, 4, 3, 1)
+        for weights, slots in zip(variants, models.weighted_variants(sampled, 4, 3, 1)):
+            self.assertEqual(weights[0], 33 * 3)
+            self.assertEqual(weights[1], 50 * 3)
+            self.assertEqual(sum(weights.values()), (33 + 50 + total) * 3)
+            for snippet_id, count in slots.items():
+                self.assertEqual(weights[snippet_id], count * total)
+
+
+class ClientFilteredSnippetsTests(TestCase):
+    def test_filters_clients(self):
+        self.assertFalse(models.filters_clients('', {}))
+        self.assertFalse(models.filters_clients('', {
+            'version_lower_bound': 'any', 'has_fxaccount': 'any',
+            'profileage_lower_bound': -1,
+            'screen_resolutions': '0-1024;1024-1920;1920-50000'}))
+        self.assertTrue(models.filters_clients('foo', {}))
+        self.assertTrue(models.filters_clients('', {'has_fxaccount': 'yes'}))
+        self.assertTrue(models.filters_clients('', {'profileage_upper_bound': 4}))
+        self.assertTrue(models.filters_clients('', {'screen_resolutions': '0-1024'}))
+
+    def test_client_filtered_snippet_ids(self):
+        snippet, campaign, options, country, provider = SnippetFactory.create_batch(
+            5, disabled=False)
+        campaign.campaign = 'foo'
+        campaign.save()
+        options.client_options = {'has_fxaccount': u'yes'}
+        options.save()
+        country.countries.add(models.TargetedCountry.objects.create(code='gr', name='Greece'))
+        provider.exclude_from_search_providers.add(SearchProviderFactory.create())
+        self.assertEqual(models.client_filtered_snippet_ids(),
+                         set([campaign.id, options.id, country.id, provider.id]))
+
 
 class SnippetBundleTests(TestCase):
     def setUp(self):
@@ -385,6 +762,24 @@ class SnippetBundleTests(TestCase):
 
         self.assertNotEqual(bundle1.key, bundle2.key)
 
+    @patch('snippets.base.models.get_data_generation', Mock(return_value=1))
+    def test_for_clients(self):
+        """Bundles of for_clients must have the snippets of single bundles."""
+        SnippetFactory.create(on_release=False, on_beta=True)
+        clients = [self._client(startpage_version='4', name='Firefox', channel=channel,
+                                locale='en-US')
+                   for channel in ['release', 'beta', 'aurora']]
+        with patch('snippets.base.models.cache') as cache:
+            cache.get.return_value = None
+            bundles = SnippetBundle.for_clients(clients)
+            self.assertEqual([bundle.client for bundle in bundles], clients)
+            for bundle in bundles:
+                self.assertEqual(set(snippet.id for snippet in bundle.snippets),
+                                 set(snippet.id for snippet in
+                                     SnippetBundle(bundle.client).snippets))
+        self.assertTrue(bundles[2].empty)
+        cache.set.assert_called_with(bundles[2].empty_cache_key, True, ANY)
+
     def test_key_funny_characters(self):
         """
         bundle.key should generate even when client contains strange unicode
@@ -427,6 +822,50 @@ class SnippetBundleTests(TestCase):
 
         self.assertEqual(bundle1.key, bundle2.key)
 
+    def test_key_empty(self):
+        """
+        Empty bundles must share a key among clients that only differ in
+        properties that don't change the rendered code.
+        """
+        bundle1 = SnippetBundle(self._client(locale='fr', channel='release'))
+        bundle1._snippets = []
+        bundle2 = SnippetBundle(self._client(locale='fr', channel='release-cck-foo'))
+        bundle2._snippets = []
+        bundle3 = SnippetBundle(self._client(locale='de', channel='release'))
+        bundle3._snippets = []
+
+        self.assertEqual(bundle1.key, bundle2.key)
+        self.assertNotEqual(bundle1.key, bundle3.key)
+
+    @patch('snippets.base.models.get_data_generation', Mock(return_value=1))
+    def test_snippets_remember_empty(self):
+        """If the client matches no snippets, remember it in the cache."""
+        bundle = SnippetBundle(self._client(startpage_version='1'))
+        with patch('snippets.base.models.cache') as cache:
+            cache.get.return_value = None
+            with self.settings(SNIPPET_BUNDLE_TIMEOUT=10):
+                self.assertEqual(bundle.snippets, [])
+        cache.set.assert_called_with(bundle.empty_cache_key, True, 10)
+
+    @patch('snippets.base.models.get_data_generation', Mock(return_value=1))
+    def test_snippets_known_empty(self):
+        """If the client is known to match no snippets, skip matching."""
+        bundle = SnippetBundle(self._client())
+        with patch('snippets.base.models.cache') as cache:
+            cache.get.return_value = True
+            with patch('snippets.base.models.Snippet') as Snippet:
+                self.assertEqual(bundle.snippets, [])
+        cache.get.assert_called_with(bundle.empty_cache_key, None)
+        self.assertTrue(not Snippet.cached_objects.filter.called)
+
+    @patch('snippets.base.models.get_data_generation')
+    def test_empty_cache_key_generation(self, get_data_generation):
+        bundle = SnippetBundle(self._client())
+        get_data_generation.return_value = 1
+        key = bundle.empty_cache_key
+        get_data_generation.return_value = 2
+        self.assertNotEqual(key, bundle.empty_cache_key)
+
     def test_generate(self):
         """
         bundle.generate should render the snippets, save them to the
@@ -440,19 +879,23 @@ class SnippetBundleTests(TestCase):
             with patch('snippets.base.models.render_to_string') as render_to_string:
                 with patch('snippets.base.models.default_storage') as default_storage:
                     with self.settings(SNIPPET_BUNDLE_TIMEOUT=10):
-                        with patch('snippets.base.models.version_list') as version_list:
-                            version_list.return_value = ['45.0']
+                        with patch('snippets.base.models.release_info') as release_info:
+                            release_info.current_version = '45'
                             render_to_string.return_value = 'rendered snippet'
                             bundle.generate()
 
         render_to_string.assert_called_with('base/fetch_snippets.jinja', {
             'snippet_ids': [s.id for s in [self.snippet1, self.snippet2]],
-            'snippets_json': json.dumps([s.to_dict() for s in [self.snippet1, self.snippet2]]),
+            'escaped_snippets_json': escapejs(
+                json.dumps([s.to_dict() for s in [self.snippet1, self.snippet2]])),
+            'escaped_markup_json': '[]',
+            'escaped_weights_json': '{}',
             'client': bundle.client,
             'locale': 'fr',
             'settings': settings,
             'current_firefox_version': '45',
             'metrics_url': settings.METRICS_URL,
+            'runtime_url': None,
         })
         default_storage.save.assert_called_with(bundle.filename, ANY)
         cache.set.assert_called_with(bundle.cache_key, True, 10)
@@ -461,6 +904,121 @@ class SnippetBundleTests(TestCase):
         content_file = default_storage.save.call_args[0][1]
         self.assertEqual(content_file.read(), 'rendered snippet')
 
+    def test_render_inline_runtime(self):
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version='4'))
+        bundle._snippets = [self.snippet1]
+        with self.settings(SNIPPET_EXTERNAL_RUNTIME=False):
+            content = bundle.render()
+        self.assertTrue('function sendMetric' in content)
+        self.assertTrue("var SNIPPET_LOCALE = 'fr';" in content)
+
+    @patch('snippets.base.models.runtime_urls', {})
+    def test_render_external_runtime(self):
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version='4'))
+        bundle._snippets = [self.snippet1]
+        with self.settings(SNIPPET_EXTERNAL_RUNTIME=True):
+            with patch('snippets.base.models.default_storage') as default_storage:
+                default_storage.exists.return_value = False
+                default_storage.url.side_effect = lambda filename: '/media/' + filename
+                content = bundle.render()
+                bundle.render()
+
+        filename, runtime_file = default_storage.save.call_args[0]
+        default_storage.save.assert_called_once_with(filename, ANY)
+        runtime = runtime_file.read()
+        self.assertTrue('function sendMetric' in runtime)
+        self.assertTrue(filename.startswith(settings.MEDIA_BUNDLES_ROOT + 'runtime/snippet.'))
+        self.assertTrue(hashlib.sha1(runtime).hexdigest() in filename)
+
+        self.assertFalse('function sendMetric' in content)
+        self.assertFalse('src=' in content)
+        url = escapejs('{0}/media/{1}'.format(settings.SITE_URL, filename))
+        self.assertTrue("request.open('GET', '{0}', true)".format(url) in content)
+        self.assertTrue('metric=runtime-load-failed' in content)
+        self.assertTrue("var SNIPPET_LOCALE = 'fr';" in content)
+
+    @patch('snippets.base.models.runtime_urls', {})
+    def test_runtime_url_existing_file(self):
+        with patch('snippets.base.models.default_storage') as default_storage:
+            default_storage.exists.return_value = True
+            default_storage.url.return_value = '/media/runtime.js'
+            runtime_url('base/includes/snippet_as.js')
+        self.assertFalse(default_storage.save.called)
+
+    def test_key_external_runtime(self):
+        bundle = SnippetBundle(self._client())
+        bundle._snippets = [self.snippet1]
+        with self.settings(SNIPPET_EXTERNAL_RUNTIME=False):
+            key = bundle.key
+        with self.settings(SNIPPET_EXTERNAL_RUNTIME=True):
+            self.assertNotEqual(bundle.key, key)
+
+    def test_variant_count(self):
+        bundle = SnippetBundle(self._client())
+        bundle._snippets = [self.snippet1, self.snippet2]
+        with self.settings(SNIPPET_BUNDLE_VARIANTS=4, SNIPPET_BUNDLE_VARIANT_SIZE=1):
+            self.assertEqual(bundle.variant_count, 4)
+        with self.settings(SNIPPET_BUNDLE_VARIANTS=4, SNIPPET_BUNDLE_VARIANT_SIZE=2):
+            self.assertEqual(bundle.variant_count, 1)
+        with self.settings(SNIPPET_BUNDLE_VARIANTS=0, SNIPPET_BUNDLE_VARIANT_SIZE=1):
+            self.assertEqual(bundle.variant_count, 1)
+
+    def test_choose_variant_disabled(self):
+        bundle = SnippetBundle(self._client())
+        bundle._snippets = [self.snippet1, self.snippet2]
+        with self.settings(SNIPPET_BUNDLE_VARIANTS=0):
+            bundle.choose_variant()
+        self.assertEqual(bundle.variant, None)
+        self.assertEqual(bundle.variant_context(),
+                         ([self.snippet1, self.snippet2], '{}'))
+
+    @override_settings(SNIPPET_BUNDLE_VARIANTS=4, SNIPPET_BUNDLE_VARIANT_SIZE=1,
+                       SNIPPET_BUNDLE_TIMEOUT=10, SNIPPET_BUNDLE_VARIANT_ROUNDS=3)
+    def test_choose_variant(self):
+        """The variant only depends on the client and the period."""
+        snippets = [self.snippet1, self.snippet2]
+        choices = set()
+        for now in range(0, 400, 5):
+            with patch('snippets.base.models.time.time', return_value=now):
+                bundle = SnippetBundle(self._client(), snippets)
+                bundle.choose_variant()
+                other_bundle = SnippetBundle(self._client(), snippets)
+                other_bundle.choose_variant()
+            self.assertEqual((bundle.variant, bundle.variant_round),
+                             (other_bundle.variant, other_bundle.variant_round))
+            self.assertEqual(bundle.variant_round, now // 10 % 3)
+            choices.add(bundle.variant)
+        self.assertEqual(choices, set(range(4)))
+
+    @override_settings(SNIPPET_BUNDLE_VARIANTS=4, SNIPPET_BUNDLE_VARIANT_SIZE=1)
+    def test_variant_context(self):
+        snippets = [self.snippet1, self.snippet2]
+        for variant in range(4):
+            bundle = SnippetBundle(self._client(), snippets, variant)
+            context_snippets, weights_json = bundle.variant_context()
+            weights = decode_escaped_json(weights_json)
+            self.assertEqual(set(snippet.id for snippet in context_snippets),
+                             set(int(snippet_id) for snippet_id in weights))
+            self.assertEqual(weights, json.loads(json.dumps(bundle.variant_weights)))
+
+    @override_settings(SNIPPET_BUNDLE_VARIANTS=2, SNIPPET_BUNDLE_VARIANT_SIZE=1)
+    def test_variants_client_filtered(self):
+        snippets = SnippetFactory.create_batch(3)
+        filtered = SnippetFactory.create(campaign='foo')
+        bundle = SnippetBundle(self._client(), snippets + [filtered])
+        self.assertEqual(bundle.sampled_snippets, snippets)
+        self.assertEqual(bundle.variant_count, 2)
+        for variant in range(2):
+            bundle.variant = variant
+            self.assertTrue(filtered in bundle.variant_context()[0])
+
+    @override_settings(SNIPPET_BUNDLE_VARIANTS=4, SNIPPET_BUNDLE_VARIANT_SIZE=1)
+    def test_key_variant(self):
+        snippets = [self.snippet1, self.snippet2]
+        keys = set(SnippetBundle(self._client(), snippets, variant, variant_round).key
+                   for variant, variant_round in [(None, 0), (0, 0), (1, 0), (0, 1)])
+        self.assertEqual(len(keys), 4)
+
     def test_generate_activity_stream(self):
         """
         bundle.generate should render the snippets, save them to the
@@ -475,19 +1033,23 @@ class SnippetBundleTests(TestCase):
             with patch('snippets.base.models.render_to_string') as render_to_string:
                 with patch('snippets.base.models.default_storage') as default_storage:
                     with self.settings(SNIPPET_BUNDLE_TIMEOUT=10):
-                        with patch('snippets.base.models.version_list') as version_list:
-                            version_list.return_value = ['45.0']
+                        with patch('snippets.base.models.release_info') as release_info:
+                            release_info.current_version = '45'
                             render_to_string.return_value = 'rendered snippet'
                             bundle.generate()
 
         render_to_string.assert_called_with('base/fetch_snippets_as.jinja', {
             'snippet_ids': [s.id for s in [self.snippet1, self.snippet2]],
-            'snippets_json': json.dumps([s.to_dict() for s in [self.snippet1, self.snippet2]]),
+            'escaped_snippets_json': escapejs(
+                json.dumps([s.to_dict() for s in [self.snippet1, self.snippet2]])),
+            'escaped_markup_json': '[]',
+            'escaped_weights_json': '{}',
             'client': bundle.client,
             'locale': 'fr',
             'settings': settings,
             'current_firefox_version': '45',
             'metrics_url': settings.METRICS_URL,
+            'runtime_url': None,
         })
         default_storage.save.assert_called_with(bundle.filename, ANY)
         cache.set.assert_called_with(bundle.cache_key, True, 10)
@@ -0,0 +1,85 @@
+from datetime import datetime
+
+from django.test.utils import override_settings
+
+from snippets.base.models import Snippet
+from snippets.base.paginator import (KeysetPaginator, count_cache_key, decode_position,
+                                     encode_position)
+from snippets.base.tests import SnippetFactory, TestCase
+from snippets.base.util import encode_cursor
+
+
+class PositionTests(TestCase):
+    def test_round_trip(self):
+        snippet = SnippetFactory.create()
+        snippet = Snippet.objects.get(pk=snippet.pk)
+        self.assertEqual(decode_position(encode_position(snippet, 7)),
+                         (snippet.modified, snippet.pk, 7))
+
+    def test_invalid(self):
+        for cursor in ('', 'foo', u'\u2603', 'Zm9vfGJhcnxiYXo=',
+                       encode_cursor(datetime.now(), 1), encode_cursor(datetime.now(), 1, -1)):
+            with self.assertRaises(ValueError):
+                decode_position(cursor)
+
+    def test_invalid_cursor_ignored(self):
+        paginator = KeysetPaginator(Snippet.objects.all(), 2, cursor='foo')
+        self.assertEqual(paginator.position, None)
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        for i in range(10):
+            SnippetFactory.create()
+        self.queryset = Snippet.objects.all()
+        self.pages = [list(self.queryset.order_by('-modified', '-id')[i:i + 3])
+                      for i in range(0, 10, 3)]
+
+    def test_pages_without_cursor(self):
+        paginator = KeysetPaginator(self.queryset, 3)
+        self.assertEqual(paginator.num_pages, 4)
+        for number, expected in enumerate(self.pages, 1):
+            self.assertEqual(list(paginator.page(number)), expected)
+
+    def test_last_page_from_the_end(self):
+        paginator = KeysetPaginator(self.queryset, 3)
+        with self.assertNumQueries(2):
+            self.assertEqual(list(paginator.page(4)), self.pages[3])
+
+    def test_cursor_navigation(self):
+        """Following page cursors in either direction reaches the same pages."""
+        for number in range(1, 5):
+            page = KeysetPaginator(self.queryset, 3).page(number)
+            for target in range(1, 5):
+                paginator = KeysetPaginator(self.queryset, 3, cursor=page.cursor_for(target))
+                self.assertEqual(list(paginator.page(target)), self.pages[target - 1])
+
+    def test_cursor_for(self):
+        page = KeysetPaginator(self.queryset, 3).page(2)
+        self.assertEqual(page.cursor_for(1), None)
+        self.assertEqual(page.cursor_for(2), None)
+        self.assertEqual(page.cursor_for(4), None)
+        self.assertEqual(decode_position(page.cursor_for(3))[1:], (self.pages[1][-1].pk, 5))
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(self.queryset, 3, cursor='foo')
+        self.assertEqual(list(paginator.page(2)), self.pages[1])
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_count(self):
+        count_key = count_cache_key(Snippet, [('on_nightly', '2')])
+        self.assertEqual(KeysetPaginator(self.queryset, 3, count_key=count_key).count, 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(KeysetPaginator(self.queryset, 3, count_key=count_key).count, 10)
+
+        # Changing snippets starts a new data generation and a new key.
+        SnippetFactory.create()
+        count_key = count_cache_key(Snippet, [('on_nightly', '2')])
+        self.assertEqual(KeysetPaginator(self.queryset, 3, count_key=count_key).count, 11)
+
+    def test_count_cache_key_params_order(self):
+        self.assertEqual(count_cache_key(Snippet, [('a', '1'), ('b', '2')]),
+                         count_cache_key(Snippet, [('b', '2'), ('a', '1')]))
+        self.assertNotEqual(count_cache_key(Snippet, [('a', '1')]),
+                            count_cache_key(Snippet, [('a', '2')]))
@@ -0,0 +1,43 @@
+from mock import patch
+
+from snippets.base.releases import ReleaseInfo
+from snippets.base.tests import TestCase
+
+
+HISTORY = {'44.0': '2016-01-26', '45.0': '2016-03-08', '43.0': '2015-12-15'}
+
+
+@patch('snippets.base.releases.product_details')
+class ReleaseInfoTests(TestCase):
+    def test_values(self, product_details):
+        product_details.firefox_history_major_releases = HISTORY
+        release_info = ReleaseInfo()
+        self.assertEqual(release_info.major_versions, ['45.0', '44.0', '43.0'])
+        self.assertEqual(release_info.current_version, '45')
+        self.assertEqual(release_info.version_choices,
+                         [('45.0', '45.0'), ('44.0', '44.0'), ('43.0', '43.0')])
+
+    def test_empty_history(self, product_details):
+        product_details.firefox_history_major_releases = {}
+        release_info = ReleaseInfo()
+        self.assertEqual(release_info.major_versions, [])
+        self.assertEqual(release_info.current_version, None)
+        self.assertEqual(release_info.version_choices, [])
+
+    def test_computed_once_per_history(self, product_details):
+        product_details.firefox_history_major_releases = HISTORY
+        release_info = ReleaseInfo()
+        with patch('snippets.base.releases.version_list', return_value=['45.0']) as version_list:
+            release_info.current_version
+            release_info.major_versions
+            release_info.version_choices
+        version_list.assert_called_once_with(HISTORY)
+
+    def test_recomputed_on_refresh(self, product_details):
+        product_details.firefox_history_major_releases = HISTORY
+        release_info = ReleaseInfo()
+        self.assertEqual(release_info.current_version, '45')
+
+        # Refreshing product details loads a new dict, even for equal data.
+        product_details.firefox_history_major_releases = dict(HISTORY, **{'46.0': '2016-04-26'})
+        self.assertEqual(release_info.current_version, '46')
@@ -1,6 +1,13 @@
+import json
+from datetime import datetime
+
+from django.utils.html import escapejs as django_escapejs
+from django.utils.safestring import SafeText
+
 from snippets.base.models import Snippet
 from snippets.base.tests import SnippetFactory, TestCase
-from snippets.base.util import first, get_object_or_none
+from snippets.base.util import (decode_cursor, encode_cursor, escapejs, first,
+                                get_object_or_none)
 
 
 class TestGetObjectOrNone(TestCase):
@@ -32,3 +39,36 @@ class TestFirst(TestCase):
         """Return None if the callback never passes for any item."""
         items = [(0, 'foo'), (1, 'bar'), (2, 'baz')]
         self.assertEqual(first(items, lambda x: x[0] == 17), None)
+
+
+class TestCursor(TestCase):
+    def test_roundtrip(self):
+        modified = datetime(2016, 5, 4, 12, 30, 15, 123)
+        self.assertEqual(decode_cursor(encode_cursor(modified, 1, 42)), (modified, 1, 42))
+
+    def test_roundtrip_no_microseconds(self):
+        modified = datetime(2016, 5, 4, 12, 30, 15)
+        self.assertEqual(decode_cursor(encode_cursor(modified, 0, 7)), (modified, 0, 7))
+
+    def test_invalid(self):
+        for cursor in ['foo', encode_cursor(datetime.now(), 0, 1)[:-4], u'\xe9']:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class TestEscapeJS(TestCase):
+    def test_same_as_django(self):
+        values = [
+            u'',
+            u'no escapes',
+            u''.join(unichr(code) for code in range(0x3000)),
+            u'\\u003C already escaped \\\\',
+            json.dumps([{'code': u'<p onclick="a(\'b\');">\u2028&amp;</p>', 'id': -1}]),
+            'byte string <>',
+            42,
+        ]
+        for value in values:
+            self.assertEqual(escapejs(value), django_escapejs(value))
+
+    def test_safe(self):
+        self.assertTrue(isinstance(escapejs('<'), SafeText))
@@ -1,27 +1,39 @@
 import json
+from datetime import datetime
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse
 from django.test.client import RequestFactory
 from django.test.utils import override_settings
+from django.utils.html import escapejs
 
-from mock import patch
+from mock import Mock, patch
 
 import snippets.base.models
 from snippets.base import views
-from snippets.base.models import Client
+from snippets.base.cache import bump_data_generation
+from snippets.base.models import Client, JSONSnippet, Snippet, TargetedCountry
 from snippets.base.templatetags.helpers import urlparams
 from snippets.base.tests import (JSONSnippetFactory, SnippetFactory,
                                  SnippetTemplateFactory, TestCase)
+from snippets.base.util import encode_cursor
 
 snippets.base.models.CHANNELS = ('release', 'beta', 'aurora', 'nightly')
 snippets.base.models.FIREFOX_STARTPAGE_VERSIONS = ('1', '2', '3', '4')
 
 
+def preview_snippets(response):
+    """Return the snippets passed to a preview page."""
+    escaped_snippets_json = response.context['escaped_snippets_json']
+    return json.loads(json.loads(u'"{0}"'.format(escaped_snippets_json)))
+
+
 @override_settings(SERVE_SNIPPET_BUNDLES=False)
 class FetchRenderSnippetsTests(TestCase):
     def setUp(self):
+        views.empty_bundle_cache.clear()
         self.factory = RequestFactory()
         self.client_items = [
             ('startpage_version', '4'),
@@ -51,12 +63,28 @@ class FetchRenderSnippetsTests(TestCase):
         params = self.client_params
         response = self.client.get('/{0}/'.format('/'.join(params)))
 
-        snippets_json = json.dumps([snippet_1.to_dict()])
+        escaped_snippets_json = escapejs(json.dumps([snippet_1.to_dict()]))
 
         self.assertTemplateUsed(response, 'base/fetch_snippets.jinja')
-        self.assertEqual(snippets_json, response.context['snippets_json'])
+        self.assertEqual(escaped_snippets_json, response.context['escaped_snippets_json'])
         self.assertEqual(response.context['locale'], 'en-US')
 
+    @override_settings(SNIPPET_BUNDLE_VARIANTS=2, SNIPPET_BUNDLE_VARIANT_SIZE=1)
+    def test_variants(self):
+        """Bundles split into variants only hold the snippets of one."""
+        SnippetFactory.create_batch(3, on_nightly=True)
+
+        params = self.client_params
+        response = self.client.get('/{0}/'.format('/'.join(params)))
+
+        weights = json.loads(json.loads(
+            u'"{0}"'.format(response.context['escaped_weights_json'])))
+        # One slot of the three snippets, weighing 100 each.
+        self.assertEqual(weights.values(), [300])
+        snippets = json.loads(json.loads(
+            u'"{0}"'.format(response.context['escaped_snippets_json'])))
+        self.assertEqual([str(snippet['id']) for snippet in snippets], weights.keys())
+
     @patch('snippets.base.views.Client', wraps=Client)
     def test_client_construction(self, ClientMock):
         """
@@ -84,23 +112,81 @@ class FetchRenderSnippetsTests(TestCase):
     def test_etag(self):
         """
         The response returned by fetch_snippets should have a ETag set
-        to the sha256 hash of the response content.
+        to the validator computed for the client.
         """
         request = self.factory.get('/')
 
-        with patch.object(views, 'render') as mock_render:
-            mock_render.return_value = HttpResponse('asdf')
-            response = views.fetch_snippets(request, **self.client_kwargs)
+        with patch.object(views, 'client_etag') as client_etag:
+            client_etag.return_value = 'asdf'
+            with patch.object(views, 'render') as mock_render:
+                mock_render.return_value = HttpResponse('asdf')
+                response = views.fetch_snippets(request, **self.client_kwargs)
+
+        self.assertEqual(response['ETag'], '"asdf"')
+        client_etag.assert_called_with('render', Client(**self.client_kwargs))
 
-            # sha256 of 'asdf'
-            expected = 'f0e4c2f76c58916ec258f246851bea091d14d4247a2fc3e18694461b1816e13b'
-            self.assertEqual(response['ETag'], expected)
+    def test_if_none_match(self):
+        """
+        If the If-None-Match header matches the validator, return a 304
+        without matching or rendering any snippets.
+        """
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"asdf"')
+
+        with patch.object(views, 'client_etag') as client_etag:
+            client_etag.return_value = 'asdf'
+            with patch.object(views, 'Snippet') as Snippet:
+                with patch.object(views, 'render') as mock_render:
+                    response = views.fetch_snippets(request, **self.client_kwargs)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(not Snippet.cached_objects.filter.called)
+        self.assertTrue(not mock_render.called)
+
+    def test_if_none_match_stale(self):
+        """If the If-None-Match header doesn't match, render the snippets."""
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"qwer"')
+
+        with patch.object(views, 'client_etag') as client_etag:
+            client_etag.return_value = 'asdf'
+            with patch.object(views, 'render') as mock_render:
+                mock_render.return_value = HttpResponse('asdf')
+                response = views.fetch_snippets(request, **self.client_kwargs)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"asdf"')
 
     def test_activity_stream(self):
         params = ['5'] + self.client_params[1:]
         response = self.client.get('/{0}/'.format('/'.join(params)))
         self.assertTemplateUsed(response, 'base/fetch_snippets_as.jinja')
 
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_empty_bundle_cached(self):
+        """Clients matching no snippets get a shared pre-rendered bundle."""
+        params = self.client_params
+        response = self.client.get('/{0}/'.format('/'.join(params)))
+        self.assertEqual(response.context['snippet_ids'], [])
+
+        other_params = params[:6] + ['nightly-cck-foo'] + params[7:]
+        with patch.object(views, 'render') as mock_render:
+            cached_response = self.client.get('/{0}/'.format('/'.join(other_params)))
+        self.assertTrue(not mock_render.called)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['Vary'], 'If-None-Match')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_empty_bundle_data_generation(self):
+        """Changes to snippets invalidate cached empty bundles."""
+        params = self.client_params
+        self.client.get('/{0}/'.format('/'.join(params)))
+
+        bump_data_generation()
+        with patch.object(views, 'render', wraps=views.render) as mock_render:
+            self.client.get('/{0}/'.format('/'.join(params)))
+        self.assertTrue(mock_render.called)
+
 
 class JSONSnippetsTests(TestCase):
     def test_base(self):
@@ -166,6 +252,83 @@ class JSONSnippetsTests(TestCase):
         response = self.client.get('/json/{0}/'.format('/'.join(params)))
         self.assertEqual(response['Content-Type'], 'application/json')
 
+    @patch('snippets.base.views.get_data_generation', Mock(return_value=1))
+    def test_response_cache(self):
+        """Responses for the same client and generation are served from the cache."""
+        views.json_response_cache.clear()
+        JSONSnippetFactory.create(on_nightly=True)
+        params = ('1', 'Fennec', '23.0a1', '20130510041606',
+                  'Darwin_Universal-gcc3', 'en-US', 'nightly',
+                  'Darwin%2010.8.0', 'default', 'default_version')
+        url = '/json/{0}/'.format('/'.join(params))
+        response = self.client.get(url)
+
+        with patch.object(views, 'JSONSnippet') as JSONSnippet:
+            cached_response = self.client.get(url)
+        self.assertTrue(not JSONSnippet.cached_objects.filter.called)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['Content-Length'], str(len(response.content)))
+        self.assertEqual(cached_response['Content-Type'], 'application/json')
+
+    @patch('snippets.base.views.get_data_generation')
+    def test_response_cache_new_generation(self, get_data_generation):
+        """A new data generation must not be served from the cache."""
+        views.json_response_cache.clear()
+        params = ('1', 'Fennec', '23.0a1', '20130510041606',
+                  'Darwin_Universal-gcc3', 'en-US', 'nightly',
+                  'Darwin%2010.8.0', 'default', 'default_version')
+        url = '/json/{0}/'.format('/'.join(params))
+        get_data_generation.return_value = 1
+        self.client.get(url)
+
+        get_data_generation.return_value = 2
+        snippet = JSONSnippetFactory.create(on_nightly=True, on_startpage_1=True)
+        response = self.client.get(url)
+        data = json.loads(response.content)
+        self.assertEqual([x['id'] for x in data], [snippet.id])
+
+    def test_num_queries(self):
+        """The number of queries doesn't depend on the number of snippets."""
+        params = ('1', 'Fennec', '23.0a1', '20130510041606',
+                  'Darwin_Universal-gcc3', 'en-US', 'nightly',
+                  'Darwin%2010.8.0', 'default', 'default_version')
+        url = '/json/{0}/'.format('/'.join(params))
+        countries = [TargetedCountry.objects.create(code=code, name=code)
+                     for code in ('gr', 'de')]
+
+        for count in (1, 10):
+            while JSONSnippet.objects.count() < count:
+                snippet = JSONSnippetFactory.create(on_nightly=True, on_startpage_1=True)
+                snippet.countries.add(*countries)
+            views.json_response_cache.clear()
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            data = json.loads(response.content)
+            self.assertEqual(len(data), count)
+            self.assertEqual(sorted(data[0]['countries']), ['DE', 'GR'])
+
+    def test_etag(self):
+        params = ('1', 'Fennec', '23.0a1', '20130510041606',
+                  'Darwin_Universal-gcc3', 'en-US', 'nightly',
+                  'Darwin%2010.8.0', 'default', 'default_version')
+        with patch.object(views, 'client_etag') as client_etag:
+            client_etag.return_value = 'asdf'
+            response = self.client.get('/json/{0}/'.format('/'.join(params)))
+        self.assertEqual(response['ETag'], '"asdf"')
+        self.assertEqual(client_etag.call_args[0][0], 'json')
+
+    def test_if_none_match(self):
+        params = ('1', 'Fennec', '23.0a1', '20130510041606',
+                  'Darwin_Universal-gcc3', 'en-US', 'nightly',
+                  'Darwin%2010.8.0', 'default', 'default_version')
+        with patch.object(views, 'client_etag') as client_etag:
+            client_etag.return_value = 'asdf'
+            with patch.object(views, 'JSONSnippet') as JSONSnippet:
+                response = self.client.get('/json/{0}/'.format('/'.join(params)),
+                                           HTTP_IF_NONE_MATCH='"asdf"')
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(not JSONSnippet.cached_objects.filter.called)
+
 
 class PreviewSnippetTests(TestCase):
     def setUp(self):
@@ -203,8 +366,26 @@ class PreviewSnippetTests(TestCase):
 
         response = self._preview_snippet(template_id=template.id, data=data)
         self.assertEqual(response.status_code, 200)
-        snippet = response.context['snippets_json']
-        self.assertTrue(json.loads(snippet))
+        self.assertTrue(preview_snippets(response))
+        self.assertIn(response.context['escaped_snippets_json'], response.content.decode('utf-8'))
+
+    def test_cached(self):
+        template = SnippetTemplateFactory.create(code='<p>{{ a }}</p>')
+        views.preview_cache.clear()
+
+        response = self._preview_snippet(template_id=template.id, data='{"a": "b"}')
+        with patch('snippets.base.views.render') as render:
+            cached_response = self._preview_snippet(template_id=template.id, data='{"a": "b"}')
+            self.assertFalse(render.called)
+        self.assertEqual(cached_response.content, response.content)
+
+        response = self._preview_snippet(template_id=template.id, data='{"a": "c"}')
+        self.assertIn('<p>c</p>', preview_snippets(response)[0]['code'])
+
+        template.code = '<div>{{ a }}</div>'
+        template.save()
+        response = self._preview_snippet(template_id=template.id, data='{"a": "b"}')
+        self.assertIn('<div>b</div>', preview_snippets(response)[0]['code'])
 
 
 class ShowSnippetTests(TestCase):
@@ -233,6 +414,26 @@ class ShowSnippetTests(TestCase):
         response = self.client.get(reverse('base.show', kwargs={'snippet_id': snippet.id}))
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached(self):
+        snippet = SnippetFactory.create(data='{"text": "foo"}')
+        views.preview_cache.clear()
+        url = reverse('base.show', kwargs={'snippet_id': snippet.id})
+
+        response = self.client.get(url)
+        with patch('snippets.base.views.render') as render:
+            cached_response = self.client.get(url)
+            self.assertFalse(render.called)
+        self.assertEqual(cached_response.content, response.content)
+
+        snippet.data = '{"text": "bar"}'
+        snippet.save()
+        with patch('snippets.base.views.render') as render:
+            render.return_value = HttpResponse('bar')
+            self.client.get(url)
+            self.assertTrue(render.called)
+
 
 @override_settings(SNIPPETS_PER_PAGE=1)
 class JSONIndexSnippetsTests(TestCase):
@@ -351,6 +552,24 @@ class IndexSnippetsTests(TestCase):
         self.assertEqual(pagination_range[-1], 7)
         self.assertEqual(len(pagination_range), 5)
 
+    def test_cursor(self):
+        response = self.client.get(urlparams(reverse('base.index'), page=5))
+        cursor = response.context['snippets'].cursor_for(6)
+        response = self.client.get(urlparams(reverse('base.index'), page=6, cursor=cursor))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['snippets'].number, 6)
+        self.assertEqual(list(response.context['snippets']),
+                         list(Snippet.objects.order_by('-modified', '-id')[5:6]))
+
+    def test_invalid_page_with_cursor(self):
+        response = self.client.get(urlparams(reverse('base.index'), page=2, cursor='foo'))
+        cursor = response.context['snippets'].cursor_for(3)
+        response = self.client.get(urlparams(reverse('base.index'), page=20, cursor=cursor))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['snippets'].number, 10)
+        self.assertEqual(list(response.context['snippets']),
+                         list(Snippet.objects.order_by('-modified', '-id')[9:10]))
+
 
 class FetchPregeneratedSnippetsTests(TestCase):
     def setUp(self):
@@ -384,6 +603,7 @@ class FetchPregeneratedSnippetsTests(TestCase):
 
         # Do not generate bundle when not expired.
         self.assertTrue(not SnippetBundle.return_value.generate.called)
+        self.assertTrue(SnippetBundle.return_value.choose_variant.called)
 
     def test_regenerate(self):
         """If the bundle has expired, re-generate it."""
@@ -400,6 +620,137 @@ class FetchPregeneratedSnippetsTests(TestCase):
         self.assertTrue(SnippetBundle.return_value.generate.called)
 
 
+@override_settings(SNIPPET_BATCH_FETCH_TOKEN='secret')
+class FetchSnippetsBatchTests(TestCase):
+    def setUp(self):
+        self.client_kwargs = {
+            'startpage_version': '4',
+            'name': 'Firefox',
+            'version': '23.0a1',
+            'appbuildid': '20130510041606',
+            'build_target': 'Darwin_Universal-gcc3',
+            'locale': 'en-US',
+            'channel': 'nightly',
+            'os_version': 'Darwin 10.8.0',
+            'distribution': 'default',
+            'distribution_version': 'default_version',
+        }
+
+    def _post(self, data, token='secret'):
+        return self.client.post(reverse('base.fetch_snippets_batch'), json.dumps(data),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION='Bearer {0}'.format(token))
+
+    def test_base(self):
+        SnippetFactory.create(on_nightly=True)
+        beta_kwargs = dict(self.client_kwargs, channel='beta')
+        with patch.object(views.SnippetBundle, 'generate') as generate:
+            response = self._post([self.client_kwargs, beta_kwargs, self.client_kwargs])
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+
+        expected = [views.SnippetBundle(Client(**kwargs))
+                    for kwargs in [self.client_kwargs, beta_kwargs, self.client_kwargs]]
+        self.assertEqual(data, [{'key': bundle.key, 'url': bundle.url} for bundle in expected])
+        # Bundles are generated once per key.
+        self.assertEqual(generate.call_count, 2)
+
+    def test_not_expired(self):
+        with patch.object(views.SnippetBundle, 'generate') as generate:
+            with patch.object(views.SnippetBundle, 'expired', False):
+                response = self._post([self.client_kwargs])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(not generate.called)
+
+    def test_get(self):
+        response = self.client.get(reverse('base.fetch_snippets_batch'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_invalid_json(self):
+        response = self.client.post(reverse('base.fetch_snippets_batch'), 'foo',
+                                    content_type='application/json',
+                                    HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_token(self):
+        with patch.object(views.SnippetBundle, 'generate') as generate:
+            self.assertEqual(self._post([self.client_kwargs], token='foo').status_code, 403)
+            response = self.client.post(reverse('base.fetch_snippets_batch'),
+                                        json.dumps([self.client_kwargs]),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 403)
+        self.assertTrue(not generate.called)
+
+    @override_settings(SNIPPET_BATCH_FETCH_TOKEN=None)
+    def test_disabled(self):
+        self.assertEqual(self._post([self.client_kwargs]).status_code, 404)
+
+    def test_not_a_list(self):
+        response = self._post(self.client_kwargs)
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_client(self):
+        client_kwargs = dict(self.client_kwargs)
+        del client_kwargs['locale']
+        self.assertEqual(self._post([client_kwargs]).status_code, 400)
+        self.assertEqual(self._post([dict(self.client_kwargs, locale=5)]).status_code, 400)
+        self.assertEqual(self._post(['foo']).status_code, 400)
+
+    @override_settings(SNIPPET_BATCH_FETCH_MAX_CLIENTS=2)
+    def test_too_many_clients(self):
+        response = self._post([self.client_kwargs] * 3)
+        self.assertEqual(response.status_code, 400)
+
+
+class ClientETagTests(TestCase):
+    def setUp(self):
+        self.client_obj = Client('4', 'Firefox', '23.0a1', '20130510041606',
+                                 'Darwin_Universal-gcc3', 'en-US', 'nightly',
+                                 'Darwin 10.8.0', 'default', 'default_version')
+
+    @patch('snippets.base.views.get_data_generation')
+    def test_stable(self, get_data_generation):
+        get_data_generation.return_value = 1
+        self.assertEqual(views.client_etag('render', self.client_obj),
+                         views.client_etag('render', self.client_obj))
+
+    @patch('snippets.base.views.get_data_generation')
+    def test_generation(self, get_data_generation):
+        get_data_generation.return_value = 1
+        etag = views.client_etag('render', self.client_obj)
+        get_data_generation.return_value = 2
+        self.assertNotEqual(etag, views.client_etag('render', self.client_obj))
+
+    @patch('snippets.base.views.get_data_generation')
+    def test_client(self, get_data_generation):
+        get_data_generation.return_value = 1
+        other_client = self.client_obj._replace(locale='fr')
+        self.assertNotEqual(views.client_etag('render', self.client_obj),
+                            views.client_etag('render', other_client))
+
+    @patch('snippets.base.views.get_data_generation')
+    def test_kind(self, get_data_generation):
+        get_data_generation.return_value = 1
+        self.assertNotEqual(views.client_etag('render', self.client_obj),
+                            views.client_etag('json', self.client_obj))
+
+    @patch('snippets.base.views.get_data_generation')
+    def test_variants(self, get_data_generation):
+        get_data_generation.return_value = 1
+        etag = views.client_etag('render', self.client_obj)
+        with self.settings(SNIPPET_BUNDLE_VARIANTS=4):
+            self.assertNotEqual(views.client_etag('render', self.client_obj), etag)
+
+    @patch('snippets.base.views.get_data_generation')
+    @patch('snippets.base.models.time.time')
+    def test_period(self, time, get_data_generation):
+        get_data_generation.return_value = 1
+        time.return_value = 0
+        etag = views.client_etag('render', self.client_obj)
+        time.return_value = settings.SNIPPET_BUNDLE_TIMEOUT
+        self.assertNotEqual(views.client_etag('render', self.client_obj), etag)
+
+
 class FetchSnippetsTests(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -432,18 +783,253 @@ class ActiveSnippetsViewTests(TestCase):
         JSONSnippetFactory.create(disabled=True)
         response = views.ActiveSnippetsView.as_view()(self.request)
         self.assertEqual(response.get('content-type'), 'application/json')
-        data = json.loads(response.content)
+        data = json.loads(''.join(response.streaming_content))
         self.assertEqual(
             set([snippets[0].id, snippets[1].id, jsonsnippets[0].id, jsonsnippets[1].id]),
             set([x['id'] for x in data]))
 
+    def test_empty(self):
+        response = views.ActiveSnippetsView.as_view()(self.request)
+        self.assertEqual(json.loads(''.join(response.streaming_content)), [])
+
+    def test_num_queries(self):
+        """The number of queries must not grow with the number of snippets."""
+        SnippetFactory.create_batch(5, countries=['us', 'gr'])
+        JSONSnippetFactory.create_batch(5, countries=['us'])
+        response = views.ActiveSnippetsView.as_view()(self.request)
+        # One query for snippets with their templates, one for
+        # jsonsnippets and one per relation for each of them.
+        with self.assertNumQueries(6):
+            data = json.loads(''.join(response.streaming_content))
+        self.assertEqual(len(data), 10)
+
+    def test_chunks(self):
+        """Snippets are loaded chunk_size at a time."""
+        snippets = SnippetFactory.create_batch(5, countries=['us'])
+        with patch.object(views.ActiveSnippetsView, 'chunk_size', 2):
+            response = views.ActiveSnippetsView.as_view()(self.request)
+            # Three chunks of snippets and their relations, and one
+            # query for jsonsnippets.
+            with self.assertNumQueries(10):
+                data = json.loads(''.join(response.streaming_content))
+        self.assertEqual([item['id'] for item in data], [snippet.id for snippet in snippets])
+
+
+class ActiveSnippetsFilterTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _get(self, **params):
+        request = self.factory.get('/', params)
+        response = views.ActiveSnippetsView.as_view()(request)
+        if response.status_code != 200:
+            return response, None
+        return response, json.loads(''.join(response.streaming_content))
+
+    def _ids(self, **params):
+        response, data = self._get(**params)
+        return [(item['type'], item['id']) for item in data]
+
+    def test_order(self):
+        snippet1 = SnippetFactory.create()
+        jsonsnippet = JSONSnippetFactory.create()
+        snippet2 = SnippetFactory.create()
+        self.assertEqual(self._ids(), [('Desktop Snippet', snippet1.id),
+                                       ('JSON Snippet', jsonsnippet.id),
+                                       ('Desktop Snippet', snippet2.id)])
+
+    def test_channel(self):
+        snippet = SnippetFactory.create(on_release=False, on_beta=True)
+        SnippetFactory.create(on_release=True, on_beta=False)
+        JSONSnippetFactory.create(on_release=True, on_beta=False)
+        self.assertEqual(self._ids(channel='beta'), [('Desktop Snippet', snippet.id)])
+
+    def test_invalid_channel(self):
+        response, data = self._get(channel='foo')
+        self.assertEqual(response.status_code, 400)
+
+    def test_locale(self):
+        snippet = SnippetFactory.create(locales=['de', 'fr'])
+        SnippetFactory.create(locales=['en-us'])
+        jsonsnippet = JSONSnippetFactory.create(locales=['de'])
+        self.assertEqual(self._ids(locale='de'), [('Desktop Snippet', snippet.id),
+                                                  ('JSON Snippet', jsonsnippet.id)])
+
+    def test_country(self):
+        snippet1 = SnippetFactory.create(countries=['gr', 'us'])
+        SnippetFactory.create(countries=['de'])
+        snippet2 = SnippetFactory.create()
+        self.assertEqual(self._ids(country='gr'), [('Desktop Snippet', snippet1.id),
+                                                   ('Desktop Snippet', snippet2.id)])
+
+    def test_template(self):
+        snippet = SnippetFactory.create(template__name='foo')
+        SnippetFactory.create(template__name='bar')
+        JSONSnippetFactory.create()
+        self.assertEqual(self._ids(template='foo'), [('Desktop Snippet', snippet.id)])
+
+    def test_template_default(self):
+        SnippetFactory.create(template__name='foo')
+        jsonsnippet = JSONSnippetFactory.create()
+        self.assertEqual(self._ids(template='default'), [('JSON Snippet', jsonsnippet.id)])
+
+    def test_since(self):
+        SnippetFactory.create()
+        JSONSnippetFactory.create()
+        snippet = SnippetFactory.create()
+        Snippet.objects.update(modified=datetime(2016, 1, 1))
+        JSONSnippet.objects.update(modified=datetime(2016, 1, 1))
+        Snippet.objects.filter(id=snippet.id).update(modified=datetime(2016, 2, 1))
+        self.assertEqual(self._ids(since='2016-01-01T00:00:00'),
+                         [('Desktop Snippet', snippet.id)])
+
+    def test_invalid_since(self):
+        response, data = self._get(since='yesterday')
+        self.assertEqual(response.status_code, 400)
+
+    def test_publish_window(self):
+        ended = SnippetFactory.create(publish_end=datetime(2016, 1, 10))
+        running = SnippetFactory.create(publish_start=datetime(2016, 1, 10),
+                                        publish_end=datetime(2016, 2, 10))
+        unlimited = SnippetFactory.create()
+        upcoming = SnippetFactory.create(publish_start=datetime(2016, 3, 1))
+        self.assertEqual(
+            self._ids(publish_after='2016-02-01', publish_before='2016-02-15'),
+            [('Desktop Snippet', running.id), ('Desktop Snippet', unlimited.id)])
+        self.assertEqual(
+            self._ids(publish_before='2016-01-05'),
+            [('Desktop Snippet', ended.id), ('Desktop Snippet', unlimited.id)])
+        self.assertEqual(
+            self._ids(publish_after='2016-02-15'),
+            [('Desktop Snippet', unlimited.id), ('Desktop Snippet', upcoming.id)])
+
+
+class ActiveSnippetsPaginationTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _paginate(self, url):
+        pages = []
+        while url:
+            response = views.ActiveSnippetsView.as_view()(self.factory.get(url))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(''.join(response.streaming_content))
+            pages.append([(item['type'], item['id']) for item in data])
+            link = response.get('Link')
+            url = link[1:link.index('>')] if link else None
+        return pages
+
+    def test_pages(self):
+        snippets = [SnippetFactory.create(), JSONSnippetFactory.create(),
+                    SnippetFactory.create(), JSONSnippetFactory.create(),
+                    SnippetFactory.create()]
+        expected = [('JSON Snippet' if isinstance(s, JSONSnippet) else 'Desktop Snippet', s.id)
+                    for s in snippets]
+        pages = self._paginate('/?limit=2')
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:5]])
+
+    def test_exact_last_page(self):
+        SnippetFactory.create_batch(2)
+        pages = self._paginate('/?limit=2')
+        self.assertEqual(len(pages), 1)
+
+    def test_same_modified(self):
+        """Snippets modified at the same time must be listed exactly once."""
+        SnippetFactory.create_batch(3)
+        JSONSnippetFactory.create_batch(3)
+        Snippet.objects.update(modified=datetime(2016, 1, 1))
+        JSONSnippet.objects.update(modified=datetime(2016, 1, 1))
+        pages = self._paginate('/?limit=4')
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        items = pages[0] + pages[1]
+        self.assertEqual(len(set(items)), 6)
+
+    def test_keeps_filters(self):
+        SnippetFactory.create_batch(3, on_release=False, on_beta=True)
+        SnippetFactory.create(on_release=True, on_beta=False)
+        pages = self._paginate('/?limit=2&channel=beta')
+        self.assertEqual([len(page) for page in pages], [2, 1])
+
+    def test_invalid_cursor(self):
+        request = self.factory.get('/', {'cursor': 'foo'})
+        response = views.ActiveSnippetsView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_wrong_length(self):
+        request = self.factory.get('/', {'cursor': encode_cursor(datetime.now(), 1)})
+        response = views.ActiveSnippetsView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_limit(self):
+        request = self.factory.get('/', {'limit': '0'})
+        response = views.ActiveSnippetsView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+
+class CacheStatsViewTests(TestCase):
+    def test_staff_only(self):
+        response = self.client.get(reverse('base.cache_stats'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_stats(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'asdf')
+        self.client.login(username='admin', password='asdf')
+        views.empty_bundle_cache.clear()
+        views.empty_bundle_cache['foo'] = 'bar'
+        views.empty_bundle_cache.get('foo')
+
+        response = self.client.get(reverse('base.cache_stats'))
+        self.assertEqual(response.status_code, 200)
+        stats = dict((layer['name'], layer) for layer in json.loads(response.content))
+        self.assertEqual(stats['empty-bundles']['size'], 1)
+        self.assertEqual(stats['empty-bundles']['hot_keys'][0][0], 'foo')
+        self.assertTrue('json-responses' in stats)
+        self.assertTrue('snippet-templates' in stats)
+
+
+class CSPViolationCaptureTests(TestCase):
+    def _report(self, data):
+        return self.client.post(reverse('csp-violation-capture'), data,
+                                content_type='application/csp-report')
+
+    def test_report(self):
+        with patch('snippets.base.views.csp_reports') as csp_reports:
+            response = self._report(json.dumps({'csp-report': {'blocked-uri': 'http://a.com'}}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(csp_reports.add.call_args[0][0], 'http://a.com')
+        data = csp_reports.add.call_args[0][1]()
+        self.assertEqual(data['logger'], 'CSP')
+
+    def test_invalid_report(self):
+        with patch('snippets.base.views.csp_reports') as csp_reports:
+            self.assertEqual(self._report('{foo').status_code, 400)
+            self.assertEqual(self._report('{"csp-report": {}}').status_code, 400)
+            self.assertEqual(self._report('{"csp-report": []}').status_code, 400)
+            self.assertEqual(self._report('{"csp-report": {"blocked-uri": ["a"]}}').status_code,
+                             400)
+            self.assertEqual(self._report('{"csp-report": {"blocked-uri": {}}}').status_code,
+                             400)
+        self.assertFalse(csp_reports.add.called)
+
 
 class HealthzViewTests(TestCase):
     def test_ok(self):
-        SnippetFactory.create()
-        response = self.client.get(reverse('base.healthz'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('base.healthz'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ReadyzViewTests(TestCase):
+    def _readiness(self, ready):
+        return {'ready': ready, 'status': 'ok', 'age': 0, 'dependencies': {}}
+
+    def test_ready(self):
+        with patch('snippets.base.views.readiness', return_value=self._readiness(True)):
+            response = self.client.get(reverse('base.readyz'))
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), self._readiness(True))
 
-    def test_fail(self):
-        with self.assertRaises(AssertionError):
-            self.client.get(reverse('base.healthz'))
+    def test_not_ready(self):
+        with patch('snippets.base.views.readiness', return_value=self._readiness(False)):
+            response = self.client.get(reverse('base.readyz'))
+        self.assertEqual(response.status_code, 503)
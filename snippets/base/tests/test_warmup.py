@@ -0,0 +1,38 @@
+import hashlib
+
+from mock import PropertyMock, patch
+
+from snippets.base import models
+from snippets.base.releases import ReleaseInfo
+from snippets.base.tests import SnippetTemplateFactory, TestCase
+from snippets.base.warmup import warm_up
+
+
+class WarmUpTests(TestCase):
+    def setUp(self):
+        models.template_cache.clear()
+
+    def test_compiles_snippet_templates(self):
+        template = SnippetTemplateFactory.create(code='<p>{{ text }}</p>')
+        warm_up()
+        key = hashlib.sha1(template.code).hexdigest()
+        self.assertIsNotNone(models.template_cache.get(key))
+
+    def test_returns_duration(self):
+        with patch('snippets.base.warmup.statsd') as statsd:
+            duration = warm_up()
+        self.assertTrue(duration >= 0)
+        statsd.timing.assert_called_with('warmup', int(duration * 1000))
+
+    def test_closes_connections(self):
+        with patch('snippets.base.warmup.connections') as connections:
+            warm_up()
+        connections.close_all.assert_called_with()
+
+    def test_closes_connections_on_error(self):
+        with patch('snippets.base.warmup.connections') as connections:
+            with patch.object(ReleaseInfo, 'version_choices', new_callable=PropertyMock,
+                              side_effect=ValueError):
+                with self.assertRaises(ValueError):
+                    warm_up()
+        connections.close_all.assert_called_with()
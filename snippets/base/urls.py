@@ -15,11 +15,14 @@ urlpatterns = [
         '(?P<locale>[^/]+)/(?P<channel>[^/]+)/(?P<os_version>[^/]+)/'
         '(?P<distribution>[^/]+)/(?P<distribution_version>[^/]+)/$',
         views.fetch_json_snippets, name='base.fetch_json_snippets'),
+    url(r'^batch-fetch/$', views.fetch_snippets_batch, name='base.fetch_snippets_batch'),
     url(r'^preview/$', views.preview_snippet, name='base.preview'),
     url(r'^show/(?P<snippet_id>\d+)/$', views.show_snippet, name='base.show'),
     url(r'^json-snippets/', views.JSONSnippetIndexView.as_view(), name='base.index_json'),
     url(r'^active-snippets.json', views.ActiveSnippetsView.as_view(), name='base.active_snippets'),
     url(r'^csp-violation-capture$', views.csp_violation_capture,
         name='csp-violation-capture'),
-    url(r'^healthz/$', views.healthz, name='base.healthz')
+    url(r'^cache-stats/$', views.cache_stats, name='base.cache_stats'),
+    url(r'^healthz/$', views.healthz, name='base.healthz'),
+    url(r'^readyz/$', views.readyz, name='base.readyz'),
 ]
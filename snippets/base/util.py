@@ -1,4 +1,10 @@
+import base64
 import hashlib
+import re
+
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
 
 from product_details import product_details
 
@@ -22,6 +28,60 @@ def first(collection, callback):
     return next((item for item in collection if callback(item)), None)
 
 
+# Replacements of django.utils.html.escapejs. The backslash must be
+# replaced first, the other replacements add backslashes.
+JS_ESCAPES = [(char, u'\\u{0:04X}'.format(ord(char))) for char in u'\\\'"><&=-;']
+JS_RARE_ESCAPES = dict((code, u'\\u{0:04X}'.format(code)) for code in range(32) + [0x2028, 0x2029])
+JS_RARE_CHARS = re.compile(u'[\x00-\x1f\u2028\u2029]')
+
+
+def escapejs(value):
+    """
+    Hex encode characters for use in JavaScript strings, like
+    django.utils.html.escapejs.
+
+    unicode.translate looks up every character of the value in Python,
+    which is slow for the large JSON payloads of bundles. Instead, the
+    characters are replaced one after the other with unicode.replace,
+    and the control characters and line separators, which JSON payloads
+    don't contain, only when they are present.
+    """
+    value = force_text(value)
+    for char, escaped in JS_ESCAPES:
+        if char in value:
+            value = value.replace(char, escaped)
+    if JS_RARE_CHARS.search(value):
+        value = value.translate(JS_RARE_ESCAPES)
+    return mark_safe(value)
+
+
+def encode_cursor(modified, *numbers):
+    """
+    Encode the position of a snippet in a keyset paginated listing, its
+    modification date followed by integers such as its kind and pk,
+    into an opaque, URL safe string.
+    """
+    position = u'|'.join([modified.isoformat()] + [unicode(number) for number in numbers])
+    return base64.urlsafe_b64encode(position.encode('utf-8'))
+
+
+def decode_cursor(cursor):
+    """
+    Return the (modified, number, ...) tuple encoded in cursor. Raises
+    ValueError if the cursor is malformed.
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        values = position.split('|')
+        modified = parse_datetime(values[0])
+        numbers = tuple(int(value) for value in values[1:])
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor: {0}'.format(cursor))
+    if modified is None:
+        raise ValueError('Invalid cursor: {0}'.format(cursor))
+    return (modified,) + numbers
+
+
 def hashfile(filepath):
     sha1 = hashlib.sha1()
     with open(filepath, 'rb') as fp:
@@ -1,37 +1,105 @@
 import hashlib
+import heapq
 import json
 import logging
 
 from distutils.util import strtobool
+from itertools import islice
 
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import permission_required
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Q
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+                         HttpResponseRedirect, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
 from django.utils.functional import lazy
+from django.utils.http import quote_etag
 from django.views.generic import TemplateView, View
-from django.views.decorators.cache import cache_control, cache_page
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST
 
 import django_filters
 from django_statsd.clients import statsd
-from product_details import product_details
-from product_details.version_compare import version_list
 from raven.contrib.django.models import client as sentry_client
 
+from snippets.base import models
+from snippets.base.cache import InstrumentedLRUCache, cache_layers, get_data_generation
+from snippets.base.csp import csp_reports
 from snippets.base.decorators import access_control
 from snippets.base.encoders import ActiveSnippetsEncoder, JSONSnippetEncoder
-from snippets.base.models import Client, JSONSnippet, Snippet, SnippetBundle, SnippetTemplate
-from snippets.base.util import get_object_or_none
+from snippets.base.forms import ActiveSnippetsForm
+from snippets.base.health import readiness
+from snippets.base.models import (Client, JSONSnippet, Snippet, SnippetBundle, SnippetTemplate,
+                                  escaped_bundle_json)
+from snippets.base.paginator import KeysetPaginator, count_cache_key
+from snippets.base.releases import release_info
+from snippets.base.util import encode_cursor, escapejs, get_object_or_none
 
 
 def _http_max_age():
     return getattr(settings, 'SNIPPET_HTTP_MAX_AGE', 90)
 HTTP_MAX_AGE = lazy(_http_max_age, str)()
 
+# Serialized fetch_json_snippets responses keyed by the client
+# validator. The validator changes with the data generation, so stale
+# entries are never served and simply fall out of the LRU.
+json_response_cache = InstrumentedLRUCache(settings.SNIPPET_JSON_RESPONSE_CACHE_SIZE,
+                                           'json-responses')
+
+# Rendered bundles for clients that match no snippets, keyed by
+# SnippetBundle.key and the data generation, so changes to snippets
+# never hit stale entries.
+empty_bundle_cache = InstrumentedLRUCache(100, 'empty-bundles')
+
+# Rendered preview pages. Keys include the modification dates of the
+# snippet and its template, so edits never hit stale entries.
+preview_cache = InstrumentedLRUCache(settings.SNIPPET_PREVIEW_CACHE_SIZE, 'previews')
+
+
+def client_etag(kind, client):
+    """
+    Return a validator for the response of a fetch view of the given
+    kind for client.
+
+    The validator is derived from the client signature, the current
+    data generation and the hashes of the bundle templates, so it can
+    be computed before any snippet matching or rendering takes
+    place. Snippet availability and bundle variants depend on the
+    passing of time, so the validator also changes every
+    SNIPPET_BUNDLE_TIMEOUT seconds.
+    """
+    etag_properties = [kind]
+    etag_properties.extend(client)
+    etag_properties.extend([
+        str(get_data_generation()),
+        str(settings.SNIPPET_EXTERNAL_RUNTIME),
+        str(settings.SNIPPET_MINIFY),
+        str(settings.SNIPPET_DEDUPLICATE_MARKUP),
+        str(settings.SNIPPET_BUNDLE_VARIANTS),
+        str(settings.SNIPPET_BUNDLE_VARIANT_SIZE),
+        str(settings.SNIPPET_BUNDLE_VARIANT_ROUNDS),
+        str(models.bundle_period()),
+        models.SNIPPET_JS_TEMPLATE_HASH,
+        models.SNIPPET_CSS_TEMPLATE_HASH,
+        models.SNIPPET_FETCH_TEMPLATE_HASH,
+        models.SNIPPET_FETCH_AS_TEMPLATE_HASH,
+    ])
+
+    etag_string = u'_'.join(etag_properties)
+    return hashlib.sha1(etag_string.encode('utf-8')).hexdigest()
+
+
+def fetch_etag(kind):
+    """Build an etag_func for the condition decorator of a fetch view."""
+    def etag_func(request, **kwargs):
+        return client_etag(kind, Client(**kwargs))
+    return etag_func
+
 
 class SnippetFilter(django_filters.FilterSet):
 
@@ -50,14 +118,20 @@ class JSONSnippetFilter(django_filters.FilterSet):
 
 class IndexView(TemplateView):
     def render(self, request, *args, **kwargs):
-        paginator = Paginator(self.snippetsfilter.qs, settings.SNIPPETS_PER_PAGE)
+        filter_params = [(name, value) for name, values in request.GET.lists()
+                         if name in self.snippetsfilter.filters for value in values]
+        count_key = count_cache_key(self.snippetsfilter._meta.model, filter_params)
+        paginator = KeysetPaginator(self.snippetsfilter.qs, settings.SNIPPETS_PER_PAGE,
+                                    cursor=request.GET.get('cursor'), count_key=count_key)
 
         page = request.GET.get('page', 1)
         try:
             snippets = paginator.page(page)
         except PageNotAnInteger:
+            paginator.position = None
             snippets = paginator.page(1)
         except EmptyPage:
+            paginator.position = None
             snippets = paginator.page(paginator.num_pages)
 
         # Display links to the page before and after the current page when
@@ -95,6 +169,7 @@ class JSONSnippetIndexView(IndexView):
 
 @cache_control(public=True, max_age=settings.SNIPPET_BUNDLE_TIMEOUT)
 @access_control(max_age=settings.SNIPPET_BUNDLE_TIMEOUT)
+@condition(etag_func=fetch_etag('bundle'))
 def fetch_pregenerated_snippets(request, **kwargs):
     """
     Return a redirect to a pre-generated bundle of snippets for the
@@ -102,6 +177,7 @@ def fetch_pregenerated_snippets(request, **kwargs):
     """
     client = Client(**kwargs)
     bundle = SnippetBundle(client)
+    bundle.choose_variant()
     if bundle.expired:
         bundle.generate()
         statsd.incr('bundle.generate')
@@ -113,39 +189,40 @@ def fetch_pregenerated_snippets(request, **kwargs):
 
 @cache_control(public=True, max_age=HTTP_MAX_AGE)
 @access_control(max_age=HTTP_MAX_AGE)
+@condition(etag_func=fetch_etag('render'))
 def fetch_render_snippets(request, **kwargs):
     """Fetch snippets for the client and render them immediately."""
     client = Client(**kwargs)
-    matching_snippets = (Snippet.cached_objects
-                         .filter(disabled=False)
-                         .match_client(client)
-                         .order_by('priority')
-                         .select_related('template')
-                         .filter_by_available())
-
-    current_firefox_version = (
-        version_list(product_details.firefox_history_major_releases)[0].split('.', 1)[0])
-
-    metrics_url = settings.METRICS_URL
-    if ((settings.ALTERNATE_METRICS_URL and
-         client.channel in settings.ALTERNATE_METRICS_CHANNELS)):
-        metrics_url = settings.ALTERNATE_METRICS_URL
-
-    template = 'base/fetch_snippets.jinja'
-
-    if client.startpage_version == '5':
-        template = 'base/fetch_snippets_as.jinja'
-    response = render(request, template, {
-        'snippet_ids': [snippet.id for snippet in matching_snippets],
-        'snippets_json': json.dumps([s.to_dict() for s in matching_snippets]),
+    bundle = SnippetBundle(client)
+
+    # Clients that match no snippets share a pre-rendered empty bundle.
+    if bundle.empty:
+        empty_key = u'{0}:{1}'.format(bundle.key, get_data_generation())
+        content = empty_bundle_cache.get(empty_key)
+        if content is not None:
+            statsd.incr('serve.snippets.empty_cached')
+            response = HttpResponse(content)
+            patch_vary_headers(response, ['If-None-Match'])
+            return response
+
+    bundle.choose_variant()
+    snippets, weights_json = bundle.variant_context()
+    snippets_json, markup_json = escaped_bundle_json(snippets)
+    response = render(request, bundle.template, {
+        'snippet_ids': [snippet.id for snippet in snippets],
+        'escaped_snippets_json': snippets_json,
+        'escaped_markup_json': markup_json,
+        'escaped_weights_json': weights_json,
         'client': client,
         'locale': client.locale,
-        'current_firefox_version': current_firefox_version,
-        'metrics_url': metrics_url,
+        'current_firefox_version': release_info.current_version,
+        'metrics_url': bundle.metrics_url,
+        'runtime_url': bundle.runtime_url,
     })
 
-    # ETag will be a hash of the response content.
-    response['ETag'] = hashlib.sha256(response.content).hexdigest()
+    if bundle.empty:
+        empty_bundle_cache[empty_key] = response.content
+
     patch_vary_headers(response, ['If-None-Match'])
 
     return response
@@ -160,18 +237,97 @@ def fetch_snippets(request, **kwargs):
         return fetch_render_snippets(request, **kwargs)
 
 
+@csrf_exempt
+@require_POST
+def fetch_snippets_batch(request):
+    """
+    Resolve the bundles of many clients in one request, generating the
+    ones that are expired.
+
+    Expects a JSON list of client descriptors, objects with the fields
+    of Client, and returns the bundle key and URL of each client in the
+    same order.
+
+    Generating bundles is expensive, so callers must authenticate with
+    SNIPPET_BATCH_FETCH_TOKEN as a bearer token. The endpoint doesn't
+    exist without it.
+    """
+    token = settings.SNIPPET_BATCH_FETCH_TOKEN
+    if not token:
+        raise Http404
+    if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                 'Bearer {0}'.format(token)):
+        return HttpResponseForbidden('Invalid token')
+
+    try:
+        descriptors = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid JSON')
+
+    if not isinstance(descriptors, list):
+        return HttpResponseBadRequest('Expected a list of clients')
+    if len(descriptors) > settings.SNIPPET_BATCH_FETCH_MAX_CLIENTS:
+        return HttpResponseBadRequest('Too many clients, the maximum is {0}'.format(
+            settings.SNIPPET_BATCH_FETCH_MAX_CLIENTS))
+
+    clients = []
+    for descriptor in descriptors:
+        try:
+            client = Client(**dict((field, descriptor[field]) for field in Client._fields))
+        except (KeyError, TypeError):
+            return HttpResponseBadRequest('Invalid client: {0}'.format(json.dumps(descriptor)))
+        if not all(isinstance(value, basestring) for value in client):
+            return HttpResponseBadRequest('Invalid client: {0}'.format(json.dumps(descriptor)))
+        clients.append(client)
+
+    statsd.incr('serve.snippets_batch')
+    statsd.incr('serve.snippets_batch.clients', len(clients))
+
+    results = []
+    generated = set()
+    for bundle in SnippetBundle.for_clients(clients):
+        bundle.choose_variant()
+        key = bundle.key
+        if key not in generated and bundle.expired:
+            bundle.generate()
+            statsd.incr('bundle.generate')
+        generated.add(key)
+        results.append({'key': key, 'url': bundle.url})
+
+    return HttpResponse(json.dumps(results), content_type='application/json')
+
+
 @cache_control(public=True, max_age=HTTP_MAX_AGE)
 @access_control(max_age=HTTP_MAX_AGE)
+@condition(etag_func=fetch_etag('json'))
 def fetch_json_snippets(request, **kwargs):
     statsd.incr('serve.json_snippets')
     client = Client(**kwargs)
-    matching_snippets = (JSONSnippet.cached_objects
-                         .filter(disabled=False)
-                         .match_client(client)
-                         .order_by('priority')
-                         .filter_by_available())
-    return HttpResponse(json.dumps(matching_snippets, cls=JSONSnippetEncoder),
-                        content_type='application/json')
+    etag = client_etag('json', client)
+
+    cached_response = json_response_cache.get(etag)
+    if cached_response is None:
+        statsd.incr('serve.json_snippets.cache_miss')
+        matching_snippets = (JSONSnippet.cached_objects
+                             .filter(disabled=False)
+                             .match_client(client)
+                             .order_by('priority')
+                             .prefetch_related('countries')
+                             .filter_by_available())
+        content = json.dumps(matching_snippets, cls=JSONSnippetEncoder)
+        cached_response = (content, {
+            'Content-Length': str(len(content)),
+            'ETag': quote_etag(etag),
+        })
+        json_response_cache[etag] = cached_response
+    else:
+        statsd.incr('serve.json_snippets.cache_hit')
+
+    content, headers = cached_response
+    response = HttpResponse(content, content_type='application/json')
+    for header, value in headers.items():
+        response[header] = value
+    return response
 
 
 PREVIEW_CLIENT = Client('4', 'Firefox', '24.0', 'default', 'default', 'en-US',
@@ -210,48 +366,187 @@ def preview_snippet(request):
     skip_boilerplate = strtobool(skip_boilerplate)
 
     template_name = 'base/preview_without_shell.jinja' if skip_boilerplate else 'base/preview.jinja'
-    current_firefox_version = (
-        version_list(product_details.firefox_history_major_releases)[0].split('.', 1)[0])
-
-    return render(request, template_name, {
-        'snippets_json': json.dumps([snippet.to_dict()]),
-        'client': PREVIEW_CLIENT,
-        'preview': True,
-        'current_firefox_version': current_firefox_version,
-    })
+    key = u'data:{0}'.format(hashlib.sha1(data.encode('utf-8')).hexdigest())
+    return render_preview(request, template_name, snippet, key)
 
 
 def show_snippet(request, snippet_id):
-    snippet = get_object_or_404(Snippet, pk=snippet_id)
+    snippet = get_object_or_404(Snippet.objects.select_related('template'), pk=snippet_id)
     if snippet.disabled and not request.user.is_authenticated():
         raise Http404()
 
-    current_firefox_version = (
-        version_list(product_details.firefox_history_major_releases)[0].split('.', 1)[0])
-    return render(request, 'base/preview.jinja', {
-        'snippets_json': json.dumps([snippet.to_dict()]),
+    # Countries and search providers can change without touching the
+    # snippet itself, but they do start a new data generation.
+    key = u'snippet:{0}:{1}:{2}'.format(snippet.id, snippet.modified.isoformat(),
+                                        get_data_generation())
+    return render_preview(request, 'base/preview.jinja', snippet, key)
+
+
+def render_preview(request, template_name, snippet, key):
+    """
+    Return the preview page of snippet rendered with template_name.
+
+    Pages are cached in preview_cache under key, which must identify
+    the snippet data, extended with the snippet template and the
+    preview options.
+    """
+    key = u'{0}:{1}:{2}:{3}:{4}'.format(template_name, release_info.current_version,
+                                        snippet.template.id,
+                                        snippet.template.modified.isoformat(), key)
+    content = preview_cache.get(key)
+    if content is not None:
+        return HttpResponse(content)
+
+    response = render(request, template_name, {
+        'escaped_snippets_json': escapejs(json.dumps([snippet.to_dict()])),
+        'escaped_markup_json': '[]',
+        'escaped_weights_json': '{}',
         'client': PREVIEW_CLIENT,
         'preview': True,
-        'current_firefox_version': current_firefox_version,
+        'current_firefox_version': release_info.current_version,
     })
+    preview_cache[key] = response.content
+    return response
 
 
 class ActiveSnippetsView(View):
+    """
+    List enabled snippets of all kinds ordered by (modified, kind, id),
+    where kind is the position of the model in snippet_models.
+
+    The listing can be filtered and paginated with the parameters of
+    ActiveSnippetsForm. Pagination is keyset based: when a limit is given
+    and more snippets follow, the URL of the next page is sent in a Link
+    header and continues right after the last snippet of the page.
+
+    Snippets of each kind are loaded chunk_size at a time while the
+    response is streamed, so memory use doesn't grow with the number of
+    snippets listed.
+    """
+    snippet_models = (Snippet, JSONSnippet)
+    chunk_size = 500
+
     def get(self, request):
-        snippets = (list(Snippet.cached_objects.filter(disabled=False)) +
-                    list(JSONSnippet.cached_objects.filter(disabled=False)))
-        return HttpResponse(json.dumps(snippets, cls=ActiveSnippetsEncoder),
-                            content_type='application/json')
+        form = ActiveSnippetsForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_json(),
+                                          content_type='application/json')
+        params = form.cleaned_data
+        limit = params['limit']
+
+        querysets = [self.filter_queryset(self.get_queryset(model), kind, params)
+                     for kind, model in enumerate(self.snippet_models)]
+        # Pages never need more than limit + 1 snippets of a kind.
+        chunk_size = min(self.chunk_size, limit + 1) if limit else self.chunk_size
+        snippets = self.merge(querysets, chunk_size)
+
+        next_cursor = None
+        if limit:
+            snippets = list(islice(snippets, limit + 1))
+            if len(snippets) > limit:
+                snippets = snippets[:limit]
+                next_cursor = encode_cursor(*snippets[-1][0])
+
+        response = StreamingHttpResponse(self.stream(snippet for key, snippet in snippets),
+                                         content_type='application/json')
+        if next_cursor:
+            query = request.GET.copy()
+            query['cursor'] = next_cursor
+            next_url = request.build_absolute_uri('?' + query.urlencode())
+            response['Link'] = '<{0}>; rel="next"'.format(next_url)
+        return response
+
+    def get_queryset(self, model):
+        # Fetch every relation the encoder needs in bulk, one query per
+        # relation for the whole set instead of per snippet.
+        queryset = (model.cached_objects
+                    .filter(disabled=False)
+                    .prefetch_related('locales', 'countries')
+                    .order_by('modified', 'id'))
+        if model is Snippet:
+            queryset = queryset.select_related('template')
+        return queryset
+
+    def filter_queryset(self, queryset, kind, params):
+        if params['channel']:
+            queryset = queryset.filter(**{'on_{0}'.format(params['channel']): True})
+        if params['locale']:
+            queryset = queryset.filter(locales__code=params['locale']).distinct()
+        if params['country']:
+            # Snippets without countries are shown everywhere.
+            queryset = queryset.filter(Q(countries__code=params['country']) |
+                                       Q(countries__isnull=True)).distinct()
+        if params['template']:
+            if queryset.model is Snippet:
+                queryset = queryset.filter(template__name=params['template'])
+            elif params['template'] != 'default':
+                queryset = queryset.none()
+        if params['since']:
+            queryset = queryset.filter(modified__gt=params['since'])
+        if params['publish_after']:
+            queryset = queryset.filter(Q(publish_end__isnull=True) |
+                                       Q(publish_end__gte=params['publish_after']))
+        if params['publish_before']:
+            queryset = queryset.filter(Q(publish_start__isnull=True) |
+                                       Q(publish_start__lte=params['publish_before']))
+        if params['cursor']:
+            modified, cursor_kind, pk = params['cursor']
+            if kind < cursor_kind:
+                queryset = queryset.filter(modified__gt=modified)
+            elif kind == cursor_kind:
+                queryset = queryset.filter(Q(modified__gt=modified) |
+                                           Q(modified=modified, id__gt=pk))
+            else:
+                queryset = queryset.filter(modified__gte=modified)
+        return queryset
+
+    def chunks(self, queryset, chunk_size):
+        """
+        Iterate over the snippets of queryset, ordered by (modified, id),
+        loading them and their relations chunk_size at a time.
+        """
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            for snippet in chunk:
+                yield snippet
+            if len(chunk) < chunk_size:
+                return
+            last = chunk[-1]
+            chunk = list(queryset.filter(Q(modified__gt=last.modified) |
+                                         Q(modified=last.modified, id__gt=last.id))
+                         [:chunk_size])
+
+    def merge(self, querysets, chunk_size):
+        """
+        Merge querysets ordered by (modified, id) into a single iterator
+        of ((modified, kind, id), snippet) tuples in key order.
+        """
+        def keyed(kind, queryset):
+            for snippet in self.chunks(queryset, chunk_size):
+                yield (snippet.modified, kind, snippet.id), snippet
+        return heapq.merge(*[keyed(kind, queryset) for kind, queryset in enumerate(querysets)])
+
+    def stream(self, snippets):
+        """
+        Yield the JSON list of snippets one snippet at a time, so that
+        the response is never held in memory as a whole.
+        """
+        encoder = ActiveSnippetsEncoder()
+        separator = ''
+        yield '['
+        for snippet in snippets:
+            yield separator + encoder.encode(snippet)
+            separator = ','
+        yield ']'
 
 
 @csrf_exempt
 @require_POST
 def csp_violation_capture(request):
-    data = sentry_client.get_data_from_request(request)
-    data.update({
-        'level': logging.INFO,
-        'logger': 'CSP',
-    })
+    """
+    Collect a CSP violation report. Reports are sent to Sentry as
+    periodic summaries by csp_reports.
+    """
     try:
         csp_data = json.loads(request.body)
     except ValueError:
@@ -260,19 +555,48 @@ def csp_violation_capture(request):
 
     try:
         blocked_uri = csp_data['csp-report']['blocked-uri']
-    except KeyError:
+    except (KeyError, TypeError):
         # Incomplete CSP report
         return HttpResponseBadRequest('Incomplete CSP Report')
+    if not isinstance(blocked_uri, basestring):
+        return HttpResponseBadRequest('Invalid CSP Report')
 
-    sentry_client.captureMessage(
-        message='CSP Violation: {}'.format(blocked_uri),
-        data=data)
+    def get_data():
+        data = sentry_client.get_data_from_request(request)
+        data.update({
+            'level': logging.INFO,
+            'logger': 'CSP',
+        })
+        return data
 
+    csp_reports.add(blocked_uri, get_data)
     return HttpResponse('Captured CSP violation, thanks for reporting.')
 
 
-@cache_page(5)
+@staff_member_required
+def cache_stats(request):
+    """
+    Dump the counters, size and most requested keys of every cache
+    layer. The numbers cover the worker serving the request only.
+    """
+    stats = [layer.stats() for layer in cache_layers.values()]
+    return HttpResponse(json.dumps(stats), content_type='application/json')
+
+
 def healthz(request):
-    """For use with Healthchecks. Wrapped with cache_page to test cache."""
-    assert Snippet.objects.exists(), 'No snippets exist'
+    """
+    Liveness check: the worker is up and serving requests. Touches no
+    dependencies, see readyz for those.
+    """
     return HttpResponse('OK')
+
+
+def readyz(request):
+    """
+    Readiness check, reporting the status and latency of the database,
+    cache and storage as last checked by the worker. Responds with 503
+    when the worker can't serve snippets.
+    """
+    report = readiness()
+    return HttpResponse(json.dumps(report), status=200 if report['ready'] else 503,
+                        content_type='application/json')
@@ -0,0 +1,62 @@
+import time
+
+from django.core.cache import caches
+from django.db import connections
+
+from django_statsd.clients import statsd
+
+from snippets.base import LANGUAGE_VALUES
+from snippets.base.models import (JINJA_ENV, ClientMatchRule, JSONSnippet, Snippet,
+                                  SnippetTemplate)
+from snippets.base.releases import release_info
+
+
+# Templates used to render bundles and previews, including the files
+# they include, which jinja only compiles when the include is rendered.
+BUNDLE_TEMPLATES = (
+    'base/fetch_snippets.jinja',
+    'base/fetch_snippets_as.jinja',
+    'base/preview.jinja',
+    'base/preview_without_shell.jinja',
+    'base/includes/snippet.css',
+    'base/includes/snippet.js',
+    'base/includes/snippet_as.css',
+    'base/includes/snippet_as.js',
+)
+
+
+def warm_up():
+    """
+    Load everything the fetch views need before serving the first
+    request and return the time it took in seconds.
+
+    Meant to run from the gunicorn hooks in snippets/wsgi/config.py. Any
+    database or cache connections opened here are closed at the end so
+    that they are never shared between forked workers.
+    """
+    start = time.time()
+    try:
+        # Parse product details JSON and derive the release information.
+        release_info.version_choices
+        list(LANGUAGE_VALUES)
+
+        # Compile bundle templates into the jinja environment cache.
+        for name in BUNDLE_TEMPLATES:
+            JINJA_ENV.env.get_template(name)
+
+        # Compile snippet templates into the snippet template cache.
+        for template in SnippetTemplate.cached_objects.all():
+            template.compile()
+
+        # Populate cache-machine with the querysets used for matching.
+        list(Snippet.cached_objects.filter(disabled=False))
+        list(JSONSnippet.cached_objects.filter(disabled=False))
+        list(ClientMatchRule.cached_objects.all())
+    finally:
+        connections.close_all()
+        for cache in caches.all():
+            cache.close()
+
+    duration = time.time() - start
+    statsd.timing('warmup', int(duration * 1000))
+    return duration
@@ -267,6 +267,46 @@ if DEFAULT_FILE_STORAGE == 'snippets.base.storage.S3Storage':
 DEAD_MANS_SNITCH_URL = config('DEAD_MANS_SNITCH_URL', default=None)
 
 SNIPPET_HTTP_MAX_AGE = config('SNIPPET_HTTP_MAX_AGE', default=90)
+SNIPPET_JSON_RESPONSE_CACHE_SIZE = config('SNIPPET_JSON_RESPONSE_CACHE_SIZE', default=500,
+                                          cast=int)
+SNIPPET_JSON_FRAGMENT_CACHE_SIZE = config('SNIPPET_JSON_FRAGMENT_CACHE_SIZE', default=1000,
+                                          cast=int)
+SNIPPET_RENDER_CACHE_SIZE = config('SNIPPET_RENDER_CACHE_SIZE', default=1000, cast=int)
+SNIPPET_PREVIEW_CACHE_SIZE = config('SNIPPET_PREVIEW_CACHE_SIZE', default=200, cast=int)
+# Serve the snippet runtime as a static file under MEDIA_BUNDLES_ROOT
+# instead of inlining it in bundles. about:home ignores script tags with
+# a src, so bundles fetch the runtime with XMLHttpRequest and run it
+# asynchronously once the request completes, after the rest of the
+# bundle. If the request fails, e.g. offline with a cached bundle, no
+# snippet is shown and a runtime-load-failed metric is sent. The media
+# host must allow that request with CORS headers, and the page's CSP
+# must allow connecting to it.
+SNIPPET_EXTERNAL_RUNTIME = config('SNIPPET_EXTERNAL_RUNTIME', default=False, cast=bool)
+SNIPPET_EXTRACT_IMAGES = config('SNIPPET_EXTRACT_IMAGES', default=False, cast=bool)
+SNIPPET_DEDUPLICATE_MARKUP = config('SNIPPET_DEDUPLICATE_MARKUP', default=False, cast=bool)
+# Split bundles into this many variants, each holding a weighted sample
+# of SNIPPET_BUNDLE_VARIANT_SIZE of the snippets that every client can be
+# shown. Snippets with countries, excluded search providers, a campaign
+# or client_options are in every variant. Disabled if lower than 2 or if
+# there aren't more snippets to sample than that. Samples change every
+# SNIPPET_BUNDLE_TIMEOUT through SNIPPET_BUNDLE_VARIANT_ROUNDS rounds.
+SNIPPET_BUNDLE_VARIANTS = config('SNIPPET_BUNDLE_VARIANTS', default=0, cast=int)
+SNIPPET_BUNDLE_VARIANT_SIZE = config('SNIPPET_BUNDLE_VARIANT_SIZE', default=10, cast=int)
+SNIPPET_BUNDLE_VARIANT_ROUNDS = config('SNIPPET_BUNDLE_VARIANT_ROUNDS', default=8, cast=int)
+SNIPPET_MINIFY = config('SNIPPET_MINIFY', default=False, cast=bool)
+SNIPPET_FAST_FETCH = config('SNIPPET_FAST_FETCH', default=False, cast=bool)
+SNIPPET_FAST_FETCH_SNAPSHOT_SIZE = config('SNIPPET_FAST_FETCH_SNAPSHOT_SIZE', default=100,
+                                          cast=int)
+SNIPPET_HEALTH_REFRESH_INTERVAL = config('SNIPPET_HEALTH_REFRESH_INTERVAL', default=10, cast=int)
+SNIPPET_CSP_FLUSH_INTERVAL = config('SNIPPET_CSP_FLUSH_INTERVAL', default=60, cast=int)
+SNIPPET_CSP_MESSAGES_PER_FLUSH = config('SNIPPET_CSP_MESSAGES_PER_FLUSH', default=20, cast=int)
+SNIPPET_CSP_MAX_BLOCKED_URIS = config('SNIPPET_CSP_MAX_BLOCKED_URIS', default=1000, cast=int)
+SNIPPET_BATCH_FETCH_MAX_CLIENTS = config('SNIPPET_BATCH_FETCH_MAX_CLIENTS', default=100,
+                                         cast=int)
+# Shared secret callers of the batch fetch endpoint send as a bearer
+# token. The endpoint is disabled when it's not set.
+SNIPPET_BATCH_FETCH_TOKEN = config('SNIPPET_BATCH_FETCH_TOKEN', default=None)
+ACTIVE_SNIPPETS_MAX_LIMIT = config('ACTIVE_SNIPPETS_MAX_LIMIT', default=1000, cast=int)
 SNIPPETS_PER_PAGE = config('SNIPPETS_PER_PAGE', default=50)
 
 ENGAGE_ROBOTS = config('ENGAGE_ROBOTS', default=False)
@@ -32,3 +32,8 @@ newrelic_license_key = config('NEW_RELIC_LICENSE_KEY', default=None)
 if newrelic_ini and newrelic_license_key:
     newrelic.agent.initialize(newrelic_ini)
     application = newrelic.agent.wsgi_application()(application)
+
+# Serve fetch requests in front of the Django stack.
+if settings.SNIPPET_FAST_FETCH:
+    from snippets.wsgi.fetch import FetchApplication  # NOQA
+    application = FetchApplication(application)
@@ -12,3 +12,33 @@ loglevel = getenv('WSGI_LOG_LEVEL', 'info')
 # See https://github.com/benoitc/gunicorn/issues/1194
 keepalive = getenv('WSGI_KEEP_ALIVE', 2)
 worker_class = getenv('GUNICORN_WORKER_CLASS', "meinheld.gmeinheld.MeinheldWorker")
+
+# Optionally load the application in the master so that the warm-up
+# below runs once and workers share its results copy-on-write. Off by
+# default: the master then initializes NewRelic and Sentry and may start
+# the threads of the CSP report aggregator and the health checks, and
+# workers only inherit those threads' state, not the threads themselves.
+preload_app = getenv('WSGI_PRELOAD_APP', 'false').lower() == 'true'
+
+
+def when_ready(server):
+    if preload_app:
+        _warm_up(server.log)
+
+
+def post_worker_init(worker):
+    # Without preload_app every worker loads the application itself and
+    # has to warm up before accepting requests.
+    if not preload_app:
+        _warm_up(worker.log)
+
+
+def _warm_up(log):
+    from snippets.base.warmup import warm_up
+
+    try:
+        duration = warm_up()
+    except Exception:
+        log.exception('Warm-up failed, starting cold.')
+    else:
+        log.info('Warm-up finished in %.3f seconds.', duration)
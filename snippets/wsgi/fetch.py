@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.handlers.wsgi import get_path_info
+from django.utils.http import parse_etags
+
+from django_statsd.clients import statsd
+
+from snippets.base.cache import InstrumentedLRUCache
+from snippets.base.middleware import parse_fetch_path
+from snippets.base.views import client_etag
+
+
+# Response headers left out of 304 responses.
+ENTITY_HEADERS = ('content-length', 'content-type')
+
+
+class FetchApplication(object):
+    """
+    WSGI application serving the fetch URLs in front of the Django
+    application.
+
+    Responses for fetch URLs are kept in a per-worker snapshot keyed by
+    the client validator (see client_etag), so entries go stale as soon
+    as targeting data changes or the bundle timeout passes. Clients in
+    the snapshot are answered with its precomputed status, headers and
+    body without going through any of the middleware, WSGI wrappers or
+    decorators of the Django stack. Everything else, including the first
+    request for each client, is passed on to the wrapped application and
+    successful fetch responses are stored on the way out.
+    """
+    def __init__(self, application, size=None):
+        self.application = application
+        self.snapshot = InstrumentedLRUCache(size or settings.SNIPPET_FAST_FETCH_SNAPSHOT_SIZE,
+                                             'fetch-snapshot')
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        fetch = None
+        if method in ('GET', 'HEAD'):
+            # Decode the path like Django does for request.path_info.
+            try:
+                path = get_path_info(environ)
+            except UnicodeDecodeError:
+                start_response('404 Not Found', [('Content-Type', 'text/plain')])
+                return ['Not Found']
+            fetch = parse_fetch_path(path)
+        if fetch is None:
+            return self.application(environ, start_response)
+
+        is_json, client = fetch
+        if is_json:
+            kind = 'json'
+        else:
+            kind = 'bundle' if settings.SERVE_SNIPPET_BUNDLES else 'render'
+        etag = client_etag(kind, client)
+
+        entry = self.snapshot.get(etag)
+        if entry is None:
+            if method != 'GET':
+                return self.application(environ, start_response)
+            entry = self.capture(environ)
+            if not self.storable(entry):
+                status, headers, body = entry
+                start_response(status, headers)
+                return [body]
+            self.snapshot[etag] = entry
+        else:
+            statsd.incr('serve.json_snippets' if is_json else 'serve.snippets')
+
+        status, headers, body = entry
+        if self.not_modified(environ, etag):
+            start_response('304 Not Modified',
+                           [(name, value) for name, value in headers
+                            if name.lower() not in ENTITY_HEADERS])
+            return []
+
+        start_response(status, headers)
+        return [body] if method == 'GET' else []
+
+    def capture(self, environ):
+        """
+        Run the wrapped application and return the (status, headers,
+        body) of its response.
+        """
+        response = {}
+        body = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return body.append
+
+        result = self.application(environ, start_response)
+        try:
+            for chunk in result:
+                body.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], ''.join(body)
+
+    def storable(self, entry):
+        status, headers, body = entry
+        return (status[:3] in ('200', '302') and
+                not any(name.lower() == 'set-cookie' for name, value in headers))
+
+    def not_modified(self, environ, etag):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match:
+            return False
+        try:
+            etags = parse_etags(if_none_match)
+        except ValueError:
+            return False
+        return etag in etags or '*' in etags